@@ -0,0 +1,4 @@
+"""Benchmarks for the REST v4 client, run against the local stub server.
+
+    python -m benchmarks --records 2000 --latency 0.002
+"""
@@ -0,0 +1,63 @@
+from __future__ import print_function
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from sugarcrm.stubserver import StubServer
+
+from .workloads import WORKLOADS, Workload
+
+
+def measure(func, ctx, repeat):
+    """Run func `repeat` times, return (round-trips, wire bytes, decoded bytes,
+    best seconds, peak bytes).
+    """
+    server = ctx.server
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        server.reset_stats()
+        start = time.perf_counter()
+        func(ctx)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    round_trips, received, decoded = server.round_trips, server.bytes_out, server.bytes_out_decoded
+
+    gc.collect()
+    tracemalloc.start()
+    func(ctx)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return round_trips, received, decoded, best, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=500,
+                        help='records per module')
+    parser.add_argument('--extra-fields', type=int, default=150,
+                        help='filler fields per module')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='server latency per request in seconds')
+    parser.add_argument('--no-compression', action='store_true',
+                        help="don't gzip server responses")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('workloads', nargs='*', default=list(WORKLOADS))
+    args = parser.parse_args(argv)
+
+    with StubServer(records=args.records, extra_fields=args.extra_fields,
+                    latency=args.latency, compression=not args.no_compression) as server:
+        ctx = Workload(server, server.connect())
+        print('%-20s %8s %12s %12s %10s %10s' % ('workload', 'calls', 'wire bytes',
+                                                 'json bytes', 'ms', 'peak KiB'))
+        for name in args.workloads:
+            round_trips, received, decoded, best, peak = measure(WORKLOADS[name], ctx,
+                                                                 args.repeat)
+            print('%-20s %8d %12d %12d %10.2f %10.1f' % (name, round_trips, received, decoded,
+                                                        best * 1000, peak / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
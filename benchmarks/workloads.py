@@ -0,0 +1,123 @@
+"""Typical QueryList / SugarEntry workloads.
+
+Each workload is a callable taking a `Workload` context and returning
+nothing; the runner measures round-trips, wall time, response bytes and
+peak memory around it.
+"""
+from collections import OrderedDict
+
+from sugarcrm import Account, Contact, Report, Task
+
+WORKLOADS = OrderedDict()
+
+
+def workload(func):
+    WORKLOADS[func.__name__] = func
+    return func
+
+
+class Workload:
+    """State shared by the workloads of a single run."""
+
+    def __init__(self, server, connection):
+        self.server = server
+        self.connection = connection
+        accounts = server.dataset.records['Accounts']
+        # Queries reading every record ask for them all: without a size,
+        # servers return list_max_entries_per_page entries only.
+        self.records = len(accounts)
+        self.account_id = next(iter(accounts))
+        self.account_name = accounts[self.account_id]['name']
+
+
+@workload
+def model_init(ctx):
+    Account(ctx.connection)
+
+
+@workload
+def list_all(ctx):
+    queryset = Account(ctx.connection).objects.all()
+    queryset.set_limits(0, ctx.records)
+    len(queryset)
+
+
+@workload
+def list_page(ctx):
+    list(Account(ctx.connection).objects.order_by('name')[0:20])
+
+
+@workload
+def list_only(ctx):
+    queryset = Account(ctx.connection).objects.only('id', 'name')
+    queryset.set_limits(0, ctx.records)
+    len(queryset)
+
+
+@workload
+def filter_startswith(ctx):
+    queryset = Contact(ctx.connection).objects.filter(name__startswith='Contact 1')
+    queryset.set_limits(0, ctx.records)
+    len(queryset)
+
+
+@workload
+def get_by_id(ctx):
+    Account(ctx.connection).objects.get(id=ctx.account_id)
+
+
+@workload
+def count(ctx):
+    Account(ctx.connection).objects.filter(name__contains='1').count()
+
+
+@workload
+def index_loop(ctx):
+    qs = Account(ctx.connection).objects.order_by('name')
+    for i in range(10):
+        qs[i]
+
+
+@workload
+def lazy_field_access(ctx):
+    for entry in Account(ctx.connection).objects.only('id')[0:10]:
+        entry['name']
+
+
+@workload
+def get_related(ctx):
+    account = Account(ctx.connection).objects.only('id').get(id=ctx.account_id)
+    account.get_related('Contacts', fields=['id', 'name'])
+
+
+@workload
+def create(ctx):
+    task = Task(ctx.connection, name='benchmark task')
+    task.save()
+
+
+@workload
+def update(ctx):
+    account = Account(ctx.connection).objects.get(id=ctx.account_id)
+    account['description'] = 'updated'
+    account.save()
+
+
+@workload
+def export_iterator(ctx):
+    queryset = Account(ctx.connection).objects.all()
+    queryset.set_limits(0, ctx.records)
+    for entry in queryset.iterator():
+        entry['name']
+
+
+@workload
+def global_search(ctx):
+    ctx.connection.search('Account 1', fields=['id', 'name'])
+
+
+@workload
+def report_dashboard(ctx):
+    report = Report(ctx.connection).objects.only('id')[0]
+    for i in range(5):
+        report.execute()['amount'].sum()
@@ -1,5 +1,6 @@
 from .sugarcrm import *
 from .sugarentry import *
 from .rest_framework import *
+from .aggregates import Sum, Count, Avg, Min, Max
 
 __version__ = "0.0.1"
@@ -0,0 +1,310 @@
+"""Client-side aggregation of QueryList results.
+
+The REST API has neither aggregates nor GROUP BY, so QueryList.aggregate()
+and QueryList.values(...).annotate(...) fetch only the fields they need,
+one page at a time, and reduce each page into running totals per group:
+
+    Opportunity().objects.aggregate(Sum('amount'), Count('id'))
+    Opportunity().objects.values('sales_stage').annotate(total=Sum('amount'))
+
+Pages are converted into float columns and reduced with NumPy when it is
+installed, with plain Python loops otherwise; memory use is bounded by the
+page size whatever the number of entries. Counts of whole groups are taken
+from get_entries_count when the group field is an enum.
+"""
+from .executor import ThreadPoolExecutor
+from .settings import AGGREGATE_PAGE_SIZE
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NAN = float('nan')
+
+# Field types whose values are compared as numbers by Min and Max.
+NUMERIC_TYPES = ('int', 'integer', 'currency', 'decimal', 'float', 'double', 'long')
+
+
+def _is_empty(value):
+    return value in ('', None)
+
+
+def _to_float(value):
+    try:
+        return NAN if _is_empty(value) else float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+def _floats(values):
+    """Column of floats, NaN for empty and non numeric values."""
+    if numpy is None:
+        return [_to_float(v) for v in values]
+    try:
+        return numpy.array(values, dtype=numpy.float64)
+    except (TypeError, ValueError):
+        return numpy.array([_to_float(v) for v in values], dtype=numpy.float64)
+
+
+class Aggregate:
+    """Reduction of a field over the entries of a group.
+
+    The state of a group is a (value, number of values) pair.
+    """
+
+    name = None
+
+    # Whether values are converted to floats before being reduced.
+    numeric = True
+
+    def __init__(self, field):
+        self.field = field
+
+    def __repr__(self):
+        return "%s('%s')" % (type(self).__name__, self.field)
+
+    @property
+    def default_alias(self):
+        return '%s__%s' % (self.field, self.name)
+
+    def is_numeric(self, model):
+        return self.numeric
+
+    def empty(self):
+        return (None, 0)
+
+    def reduce(self, values, groups, num_groups):
+        """Return the states of num_groups groups from a page of values,
+        groups giving the group number of each value.
+        """
+        states = [self.empty() for _ in range(num_groups)]
+        for value, group in zip(values, groups):
+            if value is None or value != value or value == '':
+                continue
+            states[group] = self.merge(states[group], (value, 1))
+        return states
+
+    def merge(self, state, other):
+        raise NotImplementedError
+
+    def result(self, state):
+        return state[0] if state[1] else None
+
+
+class Sum(Aggregate):
+    name = 'sum'
+
+    def empty(self):
+        return (0.0, 0)
+
+    def reduce(self, values, groups, num_groups):
+        if numpy is None:
+            return super().reduce(values, groups, num_groups)
+        valid = ~numpy.isnan(values)
+        sums = numpy.bincount(groups[valid], weights=values[valid], minlength=num_groups)
+        counts = numpy.bincount(groups[valid], minlength=num_groups)
+        return list(zip(sums.tolist(), counts.tolist()))
+
+    def merge(self, state, other):
+        return (state[0] + other[0], state[1] + other[1])
+
+
+class Avg(Sum):
+    name = 'avg'
+
+    def result(self, state):
+        return state[0] / state[1] if state[1] else None
+
+
+class Count(Aggregate):
+    name = 'count'
+    numeric = False
+
+    def empty(self):
+        return (0, 0)
+
+    def reduce(self, values, groups, num_groups):
+        if numpy is None:
+            return super().reduce(values, groups, num_groups)
+        present = numpy.fromiter((not _is_empty(v) for v in values), dtype=bool,
+                                 count=len(values))
+        counts = numpy.bincount(groups[present], minlength=num_groups)
+        return [(c, c) for c in counts.tolist()]
+
+    def merge(self, state, other):
+        return (state[0] + other[1], state[1] + other[1])
+
+    def result(self, state):
+        return state[1]
+
+    def counts_rows(self):
+        """Whether every entry has a value, e.g. Count('id')."""
+        return self.field in ('id', 'pk')
+
+
+class _Extremum(Aggregate):
+    # Values of non numeric fields, such as dates, are compared as strings.
+
+    def is_numeric(self, model):
+        field = model._available_fields.get(self.field) or {}
+        return field.get('type') in NUMERIC_TYPES
+
+    def reduce(self, values, groups, num_groups):
+        if numpy is None or values.dtype != numpy.float64:
+            return super().reduce(values, groups, num_groups)
+        valid = ~numpy.isnan(values)
+        out = numpy.full(num_groups, self._identity)
+        self._ufunc.at(out, groups[valid], values[valid])
+        counts = numpy.bincount(groups[valid], minlength=num_groups)
+        return list(zip(out.tolist(), counts.tolist()))
+
+
+class Min(_Extremum):
+    name = 'min'
+    _identity = float('inf')
+    _ufunc = numpy.fmin if numpy is not None else None
+
+    def merge(self, state, other):
+        if not other[1]:
+            return state
+        if not state[1]:
+            return other
+        return (min(state[0], other[0]), state[1] + other[1])
+
+
+class Max(_Extremum):
+    name = 'max'
+    _identity = float('-inf')
+    _ufunc = numpy.fmax if numpy is not None else None
+
+    def merge(self, state, other):
+        if not other[1]:
+            return state
+        if not state[1]:
+            return other
+        return (max(state[0], other[0]), state[1] + other[1])
+
+
+def _iter_pages(queryset, fields, page_size):
+    """Yield the values of fields of the entries of queryset, as lists of
+    rows of at most page_size entries.
+    """
+    model = queryset.model
+    replica = queryset._replica()
+    if replica is not None:
+        rows = ([entry._fields.get(f, '') for f in fields] for entry in
+                replica.search(model, queryset._lookups, '', queryset._offset,
+                               queryset._limit, fields))
+        page = []
+        for row in rows:
+            page.append(row)
+            if len(page) == page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+        return
+
+    offset = int(queryset._offset or 0)
+    remaining = int(queryset._limit) if queryset._limit else None
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        # Pages of an unordered query may overlap.
+        page = [[(record['name_value_list'].get(f) or {}).get('value', '') for f in fields]
+                for record in model._connection.iter_entry_list(
+                    model.module_name, queryset._query, '%s.id' % model._table, offset, fields,
+                    [], size, 0)]
+        if page:
+            yield page
+        if len(page) < size:
+            return
+        offset += len(page)
+        if remaining is not None:
+            remaining -= len(page)
+
+
+def _field(aggregate):
+    return 'id' if aggregate.field == 'pk' else aggregate.field
+
+
+def _columns(page, num_fields):
+    return [[row[i] for row in page] for i in range(num_fields)]
+
+
+def _group_numbers(keys, index):
+    """Map the group keys of a page to group numbers, adding new keys to
+    index; return the numbers as an array.
+    """
+    numbers = [index.setdefault(key, len(index)) for key in keys]
+    if numpy is None:
+        return numbers
+    return numpy.array(numbers, dtype=numpy.intp)
+
+
+def compute(queryset, group_by, aggregates, page_size=AGGREGATE_PAGE_SIZE):
+    """Return {group key tuple: {alias: value}} for queryset's entries.
+
+    Keyword arguments:
+    queryset -- QueryList whose entries are aggregated
+    group_by -- fields whose values form the groups; no fields make a
+                single () group
+    aggregates -- dict alias -> Aggregate
+    """
+    model = queryset.model
+    group_by = list(group_by)
+    fields = list(group_by)
+    for aggregate in aggregates.values():
+        if _field(aggregate) not in fields:
+            fields.append(_field(aggregate))
+    if not fields:
+        fields = ['id']
+    positions = dict((f, i) for i, f in enumerate(fields))
+    numeric = dict((alias, a.is_numeric(model)) for alias, a in aggregates.items())
+
+    index = {}
+    states = {}
+    for page in _iter_pages(queryset, fields, page_size):
+        columns = _columns(page, len(fields))
+        keys = list(zip(*[columns[positions[f]] for f in group_by])) if group_by else \
+            [()] * len(page)
+        groups = _group_numbers(keys, index)
+        for alias, aggregate in aggregates.items():
+            values = columns[positions[_field(aggregate)]]
+            if numeric[alias]:
+                values = _floats(values)
+            elif numpy is not None:
+                values = numpy.array(values, dtype=object)
+            page_states = aggregate.reduce(values, groups, len(index))
+            group_states = states.setdefault(alias, [])
+            group_states.extend(aggregate.empty() for _ in range(len(index) - len(group_states)))
+            for group, state in enumerate(page_states):
+                group_states[group] = aggregate.merge(group_states[group], state)
+
+    if not group_by and not index:
+        index[()] = 0
+    results = {}
+    for key, group in index.items():
+        results[key] = dict(
+            (alias, aggregate.result(states[alias][group] if alias in states and
+                                     group < len(states[alias]) else aggregate.empty()))
+            for alias, aggregate in aggregates.items())
+    return results
+
+
+def count_groups(queryset, field, max_workers=4):
+    """Return {(option,): number of entries} using one get_entries_count per
+    option of the enum field, or None when the field isn't an enum or entries
+    have values outside of its options.
+    """
+    meta = queryset.model._available_fields.get(field) or {}
+    options = list(meta.get('options') or ()) if meta.get('type') in ('enum', 'radioenum') else []
+    if not options or queryset._limit or queryset._offset:
+        return None
+    entries = queryset._chain(_values=None, _annotations=None)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        total = executor.submit(entries.count)
+        counts = list(executor.map(lambda o: entries.filter(**{field: o}).count(), options))
+    if sum(counts) != total.result():
+        return None
+    return dict(((option,), count) for option, count in zip(options, counts) if count)
@@ -0,0 +1,166 @@
+"""Bulk operations packing many records into few API calls."""
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import six
+
+from .executor import ThreadPoolExecutor
+
+
+class BulkRelateResult:
+    """Outcome of bulk_relate().
+
+    created, deleted -- number of (parent, link) groups linked or unlinked
+    failed -- the (parent, child, link_name) triples which failed
+    calls -- number of set_relationships calls made
+    """
+
+    def __init__(self):
+        self.created = 0
+        self.deleted = 0
+        self.failed = []
+        self.calls = 0
+
+    def __repr__(self):
+        return '<BulkRelateResult created=%d deleted=%d failed=%d calls=%d>' % (
+            self.created, self.deleted, len(self.failed), self.calls)
+
+
+def _record(obj):
+    """Return (module_name, id) for an entry or a (module_name, id) pair,
+    given as a tuple or a list (e.g. decoded from JSON).
+    """
+    if isinstance(obj, (tuple, list)):
+        module_name, record_id = obj
+        return module_name, record_id
+    return obj.module_name, obj['id']
+
+
+def _pack(links):
+    """Group (parent, child, link_name) triples into set_relationships
+    elements: dicts with module, id, link, related ids and name_value_list.
+    """
+    groups = OrderedDict()
+    for link in links:
+        parent, child, link_name = link if len(link) == 3 else tuple(link) + (None,)
+        module_name, parent_id = _record(parent)
+        if link_name is None:
+            # Same default as Sugarcrm.relate().
+            link_name = child._table
+        child_id = child if isinstance(child, six.string_types) else _record(child)[1]
+        groups.setdefault((module_name, parent_id, link_name), []).append((child_id, link))
+
+    elements = []
+    for (module_name, parent_id, link_name), children in groups.items():
+        if module_name == 'ProductBundles':
+            # Required for Sugar Bug 32064: one product_index per product.
+            for i, child in enumerate(children):
+                elements.append({'module': module_name, 'id': parent_id, 'link': link_name,
+                                 'children': [child],
+                                 'name_value_list': [{'name': 'product_index',
+                                                      'value': '%d' % (i + 1)}]})
+        else:
+            elements.append({'module': module_name, 'id': parent_id, 'link': link_name,
+                             'children': children, 'name_value_list': []})
+    return elements
+
+
+def _apply(connection, elements, delete):
+    """Send elements in one set_relationships call, narrowing down failures
+    by splitting the call until the failed pairs are isolated.
+    """
+    response = connection.set_relationships(
+        [e['module'] for e in elements],
+        [e['id'] for e in elements],
+        [e['link'] for e in elements],
+        [[child_id for child_id, _ in e['children']] for e in elements],
+        [e['name_value_list'] for e in elements],
+        [1 if delete else 0] * len(elements)) or {}
+    calls = 1
+    if not int(response.get('failed') or 0):
+        return calls, int(response.get('created') or 0), int(response.get('deleted') or 0), []
+
+    if len(elements) == 1 and len(elements[0]['children']) == 1:
+        return calls, 0, 0, [elements[0]['children'][0][1]]
+
+    if len(elements) == 1:
+        element = elements[0]
+        halves = [[dict(element, children=element['children'][:len(element['children']) // 2])],
+                  [dict(element, children=element['children'][len(element['children']) // 2:])]]
+    else:
+        halves = [elements[:len(elements) // 2], elements[len(elements) // 2:]]
+    created = deleted = 0
+    failed = []
+    for half in halves:
+        half_calls, half_created, half_deleted, half_failed = _apply(connection, half, delete)
+        calls += half_calls
+        created += half_created
+        deleted += half_deleted
+        failed.extend(half_failed)
+    return calls, created, deleted, failed
+
+
+def bulk_relate(connection, links, delete=False, chunk_size=100, max_workers=4):
+    """Link or unlink many (parent, child, link_name) triples.
+
+    Keyword arguments:
+    connection -- Sugarcrm connection
+    links -- iterable of (parent, child, link_name) triples. Parents are
+             entries or (module_name, id) pairs, children entries or ids.
+             link_name defaults to the child's table name, like relate().
+    delete -- unlink instead of link
+    chunk_size -- maximum number of (parent, link) groups per call
+    max_workers -- number of concurrent calls
+
+    Returns a BulkRelateResult listing the triples which failed.
+    """
+    elements = _pack(links)
+    chunks = [elements[i:i + chunk_size] for i in range(0, len(elements), chunk_size)]
+    result = BulkRelateResult()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for calls, created, deleted, failed in executor.map(
+                lambda chunk: _apply(connection, chunk, delete), chunks):
+            result.calls += calls
+            result.created += created
+            result.deleted += deleted
+            result.failed.extend(failed)
+    return result
+
+
+def bulk_update(connection, module_name, ids, values, chunk_size=100, max_workers=4):
+    """Set the same values on many records with concurrent set_entries calls.
+
+    Keyword arguments:
+    connection -- Sugarcrm connection
+    module_name -- module of the records
+    ids -- iterable of record ids, consumed while the first calls run
+    values -- dict field -> value
+    chunk_size -- records per call
+    max_workers -- number of concurrent calls
+
+    Returns the number of records updated.
+    """
+    values = [{'name': field, 'value': value} for field, value in values.items()]
+
+    def update(chunk):
+        result = connection.set_entries(module_name,
+                                        [[{'name': 'id', 'value': i}] + values for i in chunk])
+        return len((result or {}).get('ids') or ())
+
+    updated = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        chunk = []
+        for record_id in ids:
+            chunk.append(record_id)
+            if len(chunk) == chunk_size:
+                pending.add(executor.submit(update, chunk))
+                chunk = []
+            if len(pending) >= 2 * max_workers:
+                # Don't read ids much faster than they are written.
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                updated += sum(future.result() for future in done)
+        if chunk:
+            pending.add(executor.submit(update, chunk))
+        updated += sum(future.result() for future in pending)
+    return updated
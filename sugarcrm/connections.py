@@ -0,0 +1,162 @@
+"""Registry of connections to several SugarCRM instances.
+
+Each alias of SUGAR_CRM_CONNECTIONS (or of register_connection()) is
+logged in on first use, then its Sugarcrm object is reused by every
+request, so a tenant isn't logged in again for each SugarEntry:
+
+    SUGAR_CRM_CONNECTIONS = {
+        'tenant_x': {'URL': 'https://x.example.com/service/v4_1/rest.php',
+                     'USERNAME': 'api', 'PASSWORD': '...',
+                     'WEBHOOK_SECRET': '...'},
+    }
+
+    Account(using='tenant_x').objects.filter(name__startswith='A')
+    Account().objects.using('tenant_x').count()
+
+At most SUGAR_CRM_MAX_CONNECTIONS connections stay open; the least
+recently used one is logged out beyond that, and connections unused for
+SUGAR_CRM_CONNECTION_IDLE_TIMEOUT seconds are logged out too. Logged out
+aliases log in again when they are used next, also by the entries and
+querysets still holding their closed connection: its calls go to the
+alias' current connection.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from .sugarcrm import Sugarcrm
+from .sugarerror import SugarError
+from .settings import (API_URL, USERNAME, PASSWORD, CONNECTIONS, MAX_CONNECTIONS,
+                       CONNECTION_IDLE_TIMEOUT, WEBHOOK_SECRET)
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CONNECTION_ALIAS = 'default'
+
+
+class ConnectionHandler:
+    """Lazily created, LRU evicted Sugarcrm connections by alias."""
+
+    def __init__(self, configs=None, max_connections=MAX_CONNECTIONS,
+                 idle_timeout=CONNECTION_IDLE_TIMEOUT):
+        self._configs = dict(configs or {})
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        # alias -> (connection, time of last use), least recently used first.
+        self._connections = OrderedDict()
+        self._lock = threading.Lock()
+        # Serializes the logins of each alias without blocking other aliases.
+        self._login_locks = defaultdict(threading.Lock)
+
+    def configure(self, alias, url, username, password, webhook_secret=None, **options):
+        """Register (or replace) the instance reached through alias.
+
+        Keyword arguments:
+        alias -- name used by get_connection(using=alias), SugarEntry(using=alias)
+                 and QueryList.using(alias)
+        url, username, password -- as for Sugarcrm
+        webhook_secret -- secret of the logic hooks posting to hooks/<alias>/,
+                          SUGAR_CRM_WEBHOOK_SECRET by default
+        options -- other Sugarcrm keyword arguments
+        """
+        with self._lock:
+            self._configs[alias] = {'URL': url, 'USERNAME': username, 'PASSWORD': password,
+                                    'WEBHOOK_SECRET': webhook_secret, 'OPTIONS': options}
+            replaced = self._connections.pop(alias, None)
+        if replaced is not None:
+            self._logout(alias, replaced[0])
+
+    def __contains__(self, alias):
+        return alias in self._configs
+
+    def __getitem__(self, alias):
+        connection = self.get_open(alias)
+        if connection is not None:
+            return connection
+        config = self._configs.get(alias)
+        if not config or not (config['URL'] and config['USERNAME'] and config['PASSWORD']):
+            raise SugarError({'name': 'Empty connection settings',
+                              'description': "Empty connection settings for '%s'" % alias,
+                              'number': 10})
+        with self._login_locks[alias]:
+            # Another thread may have logged in while this one waited.
+            connection = self.get_open(alias)
+            if connection is None:
+                connection = Sugarcrm(config['URL'], config['USERNAME'], config['PASSWORD'],
+                                      **config.get('OPTIONS') or {})
+                with self._lock:
+                    self._connections[alias] = (connection, time.time())
+                self._evict()
+        return connection
+
+    def get_url(self, alias):
+        """Return the URL configured for alias, or None."""
+        config = self._configs.get(alias)
+        return config['URL'] if config else None
+
+    def get_webhook_secret(self, alias):
+        """Return the secret signing the logic hooks of alias: its
+        WEBHOOK_SECRET, or SUGAR_CRM_WEBHOOK_SECRET.
+        """
+        config = self._configs.get(alias) or {}
+        return config.get('WEBHOOK_SECRET') or WEBHOOK_SECRET
+
+    def get_open(self, alias):
+        """Return the logged in connection of alias, or None, without logging in."""
+        self._evict()
+        with self._lock:
+            if alias not in self._connections:
+                return None
+            connection = self._connections[alias][0]
+            self._connections[alias] = (connection, time.time())
+            self._connections.move_to_end(alias)
+            return connection
+
+    def _evict(self):
+        """Log out of the idle connections and of those beyond the cap."""
+        evicted = []
+        with self._lock:
+            deadline = time.time() - self.idle_timeout
+            for alias, (connection, last_used) in list(self._connections.items()):
+                if last_used < deadline or len(self._connections) > self.max_connections:
+                    evicted.append((alias, connection))
+                    del self._connections[alias]
+        for alias, connection in evicted:
+            self._logout(alias, connection)
+
+    def _logout(self, alias, connection):
+        # Entries, querysets and threads still holding the connection make
+        # their calls with the alias' current one, so they log in again
+        # through this registry and its cap.
+        try:
+            connection.close(reopen=lambda: self[alias])
+        except Exception as e:
+            log.warning("Cannot log out of SugarCRM connection '%s': %s", alias, e)
+
+    def close(self, alias=None):
+        """Log out of the connection of alias, or of every connection."""
+        with self._lock:
+            aliases = list(self._connections) if alias is None else [alias]
+            closed = [(a, self._connections.pop(a)[0]) for a in aliases if a in self._connections]
+        for closed_alias, connection in closed:
+            self._logout(closed_alias, connection)
+
+    def __len__(self):
+        return len(self._connections)
+
+
+def _default_configs():
+    configs = dict(CONNECTIONS)
+    if DEFAULT_CONNECTION_ALIAS not in configs:
+        configs[DEFAULT_CONNECTION_ALIAS] = {'URL': API_URL, 'USERNAME': USERNAME,
+                                             'PASSWORD': PASSWORD}
+    return configs
+
+
+connections = ConnectionHandler(_default_configs())
+
+
+def register_connection(alias, url, username, password, **options):
+    """Register a SugarCRM instance at runtime, see ConnectionHandler.configure()."""
+    connections.configure(alias, url, username, password, **options)
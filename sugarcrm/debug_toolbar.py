@@ -0,0 +1,80 @@
+"""django-debug-toolbar panel listing the SugarCRM calls of a request.
+
+Enable it by adding the panel to the toolbar settings:
+
+    DEBUG_TOOLBAR_PANELS = [
+        ...
+        'sugarcrm.debug_toolbar.SugarCRMPanel',
+    ]
+"""
+import contextvars
+
+from debug_toolbar.panels import Panel
+from django.utils.html import format_html, format_html_join
+
+from . import sugarcrm
+
+# Panel of the request being handled. Connections are shared between
+# threads and requests; the thread pools of the package copy the context
+# into their workers, so their calls are tagged with the request too.
+_current_panel = contextvars.ContextVar('sugarcrm_debug_toolbar_panel', default=None)
+
+
+class SugarCRMPanel(Panel):
+    """Panel showing every SugarCRM round-trip made while handling a request."""
+
+    title = 'SugarCRM'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._calls = []
+        self._token = None
+
+    def _listener(self, record):
+        if _current_panel.get() is self:
+            self._calls.append(record)
+
+    def enable_instrumentation(self):
+        self._token = _current_panel.set(self)
+        sugarcrm._call_listeners.append(self._listener)
+
+    def disable_instrumentation(self):
+        if self._listener in sugarcrm._call_listeners:
+            sugarcrm._call_listeners.remove(self._listener)
+        if self._token is not None:
+            try:
+                _current_panel.reset(self._token)
+            except ValueError:
+                # Disabled from another context than the one it was enabled in.
+                pass
+            self._token = None
+
+    def generate_stats(self, request, response):
+        self.record_stats({
+            'calls': [call._asdict() for call in self._calls],
+            'total_time': sum(call.duration for call in self._calls) * 1000,
+            'total_size': sum(call.response_size for call in self._calls),
+        })
+
+    @property
+    def nav_subtitle(self):
+        stats = self.get_stats()
+        return '%d calls in %.2fms' % (len(stats.get('calls', [])), stats.get('total_time', 0))
+
+    @property
+    def content(self):
+        # format_html() escapes its arguments into SafeString before
+        # formatting them, so numbers are formatted beforehand.
+        stats = self.get_stats()
+        rows = format_html_join(
+            '', '<tr><td>{}</td><td>{}</td><td><code>{}</code></td>'
+                '<td>{}</td><td>{}</td></tr>',
+            ((c['method'], c['module'] or '', c['query'] or '',
+              '%.2f' % (c['duration'] * 1000), c['response_size'])
+             for c in stats.get('calls', [])))
+        return format_html(
+            '<table><thead><tr><th>Method</th><th>Module</th><th>Query</th>'
+            '<th>Time (ms)</th><th>Bytes</th></tr></thead><tbody>{}</tbody></table>'
+            '<p>{} calls, {}ms, {} bytes</p>',
+            rows, len(stats.get('calls', [])), '%.2f' % stats.get('total_time', 0),
+            stats.get('total_size', 0))
@@ -0,0 +1,23 @@
+"""Thread pool running its tasks in the context of the submitting thread.
+
+Context variables, such as the request the debug toolbar panel tags calls
+with, aren't inherited by the workers of concurrent.futures executors.
+"""
+import contextvars
+import threading
+from concurrent import futures
+
+
+class ThreadPoolExecutor(futures.ThreadPoolExecutor):
+    """ThreadPoolExecutor whose tasks run in a copy of the caller's context."""
+
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def start_thread(target, *args, **kwargs):
+    """Start a daemon thread running target in a copy of the caller's context."""
+    thread = threading.Thread(
+        target=contextvars.copy_context().run, args=(target,) + args, kwargs=kwargs, daemon=True)
+    thread.start()
+    return thread
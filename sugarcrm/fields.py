@@ -0,0 +1,114 @@
+"""Conversion of field values between the API's strings and Python types.
+
+The REST API sends every value as a string, HTML escaped. With typed
+fields (SugarEntry.typed_fields or SUGAR_CRM_TYPED_FIELDS), entries keep
+the strings they received and convert a field on its first access,
+according to its type in get_module_fields:
+
+    datetime, datetimecombo -- datetime in UTC
+    date -- date
+    int, integer, long -- int
+    decimal, currency -- Decimal
+    float, double -- float
+    bool -- bool
+    enum, radioenum -- EnumValue, a str with the option's label
+    multienum -- list of str
+    other types -- str, HTML unescaped
+
+Empty values of non text fields are None. Values which can't be parsed
+are left as strings. Values set on an entry are converted back to strings
+by to_sugar() when they are set, which is what save() sends.
+"""
+import datetime
+from decimal import Decimal, InvalidOperation
+
+try:
+    from html import unescape as _html_unescape
+except ImportError:
+    from six.moves.html_parser import HTMLParser
+    _html_unescape = HTMLParser().unescape
+
+import six
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+DATE_FORMAT = '%Y-%m-%d'
+
+INT_TYPES = ('int', 'integer', 'long')
+DECIMAL_TYPES = ('decimal', 'currency')
+FLOAT_TYPES = ('float', 'double')
+ENUM_TYPES = ('enum', 'radioenum')
+
+
+def unescape(value):
+    """HTML unescape value; most values have no entity, skip them cheaply."""
+    if isinstance(value, six.string_types) and '&' in value:
+        return _html_unescape(value)
+    return value
+
+
+class EnumValue(str):
+    """Key of an enum option, with the option's label."""
+
+    def __new__(cls, key, label=None):
+        value = super().__new__(cls, key)
+        value.label = key if label is None else label
+        return value
+
+
+def _option_label(meta, key):
+    option = (meta.get('options') or {}).get(key)
+    if isinstance(option, dict):
+        return option.get('value', key)
+    return option
+
+
+def to_python(meta, value):
+    """Convert a value received from the API for a field described by meta."""
+    field_type = meta.get('type')
+    if not isinstance(value, six.string_types):
+        return value
+    if field_type in ENUM_TYPES:
+        return EnumValue(value, _option_label(meta, value))
+    if field_type == 'multienum':
+        return [key for key in (k.strip('^') for k in value.split(',')) if key]
+    if field_type not in INT_TYPES + DECIMAL_TYPES + FLOAT_TYPES + (
+            'bool', 'date', 'datetime', 'datetimecombo'):
+        return unescape(value)
+    if value == '':
+        return None
+    try:
+        if field_type in INT_TYPES:
+            return int(value)
+        if field_type in DECIMAL_TYPES:
+            return Decimal(value)
+        if field_type in FLOAT_TYPES:
+            return float(value)
+        if field_type == 'bool':
+            return value.lower() in ('1', 'true', 'on', 'yes')
+        if field_type == 'date':
+            return datetime.datetime.strptime(value, DATE_FORMAT).date()
+        return datetime.datetime.strptime(value, DATETIME_FORMAT).replace(
+            tzinfo=datetime.timezone.utc)
+    except (ValueError, InvalidOperation):
+        return value
+
+
+def to_sugar(meta, value):
+    """Convert a Python value of a field described by meta to the API's string."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc)
+        if meta.get('type') == 'date':
+            return value.strftime(DATE_FORMAT)
+        return value.strftime(DATETIME_FORMAT)
+    if isinstance(value, datetime.date):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, (list, tuple, set)) and meta.get('type') == 'multienum':
+        return ','.join('^%s^' % key for key in value)
+    if isinstance(value, (int, float, Decimal)):
+        return str(value)
+    return value
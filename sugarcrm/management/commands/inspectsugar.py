@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from sugarcrm.schema import take_snapshot, save_snapshot, generate_classes
+from sugarcrm.settings import SCHEMA_SNAPSHOT
+from sugarcrm.sugarcrm import get_connection
+
+
+class Command(BaseCommand):
+    help = ('Snapshot the SugarCRM module metadata to a file loaded by connections at '
+            'startup, and optionally generate Python entry classes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('modules', nargs='*',
+                            help='Modules to snapshot, all available ones by default.')
+        parser.add_argument('--output', default=SCHEMA_SNAPSHOT or 'sugarcrm_schema.json',
+                            help='Snapshot path, SUGAR_CRM_SCHEMA_SNAPSHOT by default.')
+        parser.add_argument('--using',
+                            help='Alias of the SugarCRM connection to snapshot, '
+                                 'see SUGAR_CRM_CONNECTIONS.')
+        parser.add_argument('--classes',
+                            help='Also write entry classes to this Python file.')
+
+    def handle(self, *args, **options):
+        snapshot = take_snapshot(get_connection(using=options['using']),
+                                 options['modules'] or None)
+        save_snapshot(snapshot, options['output'])
+        self.stdout.write('Wrote %d modules of SugarCRM %s to %s' % (
+            len(snapshot['modules']), snapshot['server_version'].strip(), options['output']))
+        if options['classes']:
+            with open(options['classes'], 'w') as f:
+                f.write(generate_classes(snapshot))
+            self.stdout.write('Wrote entry classes to %s' % options['classes'])
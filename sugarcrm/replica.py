@@ -0,0 +1,310 @@
+"""Local SQLite read replica of SugarCRM modules.
+
+A replica keeps a copy of module records in one table per module, filled
+by sync(). QueryList reads are routed to it with `.using('replica')` or,
+for whole modules, with the SUGAR_CRM_READ_REPLICA_MODULES setting:
+
+    SUGAR_CRM_REPLICAS = {'replica': '/var/lib/app/sugarcrm.sqlite3'}
+    SUGAR_CRM_READ_REPLICA_MODULES = {'Accounts': 'replica'}
+
+A replica copies the records of one connection, 'default' unless given:
+
+    SUGAR_CRM_REPLICAS = {'replica_x': {'PATH': '/var/lib/app/x.sqlite3',
+                                        'CONNECTION': 'tenant_x'}}
+
+Writes (SugarEntry.save()) still go through set_entry on the server.
+"""
+import sqlite3
+import threading
+
+import six
+
+from .connections import DEFAULT_CONNECTION_ALIAS
+from .settings import REPLICAS, READ_REPLICA_MODULES
+
+# Fields indexed in every module table where they exist.
+INDEXED_FIELDS = ('name', 'date_modified', 'assigned_user_id', 'parent_id', 'account_id',
+                  'email1', 'status')
+
+# Field types compared as numbers rather than text.
+NUMERIC_TYPES = ('int', 'integer', 'currency', 'decimal', 'float', 'double', 'long')
+
+_replicas = {}
+_replicas_lock = threading.Lock()
+
+
+def register_replica(alias, replica):
+    """Make a replica available to QueryList.using(alias)."""
+    with _replicas_lock:
+        _replicas[alias] = replica
+
+
+def get_replica(alias):
+    """Return the replica registered or configured under alias, or None."""
+    with _replicas_lock:
+        if alias not in _replicas and alias in REPLICAS:
+            config = REPLICAS[alias]
+            if isinstance(config, six.string_types):
+                config = {'PATH': config}
+            _replicas[alias] = SQLiteReplica(
+                config['PATH'], connection=config.get('CONNECTION', DEFAULT_CONNECTION_ALIAS))
+        return _replicas.get(alias)
+
+
+def get_read_replica(module_name, alias=None):
+    """Return the replica to read module_name from: the one given by alias,
+    or the one configured for the module when alias is None.
+    """
+    if alias is None:
+        alias = READ_REPLICA_MODULES.get(module_name)
+    return get_replica(alias) if alias else None
+
+
+def iter_replicas(connection=None):
+    """Return the replicas registered or opened so far, those copying the
+    records of the connection alias when given.
+    """
+    with _replicas_lock:
+        return [replica for replica in _replicas.values()
+                if connection is None or replica.connection_alias == connection]
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+class SQLiteReplica:
+    """Copy of SugarCRM records in a SQLite database.
+
+    connection -- alias of the connection whose records are copied, whose
+                  logic hooks keep the replica up to date
+    """
+
+    def __init__(self, path=':memory:', indexed_fields=INDEXED_FIELDS,
+                 connection=DEFAULT_CONNECTION_ALIAS):
+        self.connection_alias = connection
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._indexed_fields = indexed_fields
+        self._columns = {}
+        with self._lock:
+            self._db.execute('CREATE TABLE IF NOT EXISTS sugarcrm_sync '
+                             '(module TEXT PRIMARY KEY, date_modified TEXT)')
+
+    @staticmethod
+    def _table(module_name):
+        return _quote('sugarcrm_%s' % module_name.lower())
+
+    def _ensure_table(self, model, fields):
+        """Create the module table, or add the missing columns."""
+        module_name = model.module_name
+        table = self._table(module_name)
+        if module_name not in self._columns:
+            self._db.execute('CREATE TABLE IF NOT EXISTS %s (id TEXT PRIMARY KEY, deleted TEXT)'
+                             % table)
+            self._columns[module_name] = set(row[1] for row in
+                                             self._db.execute('PRAGMA table_info(%s)' % table))
+        columns = self._columns[module_name]
+        for field in fields:
+            if field not in columns:
+                self._db.execute('ALTER TABLE %s ADD COLUMN %s TEXT' % (table, _quote(field)))
+                columns.add(field)
+                if field in self._indexed_fields:
+                    self._db.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % (
+                        _quote('sugarcrm_%s_%s' % (module_name.lower(), field)), table,
+                        _quote(field)))
+
+    def upsert(self, model, records):
+        """Store records, given as field -> value dicts."""
+        with self._lock, self._db:
+            for record in records:
+                self._ensure_table(model, record)
+                fields = list(record)
+                self._db.execute('INSERT OR REPLACE INTO %s (%s) VALUES (%s)' % (
+                    self._table(model.module_name), ', '.join(_quote(f) for f in fields),
+                    ', '.join('?' * len(fields))), [record[f] for f in fields])
+
+    def delete(self, module_name, record_id):
+        with self._lock, self._db:
+            if module_name in self._columns or self._table_exists(module_name):
+                self._db.execute('DELETE FROM %s WHERE id = ?' % self._table(module_name),
+                                 (record_id,))
+
+    def has_module(self, module_name):
+        with self._lock:
+            return module_name in self._columns or self._table_exists(module_name)
+
+    def refresh(self, model, record_id):
+        """Copy one record again, e.g. after a logic hook reported its change."""
+        with self._lock:
+            self._ensure_table(model, [])
+            fields = sorted(self._columns[model.module_name])
+        result = model._connection.get_entry(model.module_name, record_id, fields)
+        records = [dict((name, obj['value']) for name, obj in r['name_value_list'].items())
+                   for r in (result or {}).get('entry_list') or [] if r.get('name_value_list')]
+        if not records or records[0].get('deleted') in ('1', 1):
+            self.delete(model.module_name, record_id)
+        else:
+            self.upsert(model, records)
+
+    def _table_exists(self, module_name):
+        return self._db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                ('sugarcrm_%s' % module_name.lower(),)).fetchone() is not None
+
+    def sync(self, model, fields=None, full=False, page_size=500):
+        """Copy the records of model's module modified since the last sync.
+
+        Keyword arguments:
+        model -- SugarEntry of the module to copy
+        fields -- fields to copy, all by default
+        full -- ignore the last sync date and copy every record
+        page_size -- records requested per get_entry_list call
+
+        Deleted records are fetched too, and removed from the replica.
+        Returns the number of records copied or removed.
+        """
+        module_name = model.module_name
+        fields = list(fields or model._available_fields.keys())
+        for field in ('id', 'deleted', 'date_modified'):
+            if field not in fields and field in model._available_fields:
+                fields.append(field)
+        with self._lock:
+            row = self._db.execute('SELECT date_modified FROM sugarcrm_sync WHERE module = ?',
+                                   (module_name,)).fetchone()
+        since = None if full or row is None else row[0]
+        query = ''
+        if since:
+            query = '%s.date_modified >= "%s"' % (model._table, since)
+
+        copied = 0
+        latest = since
+        # get_entry_list returns the live records with deleted=0 and the
+        # deleted ones only with deleted=1: one pass each.
+        for deleted in (0, 1):
+            for records in self._iter_pages(model, query, fields, deleted, page_size):
+                if deleted:
+                    for record in records:
+                        self.delete(module_name, record['id'])
+                else:
+                    self.upsert(model, records)
+                for record in records:
+                    latest = max(latest or '', record.get('date_modified') or '')
+                copied += len(records)
+
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO sugarcrm_sync (module, date_modified) '
+                             'VALUES (?, ?)', (module_name, latest))
+        return copied
+
+    def _iter_pages(self, model, query, fields, deleted, page_size):
+        """Yield the records matching query by pages of field -> value dicts."""
+        offset = 0
+        while True:
+            records = [dict((name, obj['value'])
+                            for name, obj in record['name_value_list'].items())
+                       for record in model._connection.iter_entry_list(
+                           model.module_name, query, '%s.date_modified' % model._table,
+                           offset, fields, [], page_size, deleted)]
+            if records:
+                yield records
+            offset += len(records)
+            if len(records) < page_size:
+                return
+
+    def _where(self, model, lookups):
+        """Translate QueryList lookups into a WHERE clause and its parameters."""
+        columns = self._columns.get(model.module_name, set())
+        clauses, params = [], []
+        for negated, query in lookups:
+            parts = []
+            for key, val in query.items():
+                key_field, key_sep, key_oper = key.partition('__')
+                if key_field == 'pk' and 'id' not in query:
+                    key_field = 'id'
+                if key_field not in model._available_fields:
+                    continue
+                if key_field not in columns:
+                    # Never synced, compare with NULL like a missing value.
+                    column = 'NULL'
+                else:
+                    column = _quote(key_field)
+                field_type = model._available_fields[key_field].get('type')
+                if field_type in NUMERIC_TYPES:
+                    column = 'CAST(%s AS REAL)' % column
+                if key_oper in ('exact', 'eq') or (not key_oper and not key_sep):
+                    parts.append('%s = ?' % column)
+                    params.append(val)
+                elif key_oper == 'contains':
+                    parts.append("%s LIKE ? ESCAPE '\\'" % column)
+                    params.append('%%%s%%' % self._escape_like(val))
+                elif key_oper == 'startswith':
+                    parts.append("%s LIKE ? ESCAPE '\\'" % column)
+                    params.append('%s%%' % self._escape_like(val))
+                elif key_oper == 'in':
+                    val = list(val)
+                    parts.append('%s IN (%s)' % (column, ', '.join('?' * len(val)) or 'NULL'))
+                    params.extend(val)
+                elif key_oper in ('gt', 'gte', 'lt', 'lte'):
+                    operator = {'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}[key_oper]
+                    parts.append('%s %s ?' % (column, operator))
+                    params.append(val)
+                else:
+                    raise LookupError('Unsupported operator')
+            if parts:
+                clause = '(%s)' % ' AND '.join(parts)
+                clauses.append('NOT %s' % clause if negated else clause)
+        return ' AND '.join(clauses), params
+
+    @staticmethod
+    def _escape_like(value):
+        return str(value).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+    def _order(self, model, order_by):
+        columns = self._columns.get(model.module_name, set())
+        parts = []
+        for part in (order_by or '').split(','):
+            field, _, direction = part.strip().partition(' ')
+            field = field.rsplit('.', 1)[-1]
+            if field in columns:
+                parts.append('%s %s' % (_quote(field),
+                                        'DESC' if direction.strip().lower() == 'desc' else 'ASC'))
+        return ', '.join(parts)
+
+    def search(self, model, lookups, order_by='', offset=0, limit=None, fields=None):
+        """Yield the entries matching QueryList lookups."""
+        module_name = model.module_name
+        with self._lock:
+            if module_name not in self._columns and not self._table_exists(module_name):
+                return
+            self._ensure_table(model, [])
+            columns = self._columns[module_name]
+            fields = [f for f in (fields or model.get_default_fields()) if f in columns]
+            if 'id' not in fields:
+                fields.insert(0, 'id')
+            where, params = self._where(model, lookups)
+            sql = 'SELECT %s FROM %s' % (', '.join(_quote(f) for f in fields),
+                                         self._table(module_name))
+            if where:
+                sql += ' WHERE ' + where
+            order = self._order(model, order_by)
+            if order:
+                sql += ' ORDER BY ' + order
+            if limit or offset:
+                sql += ' LIMIT ? OFFSET ?'
+                params += [int(limit) if limit else -1, int(offset or 0)]
+            rows = self._db.execute(sql, params).fetchall()
+        for row in rows:
+            yield model._entry_from_record({'name_value_list': dict(
+                (f, {'name': f, 'value': '' if v is None else v}) for f, v in zip(fields, row))})
+
+    def count(self, model, lookups):
+        module_name = model.module_name
+        with self._lock:
+            if module_name not in self._columns and not self._table_exists(module_name):
+                return 0
+            self._ensure_table(model, [])
+            where, params = self._where(model, lookups)
+            sql = 'SELECT COUNT(*) FROM %s' % self._table(module_name)
+            if where:
+                sql += ' WHERE ' + where
+            return self._db.execute(sql, params).fetchone()[0]
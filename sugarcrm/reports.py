@@ -0,0 +1,152 @@
+"""Execution of saved reports into cached, columnar tables."""
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+import six
+
+from .cache import TTLCache
+from .settings import REPORT_CACHE_TTL
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Results are refreshed in the background when read after this fraction of
+# their time to live.
+REFRESH_AHEAD = 0.8
+
+_cache = TTLCache(REPORT_CACHE_TTL, maxsize=128)
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+class ReportTable:
+    """Rows of a report stored by columns.
+
+    Columns whose values are all numbers (or empty, stored as NaN) are float
+    arrays: NumPy arrays when NumPy is installed, array('d') otherwise.
+    Other columns are lists, or NumPy object arrays.
+    """
+
+    def __init__(self, columns, num_rows, fetched_at=None):
+        self.columns = columns
+        self.num_rows = num_rows
+        self.fetched_at = fetched_at or time.time()
+
+    def __len__(self):
+        return self.num_rows
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def __contains__(self, column):
+        return column in self.columns
+
+    def __iter__(self):
+        """Iterate over the rows as dicts."""
+        names = list(self.columns)
+        for i in range(self.num_rows):
+            yield dict((name, self.columns[name][i]) for name in names)
+
+    @property
+    def column_names(self):
+        return list(self.columns)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a table from an iterable of name_value_list rows, one row at
+        a time.
+        """
+        columns = OrderedDict()
+        num_rows = 0
+        for row in rows:
+            if isinstance(row, dict):
+                items = [(name, field['value'] if isinstance(field, dict) else field)
+                         for name, field in row.items()]
+            else:
+                items = [(field['name'], field['value']) for field in row]
+            for name, value in items:
+                if name not in columns:
+                    # Missing values of earlier rows.
+                    columns[name] = array('d', [float('nan')] * num_rows)
+                column = columns[name]
+                if isinstance(column, array):
+                    try:
+                        column.append(float('nan') if value in ('', None) else float(value))
+                        continue
+                    except (TypeError, ValueError):
+                        column = columns[name] = [None if v != v else v for v in column]
+                column.append(value)
+            num_rows += 1
+            for name, column in columns.items():
+                if len(column) < num_rows:
+                    column.append(float('nan') if isinstance(column, array) else None)
+        if numpy is not None:
+            for name, column in columns.items():
+                if isinstance(column, array):
+                    columns[name] = numpy.frombuffer(column, dtype=numpy.float64)
+                else:
+                    values = numpy.empty(len(column), dtype=object)
+                    values[:] = column
+                    columns[name] = values
+        return cls(columns, num_rows)
+
+
+def _cache_key(connection, report_id, fields):
+    return (connection._url, report_id, tuple(fields or ()))
+
+
+def fetch(connection, report_id, fields=None):
+    """Execute a report on the server, bypassing the cache."""
+    return ReportTable.from_rows(connection.iter_report_rows(report_id, fields))
+
+
+def execute(connection, report_id, fields=None, ttl=None):
+    """Return the ReportTable of a saved report, cached for ttl seconds.
+
+    A result read after REFRESH_AHEAD of its time to live is returned
+    immediately while a background thread fetches a fresh one, so busy
+    dashboards never wait on the server once the cache is warm.
+    """
+    ttl = REPORT_CACHE_TTL if ttl is None else ttl
+    key = _cache_key(connection, report_id, fields)
+    table, expires = _cache.get_with_expiry(key)
+    if table is None:
+        table = fetch(connection, report_id, fields)
+        _cache.set(key, table, ttl)
+        return table
+    if expires - time.time() < ttl * (1 - REFRESH_AHEAD):
+        with _refreshing_lock:
+            if key in _refreshing:
+                return table
+            _refreshing.add(key)
+        threading.Thread(target=_refresh, args=(connection, report_id, fields, ttl, key),
+                         daemon=True).start()
+    return table
+
+
+def _refresh(connection, report_id, fields, ttl, key):
+    try:
+        _cache.set(key, fetch(connection, report_id, fields), ttl)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+
+def invalidate(connection):
+    """Forget the cached reports of connection's server.
+
+    Reports may join any modules, so a change to any record of the server
+    invalidates them all.
+
+    connection -- Sugarcrm connection, or the URL of its server
+    """
+    url = connection if isinstance(connection, six.string_types) else connection._url
+    return _cache.delete_matching(lambda key: key[0] == url)
+
+
+def clear_cache():
+    _cache.clear()
@@ -1,2 +1,3 @@
 from .helpers import *
 from .filterset import *
+from .mixins import *
@@ -0,0 +1,122 @@
+"""Conditional responses for DRF viewsets backed by SugarCRM.
+
+    from sugarcrm.rest_framework.conditional import ConditionalResponseMixin
+
+    class AccountViewSet(ConditionalResponseMixin, viewsets.ReadOnlyModelViewSet):
+        ...
+
+Kept out of sugarcrm.rest_framework so the library imports without Django.
+"""
+import calendar
+import hashlib
+import time
+
+from django.dispatch import receiver
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from ..cache import TTLCache
+from ..settings import REST_VALIDATOR_TTL, REST_PAGE_CACHE_TTL
+from ..signals import record_changed
+from ..sugarquerylist import QueryList
+
+# (module_name, query, using) -> (ETag, Last-Modified timestamp) of lists.
+_validators = TTLCache(REST_VALIDATOR_TTL, maxsize=1024)
+
+# (view, request path, ETag) -> serialized response data.
+_pages = TTLCache(REST_PAGE_CACHE_TTL, maxsize=256)
+
+
+@receiver(record_changed)
+def _invalidate_validators(sender, module_name, **kwargs):
+    _validators.delete_matching(lambda key: key[0] == module_name)
+
+
+class ConditionalResponseMixin:
+    """
+    DRF viewset mixin answering conditional requests from date_modified
+
+    list() computes the ETag and Last-Modified of a filtered queryset from
+    its most recently modified entry and its count, two requests fetching
+    no other field, reused for SUGAR_CRM_REST_VALIDATOR_TTL seconds.
+    retrieve() reads the entry's date_modified alone. Clients sending
+    If-None-Match or If-Modified-Since get a 304 when nothing changed, and
+    serialized responses are cached by ETag, so unchanged data is neither
+    fetched nor serialized again.
+
+    Responses are cached by request path: views returning different data
+    to different users must add the user to get_page_cache_key().
+    """
+    validator_field = 'date_modified'
+
+    def get_page_cache_key(self, request):
+        return type(self).__module__, type(self).__name__, request.get_full_path()
+
+    def _timestamp(self, value):
+        try:
+            return calendar.timegm(time.strptime(value, '%Y-%m-%d %H:%M:%S'))
+        except (TypeError, ValueError):
+            return None
+
+    def _supports_validator(self, queryset):
+        return (isinstance(queryset, QueryList) and
+                self.validator_field in queryset.model._available_fields)
+
+    def get_list_validator(self, queryset):
+        """Return the (ETag, Last-Modified timestamp) of a queryset."""
+        key = (queryset.model.module_name, queryset._query, queryset._using)
+        validator = _validators.get(key)
+        if validator is None:
+            latest = queryset.order_by('-' + self.validator_field).only('id', self.validator_field)
+            latest.set_limits(0, 1)
+            modified = [entry._fields[self.validator_field] for entry in latest.iterator()]
+            count = queryset.count()
+            tag = '%s|%s|%d' % (queryset._query, modified[0] if modified else '', count)
+            validator = ('W/"%s"' % hashlib.md5(tag.encode('utf-8')).hexdigest(),
+                         self._timestamp(modified[0]) if modified else None)
+            _validators.set(key, validator)
+        return validator
+
+    def _conditional(self, request, validator, render):
+        etag, last_modified = validator
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            key = self.get_page_cache_key(request) + (etag,)
+            data = _pages.get(key)
+            if data is None:
+                response = render()
+                if response.status_code == 200:
+                    _pages.set(key, response.data)
+            else:
+                response = Response(data)
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if not self._supports_validator(queryset) or queryset._annotations is not None:
+            return super().list(request, *args, **kwargs)
+        return self._conditional(request, self.get_list_validator(queryset),
+                                 lambda: super(ConditionalResponseMixin, self).list(
+                                     request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        if not self._supports_validator(queryset) or lookup_url_kwarg not in self.kwargs:
+            return super().retrieve(request, *args, **kwargs)
+        entries = list(queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+                       .only('id', self.validator_field).iterator())
+        if len(entries) != 1:
+            # Let DRF answer 404.
+            return super().retrieve(request, *args, **kwargs)
+        modified = entries[0]._fields[self.validator_field]
+        tag = '%s|%s' % (entries[0]['id'], modified)
+        validator = ('W/"%s"' % hashlib.md5(tag.encode('utf-8')).hexdigest(),
+                     self._timestamp(modified))
+        return self._conditional(request, validator,
+                                 lambda: super(ConditionalResponseMixin, self).retrieve(
+                                     request, *args, **kwargs))
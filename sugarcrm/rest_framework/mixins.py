@@ -0,0 +1,23 @@
+from ..sugarquerylist import QueryList
+
+
+class FieldProjectionMixin:
+    """
+    DRF view mixin requesting only the fields used by the serializer
+
+    Querysets which already call only() or defer() are left untouched.
+    """
+    def get_projection_fields(self):
+        serializer = self.get_serializer_class()()
+        fields = {'id'}
+        for field in serializer.fields.values():
+            source = getattr(field, 'source', None) or field.field_name
+            if source != '*':
+                fields.add(source.split('.')[0])
+        return sorted(fields)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if isinstance(queryset, QueryList) and queryset._fields is None:
+            queryset = queryset.only(*self.get_projection_fields())
+        return queryset
@@ -0,0 +1,124 @@
+"""On-disk snapshots of SugarCRM module metadata.
+
+A snapshot holds the result of get_available_modules and of
+get_module_fields for each module, so a connection created with
+`schema_snapshot=path` (or the SUGAR_CRM_SCHEMA_SNAPSHOT setting) doesn't
+fetch them again. The snapshot records the URL and the server version
+it was taken from; a connection falls back to live metadata when its URL
+is another one, or when the server was upgraded. Snapshots are written by
+the inspectsugar management command, one file per instance when several
+are configured (schema_snapshot in the OPTIONS of SUGAR_CRM_CONNECTIONS).
+"""
+import json
+import logging
+import os
+import re
+import time
+
+from .fields import DECIMAL_TYPES, ENUM_TYPES, FLOAT_TYPES, INT_TYPES
+
+log = logging.getLogger(__name__)
+
+# Bumped when the layout of snapshot files changes.
+SNAPSHOT_FORMAT = 2
+
+# Python types of the values of each field type, as converted by
+# sugarcrm.fields.to_python() for the typed generated classes; str otherwise.
+FIELD_TYPES = dict(
+    [(field_type, 'int') for field_type in INT_TYPES] +
+    [(field_type, 'Decimal') for field_type in DECIMAL_TYPES] +
+    [(field_type, 'float') for field_type in FLOAT_TYPES] +
+    [(field_type, 'EnumValue') for field_type in ENUM_TYPES] +
+    [('bool', 'bool'), ('multienum', 'list'), ('date', 'datetime.date'),
+     ('datetime', 'datetime.datetime'), ('datetimecombo', 'datetime.datetime')])
+
+
+def server_version(server_info):
+    return '%s %s' % ((server_info or {}).get('flavor', ''), (server_info or {}).get('version', ''))
+
+
+def take_snapshot(connection, modules=None):
+    """Fetch the metadata of modules (all available ones by default)."""
+    available = connection.get_available_modules()['modules']
+    if modules is None:
+        modules = [m['module_key'] for m in available]
+    schemas = {}
+    for module_name in modules:
+        schema = connection.get_module_fields(module_name)
+        if schema is not None:
+            schemas[module_name] = schema
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+        'url': connection._url,
+        'server_version': server_version(connection.get_server_info()),
+        'available_modules': available,
+        'modules': schemas,
+    }
+
+
+def save_snapshot(snapshot, path):
+    """Write a snapshot atomically, so running processes never read half a file."""
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot, f, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path):
+    """Return the snapshot stored at path, or None if it is missing or of
+    another format.
+    """
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        log.warning('Cannot load SugarCRM schema snapshot %s: %s', path, e)
+        return None
+    if snapshot.get('format') != SNAPSHOT_FORMAT:
+        log.warning('Ignoring SugarCRM schema snapshot %s of format %s', path,
+                    snapshot.get('format'))
+        return None
+    return snapshot
+
+
+def class_name(module_name):
+    """Singular CamelCase class name of a module: Opportunities -> Opportunity."""
+    name = re.sub(r'[^0-9A-Za-z]', '', module_name)
+    if name.endswith('ies'):
+        name = name[:-3] + 'y'
+    elif name.endswith('sses'):
+        name = name[:-2]
+    elif name.endswith('s') and not name.endswith('ss'):
+        name = name[:-1]
+    return name[:1].upper() + name[1:]
+
+
+def generate_classes(snapshot):
+    """Return the source of a Python module defining one SugarEntry subclass
+    per module of the snapshot, with typed fields and the Python types of
+    the module's fields as annotations.
+    """
+    lines = [
+        '"""SugarCRM entry classes generated by inspectsugar from %s (%s).' % (
+            snapshot['server_version'].strip(), snapshot['created']),
+        '',
+        'Do not edit, run inspectsugar again after changing the CRM schema.',
+        '"""',
+        'import datetime',
+        'from decimal import Decimal',
+        '',
+        'from sugarcrm import SugarEntry',
+        'from sugarcrm.fields import EnumValue',
+    ]
+    for module_name in sorted(snapshot['modules']):
+        schema = snapshot['modules'][module_name]
+        lines += ['', '', 'class %s(SugarEntry):' % class_name(module_name),
+                  '    """%s, stored in the %s table."""' % (module_name, schema['table_name']),
+                  '    module_name = %r' % module_name, '    typed_fields = True', '']
+        for name, field in sorted(schema['module_fields'].items()):
+            if not re.match(r'^[A-Za-z_][0-9A-Za-z_]*$', name):
+                continue
+            lines.append('    %s: %s  # %s' % (name, FIELD_TYPES.get(field.get('type'), 'str'),
+                                              field.get('type', '')))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,65 @@
+"""Concurrent global search across modules on top of search_by_module."""
+from concurrent.futures import as_completed
+
+from .cache import TTLCache
+from .executor import ThreadPoolExecutor
+from .settings import SEARCH_CACHE_TTL
+
+DEFAULT_SEARCH_MODULES = ('Accounts', 'Contacts', 'Leads', 'Opportunities')
+
+
+class Searcher:
+    """Run search_by_module as one request per module.
+
+    Results of each (search string, module) pair are cached for ttl
+    seconds, so a search box re-sending the same string doesn't reach the
+    server again.
+    """
+
+    def __init__(self, connection, ttl=SEARCH_CACHE_TTL, maxsize=256, max_workers=4):
+        self._connection = connection
+        self._cache = TTLCache(ttl, maxsize)
+        self.max_workers = max_workers
+
+    def _search_module(self, search_string, module, fields, max_results):
+        key = (search_string.strip().lower(), module, tuple(fields or ()), max_results)
+        records = self._cache.get(key)
+        if records is None:
+            result = self._connection.search_by_module(search_string, [module], 0, max_results,
+                                                       '', list(fields or []), False, False)
+            records = []
+            for block in (result or {}).get('entry_list') or []:
+                if block['name'] == module:
+                    records.extend(block['records'])
+            self._cache.set(key, records)
+        return self._build_entries(module, records)
+
+    def _build_entries(self, module, records):
+        if module not in self._connection.rst_modules:
+            return []
+        model = self._connection[module]
+        return [model._entry_from_record({'name_value_list': record}) for record in records]
+
+    def iter_search(self, search_string, modules=DEFAULT_SEARCH_MODULES, fields=None,
+                    max_results=10):
+        """Yield (module, entries) pairs in the order the modules answer."""
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(modules)) or 1) as executor:
+            futures = dict((executor.submit(self._search_module, search_string, module,
+                                            fields, max_results), module)
+                           for module in modules)
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def search(self, search_string, modules=DEFAULT_SEARCH_MODULES, fields=None, max_results=10):
+        """Return a dict module -> entries, in the order of modules, once every
+        module answered.
+        """
+        results = dict(self.iter_search(search_string, modules, fields, max_results))
+        return dict((module, results[module]) for module in modules)
+
+    def invalidate(self, module_name):
+        """Forget the cached results of module_name."""
+        return self._cache.delete_matching(lambda key: key[1] == module_name)
+
+    def clear(self):
+        self._cache.clear()
@@ -1,8 +1,100 @@
+import os
+
 try:
     from django.conf import settings
+    if not (settings.configured or os.environ.get('DJANGO_SETTINGS_MODULE')):
+        # Django installed but not set up, e.g. scripts and the benchmarks:
+        # use the defaults rather than raising ImproperlyConfigured.
+        settings = None
 except:
     settings = None
 
 API_URL = getattr(settings, 'SUGAR_CRM_URL', '')
 USERNAME = getattr(settings, 'SUGAR_CRM_USERNAME', '')
 PASSWORD = getattr(settings, 'SUGAR_CRM_PASSWORD', '')
+
+# Gzip large request bodies (e.g. set_entries); the web server in front of
+# SugarCRM must be configured to decode them.
+COMPRESS_REQUESTS = getattr(settings, 'SUGAR_CRM_COMPRESS_REQUESTS', False)
+
+# Fields requested by default for each module, e.g. {'Accounts': ['id', 'name']}.
+# Modules not listed here fetch all their fields unless only() is used.
+DEFAULT_FIELDS = getattr(settings, 'SUGAR_CRM_DEFAULT_FIELDS', {})
+
+# Seconds during which search results are reused for the same search string.
+SEARCH_CACHE_TTL = getattr(settings, 'SUGAR_CRM_SEARCH_CACHE_TTL', 30)
+
+# Seconds during which the result of a saved report is reused.
+REPORT_CACHE_TTL = getattr(settings, 'SUGAR_CRM_REPORT_CACHE_TTL', 300)
+
+# Local read replicas, alias -> SQLite database path, or alias ->
+# {'PATH': ..., 'CONNECTION': alias of the connection it copies}, see
+# sugarcrm.replica.
+REPLICAS = getattr(settings, 'SUGAR_CRM_REPLICAS', {})
+
+# Modules read from a replica by default, module name -> replica alias.
+READ_REPLICA_MODULES = getattr(settings, 'SUGAR_CRM_READ_REPLICA_MODULES', {})
+
+# Seconds module schemas (get_module_fields) are kept by a connection,
+# None to keep them until Sugarcrm.invalidate_schema() is called.
+SCHEMA_CACHE_TTL = getattr(settings, 'SUGAR_CRM_SCHEMA_CACHE_TTL', 3600)
+
+# Module metadata snapshot written by the inspectsugar command, loaded by
+# connections instead of fetching the metadata, see sugarcrm.schema.
+SCHEMA_SNAPSHOT = getattr(settings, 'SUGAR_CRM_SCHEMA_SNAPSHOT', None)
+
+# Compare the snapshot with the server version when connecting.
+SCHEMA_SNAPSHOT_CHECK = getattr(settings, 'SUGAR_CRM_SCHEMA_SNAPSHOT_CHECK', True)
+
+# SugarCRM instances, alias -> {'URL': ..., 'USERNAME': ..., 'PASSWORD': ...,
+# 'WEBHOOK_SECRET': ..., 'OPTIONS': {Sugarcrm keyword arguments}}. The
+# 'default' alias falls back to SUGAR_CRM_URL, SUGAR_CRM_USERNAME and
+# SUGAR_CRM_PASSWORD, and every alias to SUGAR_CRM_WEBHOOK_SECRET.
+CONNECTIONS = getattr(settings, 'SUGAR_CRM_CONNECTIONS', {})
+
+# Logged in connections kept open at once; the least recently used ones are
+# closed beyond that.
+MAX_CONNECTIONS = getattr(settings, 'SUGAR_CRM_MAX_CONNECTIONS', 32)
+
+# Seconds after which an unused connection is closed.
+CONNECTION_IDLE_TIMEOUT = getattr(settings, 'SUGAR_CRM_CONNECTION_IDLE_TIMEOUT', 600)
+
+# Secret shared with the SugarCRM logic hooks posting to sugarcrm.webhooks,
+# for the aliases without their own WEBHOOK_SECRET; requests are rejected
+# while it is empty.
+WEBHOOK_SECRET = getattr(settings, 'SUGAR_CRM_WEBHOOK_SECRET', '')
+
+# Entries fetched at once by QueryList index and slice access; following
+# windows are prefetched while a query is read sequentially.
+QUERY_WINDOW_SIZE = getattr(settings, 'SUGAR_CRM_QUERY_WINDOW_SIZE', 20)
+
+# Entries fetched per request by QueryList.aggregate() and annotate(), and
+# ids per request by QueryList.update() and delete().
+AGGREGATE_PAGE_SIZE = getattr(settings, 'SUGAR_CRM_AGGREGATE_PAGE_SIZE', 1000)
+
+# Queue SugarEntry.save() writes and send them in the background, see
+# sugarcrm.writebehind.
+WRITE_BEHIND = getattr(settings, 'SUGAR_CRM_WRITE_BEHIND', False)
+
+# Seconds queued writes wait for other saves of the same record.
+WRITE_BEHIND_DELAY = getattr(settings, 'SUGAR_CRM_WRITE_BEHIND_DELAY', 1.0)
+
+# Attempts after a failed write before giving up on it.
+WRITE_BEHIND_RETRIES = getattr(settings, 'SUGAR_CRM_WRITE_BEHIND_RETRIES', 3)
+
+# SQLite database keeping queued writes across restarts; in memory if None.
+WRITE_BEHIND_PATH = getattr(settings, 'SUGAR_CRM_WRITE_BEHIND_PATH', None)
+
+# Seconds the process waits for the queued writes when it exits.
+WRITE_BEHIND_EXIT_TIMEOUT = getattr(settings, 'SUGAR_CRM_WRITE_BEHIND_EXIT_TIMEOUT', 10)
+
+# Seconds during which ConditionalResponseMixin reuses the ETag of a query;
+# logic hook webhooks drop them earlier.
+REST_VALIDATOR_TTL = getattr(settings, 'SUGAR_CRM_REST_VALIDATOR_TTL', 5)
+
+# Seconds during which ConditionalResponseMixin keeps serialized responses.
+REST_PAGE_CACHE_TTL = getattr(settings, 'SUGAR_CRM_REST_PAGE_CACHE_TTL', 300)
+
+# Convert field values to Python types (datetime, Decimal, bool, ...) from
+# the module metadata, see sugarcrm.fields.
+TYPED_FIELDS = getattr(settings, 'SUGAR_CRM_TYPED_FIELDS', False)
@@ -0,0 +1,56 @@
+"""Signals sent when SugarCRM reports a change through its logic hooks.
+
+sugarcrm.webhooks sends them for every hook received. The receivers below
+invalidate the library's own caches; applications connect their own
+receivers to drop theirs:
+
+    from django.dispatch import receiver
+    from sugarcrm.signals import record_changed
+
+    @receiver(record_changed)
+    def forget_account(sender, module_name, record_id, **kwargs):
+        if module_name == 'Accounts':
+            cache.delete('account-%s' % record_id)
+
+The sender is the alias of the connection the hook came from.
+"""
+import logging
+
+from django.dispatch import Signal, receiver
+
+from . import reports
+from .connections import connections
+from .replica import iter_replicas
+
+log = logging.getLogger(__name__)
+
+# Sent with module_name, record_id and event ('after_save' or 'after_delete').
+record_changed = Signal()
+
+# Sent with module_name, record_id, related_module, related_id, link and event
+# ('after_relationship_add' or 'after_relationship_delete'). record_changed is
+# sent for both records too.
+relationship_changed = Signal()
+
+
+@receiver(record_changed)
+def invalidate_caches(sender, module_name, record_id, event, **kwargs):
+    connection = connections.get_open(sender)
+    if connection is not None and connection._searcher is not None:
+        connection._searcher.invalidate(module_name)
+    # Reports outlive the connection they were fetched through.
+    url = connections.get_url(sender)
+    if url:
+        reports.invalidate(url)
+    for replica in iter_replicas(sender):
+        if not replica.has_module(module_name):
+            continue
+        if event == 'after_delete':
+            replica.delete(module_name, record_id)
+        else:
+            try:
+                # Logs in again if the connection was closed since.
+                replica.refresh(connections[sender][module_name], record_id)
+            except Exception as e:
+                # The replica catches up on its next sync().
+                log.warning('Cannot refresh %s %s in replica: %s', module_name, record_id, e)
@@ -0,0 +1,141 @@
+"""Incremental parsing of JSON responses.
+
+SugarCRM answers get_entry_list with a single JSON object whose
+'entry_list' array may hold thousands of records. iter_json_object()
+parses such an object from an iterable of byte chunks and yields the items
+of selected arrays as soon as they are complete, so only about one record
+has to be kept in memory at a time.
+"""
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+
+_WHITESPACE = ' \t\n\r'
+
+_NUMBER_CHARS = '0123456789.eE+-'
+
+
+class _Buffer:
+    """Text decoded from an iterable of byte chunks, consumed from the left."""
+
+    def __init__(self, chunks, encoding='utf-8'):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read at least as much data as is buffered, return False at EOF.
+
+        Doubling the buffer keeps the cost of re-parsing a value which
+        spans many chunks linear in its size.
+        """
+        if self.eof:
+            return False
+        if self.pos > len(self.text) // 2:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        wanted = max(len(self.text) - self.pos, 1)
+        parts = []
+        read = 0
+        while read < wanted:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                parts.append(self._decoder.decode(b'', final=True))
+                self.eof = True
+                break
+            parts.append(self._decoder.decode(chunk))
+            read += len(chunk)
+        self.text += ''.join(parts)
+        return True
+
+    def skip_whitespace(self):
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text) or not self.fill():
+                return
+
+    def peek(self):
+        self.skip_whitespace()
+        if self.pos >= len(self.text):
+            raise ValueError('Unexpected end of JSON data')
+        return self.text[self.pos]
+
+    def expect(self, *chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError('Expected %s at position %d, got %r' %
+                             (' or '.join(repr(c) for c in chars), self.pos, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Parse and consume one complete JSON value."""
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except ValueError:
+                if not self.fill():
+                    raise
+                continue
+            # A number cut by the end of a chunk may parse as a shorter one.
+            if (end == len(self.text) or self.text[end] in _NUMBER_CHARS) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_object(chunks, stream_keys=()):
+    """Parse a JSON object from an iterable of byte chunks.
+
+    Yields (key, value, is_item) tuples: the members of the object in order,
+    except for the arrays under one of stream_keys whose elements are
+    yielded one by one with is_item set. A `null` document yields nothing.
+
+    stream_keys may also map keys to a depth: with a depth of 2 the items
+    of the arrays nested in the array are yielded, and so on.
+    """
+    if not isinstance(stream_keys, dict):
+        stream_keys = dict((key, 1) for key in stream_keys)
+    buf = _Buffer(chunks)
+    buf.skip_whitespace()
+    if buf.pos >= len(buf.text):
+        return
+    if buf.peek() != '{':
+        value = buf.value()
+        if value is None:
+            return
+        raise ValueError('Expected a JSON object, got %s' % type(value).__name__)
+
+    buf.expect('{')
+    if buf.peek() == '}':
+        return
+    while True:
+        key = buf.value()
+        buf.expect(':')
+        if key in stream_keys and buf.peek() == '[':
+            for item in _iter_array(buf, stream_keys[key]):
+                yield key, item, True
+        else:
+            yield key, buf.value(), False
+        if buf.expect(',', '}') == '}':
+            return
+
+
+def _iter_array(buf, depth):
+    buf.expect('[')
+    if buf.peek() == ']':
+        buf.pos += 1
+        return
+    while True:
+        if depth > 1 and buf.peek() == '[':
+            for item in _iter_array(buf, depth - 1):
+                yield item
+        else:
+            yield buf.value()
+        if buf.expect(',', ']') == ']':
+            return
@@ -0,0 +1,893 @@
+"""Local stand-in for a SugarCRM REST v4 server.
+
+The stub serves synthetic datasets of configurable size over a real HTTP
+socket, so the client library can be exercised (and benchmarked) without a
+live CRM:
+
+    with StubServer(records=1000, latency=0.005) as server:
+        conn = server.connect()
+        Account(conn).objects.filter(name__startswith='Account 1')
+
+Every handled call is counted in `StubServer.calls` together with the
+number of request and response bytes that went over the wire.
+"""
+from __future__ import print_function
+
+import base64
+import gzip
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import types
+import uuid
+import zlib
+from collections import Counter, OrderedDict, defaultdict
+
+from six.moves import BaseHTTPServer, socketserver, urllib
+
+DEFAULT_MODULES = ('Accounts', 'Contacts', 'Leads', 'Opportunities', 'Tasks',
+                   'Calls', 'Notes', 'Documents', 'Users', 'Reports')
+
+# Saved reports list the records of this module.
+REPORTED_MODULE = 'Opportunities'
+REPORT_FIELDS = ('name', 'amount', 'sales_stage', 'probability')
+
+# Fields every synthetic module has, with their SugarCRM field types.
+BASE_FIELDS = OrderedDict([
+    ('id', 'id'),
+    ('name', 'name'),
+    ('date_entered', 'datetime'),
+    ('date_modified', 'datetime'),
+    ('modified_user_id', 'assigned_user_name'),
+    ('created_by', 'assigned_user_name'),
+    ('description', 'text'),
+    ('deleted', 'bool'),
+    ('assigned_user_id', 'relate'),
+    ('status', 'enum'),
+])
+
+# Extra, module specific fields.
+MODULE_FIELDS = {
+    'Accounts': OrderedDict([('account_type', 'enum'), ('industry', 'enum'),
+                             ('annual_revenue', 'varchar')]),
+    'Contacts': OrderedDict([('first_name', 'varchar'), ('last_name', 'varchar'),
+                             ('email1', 'varchar'), ('account_id', 'relate')]),
+    'Leads': OrderedDict([('first_name', 'varchar'), ('last_name', 'varchar'),
+                          ('lead_source', 'enum')]),
+    'Opportunities': OrderedDict([('amount', 'currency'), ('sales_stage', 'enum'),
+                                  ('probability', 'int'), ('date_closed', 'date')]),
+    'Tasks': OrderedDict([('date_start', 'datetimecombo'), ('date_due', 'datetimecombo'),
+                          ('priority', 'enum'), ('parent_type', 'parent_type'),
+                          ('parent_id', 'id')]),
+    'Calls': OrderedDict([('date_start', 'datetimecombo'), ('duration_hours', 'int'),
+                          ('direction', 'enum')]),
+    'Notes': OrderedDict([('filename', 'file'), ('file_mime_type', 'varchar'),
+                          ('parent_type', 'parent_type'), ('parent_id', 'id')]),
+    'Documents': OrderedDict([('document_name', 'varchar'), ('document_revision_id', 'id'),
+                              ('revision', 'varchar')]),
+    'Users': OrderedDict([('user_name', 'user_name'), ('first_name', 'varchar'),
+                          ('last_name', 'varchar')]),
+}
+
+ENUM_OPTIONS = {
+    'status': ['New', 'Assigned', 'In Progress', 'Closed'],
+    'account_type': ['Customer', 'Partner', 'Reseller', 'Analyst'],
+    'industry': ['Banking', 'Energy', 'Retail', 'Technology'],
+    'lead_source': ['Cold Call', 'Web Site', 'Email', 'Partner'],
+    'sales_stage': ['Prospecting', 'Qualification', 'Negotiation/Review',
+                    'Closed Won', 'Closed Lost'],
+    'priority': ['High', 'Medium', 'Low'],
+    'direction': ['Inbound', 'Outbound'],
+}
+
+
+def _error(name, description, number):
+    return {'name': name, 'description': description, 'number': number}
+
+
+INVALID_SESSION = _error('Invalid Session ID',
+                         'The session ID is invalid', 11)
+INVALID_LOGIN = _error('Invalid Login',
+                       'Login attempt failed please check the username and password', 10)
+MISSING_MODULE = _error('Module Does Not Exist',
+                        'This module is not available on this server', 20)
+INVALID_REQUEST = _error('Invalid Request', 'Unsupported method', 1001)
+
+
+def _now():
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+
+class QuerySyntaxError(Exception):
+    pass
+
+
+class QueryMatcher:
+    """Evaluate the SQL WHERE fragments built by QueryList against records.
+
+    Supports the subset generated by the library: comparisons, LIKE, IN,
+    IS [NOT] NULL, NOT, AND, OR and parentheses. Column names may be
+    prefixed by a table name (`accounts.name`, `accounts_cstm.foo_c`).
+    """
+
+    _token_re = re.compile(r"""\s*(?:
+          (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.)*")
+        | (?P<number>-?\d+(?:\.\d+)?(?![A-Za-z_]))
+        | (?P<op><>|!=|>=|<=|=|<|>|\(|\)|,)
+        | (?P<word>[A-Za-z_][A-Za-z0-9_.]*)
+        )""", re.X)
+
+    def __init__(self, query):
+        self._tokens = self._tokenize(query or '')
+        self._pos = 0
+        if self._tokens:
+            self._predicate = self._parse_or()
+            if self._pos != len(self._tokens):
+                raise QuerySyntaxError('Unexpected %r' % (self._tokens[self._pos][1],))
+        else:
+            self._predicate = lambda record: True
+
+    def __call__(self, record):
+        return self._predicate(record)
+
+    def _tokenize(self, query):
+        tokens = []
+        pos = 0
+        query = query.rstrip()
+        while pos < len(query):
+            match = self._token_re.match(query, pos)
+            if not match or match.end() == pos:
+                raise QuerySyntaxError('Cannot parse %r' % query[pos:])
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind == 'string':
+                value = re.sub(r"\\(.)", r"\1", value[1:-1].replace("''", "'"))
+            elif kind == 'word' and value.upper() in ('AND', 'OR', 'NOT', 'IN',
+                                                     'LIKE', 'IS', 'NULL'):
+                kind, value = 'keyword', value.upper()
+            tokens.append((kind, value))
+            pos = match.end()
+        return tokens
+
+    def _peek(self, *values):
+        if self._pos < len(self._tokens):
+            token = self._tokens[self._pos]
+            if not values or token[1] in values:
+                return token
+        return None
+
+    def _next(self):
+        if self._pos >= len(self._tokens):
+            raise QuerySyntaxError('Unexpected end of query')
+        self._pos += 1
+        return self._tokens[self._pos - 1]
+
+    def _expect(self, value):
+        token = self._next()
+        if token[1] != value:
+            raise QuerySyntaxError('Expected %r, got %r' % (value, token[1]))
+
+    def _parse_or(self):
+        parts = [self._parse_and()]
+        while self._peek('OR'):
+            self._next()
+            parts.append(self._parse_and())
+        if len(parts) == 1:
+            return parts[0]
+        return lambda record: any(p(record) for p in parts)
+
+    def _parse_and(self):
+        parts = [self._parse_not()]
+        while self._peek('AND'):
+            self._next()
+            parts.append(self._parse_not())
+        if len(parts) == 1:
+            return parts[0]
+        return lambda record: all(p(record) for p in parts)
+
+    def _parse_not(self):
+        if self._peek('NOT'):
+            self._next()
+            inner = self._parse_not()
+            return lambda record: not inner(record)
+        return self._parse_primary()
+
+    def _parse_primary(self):
+        if self._peek('('):
+            self._next()
+            inner = self._parse_or()
+            self._expect(')')
+            return inner
+
+        kind, column = self._next()
+        if kind != 'word':
+            raise QuerySyntaxError('Expected column, got %r' % column)
+        field = column.rsplit('.', 1)[-1]
+
+        negate = False
+        if self._peek('NOT'):
+            self._next()
+            negate = True
+
+        kind, oper = self._next()
+        if oper == 'IN':
+            self._expect('(')
+            values = []
+            while not self._peek(')'):
+                values.append(str(self._next()[1]))
+                if self._peek(','):
+                    self._next()
+            self._expect(')')
+            values = set(values)
+            test = lambda record: str(record.get(field) or '') in values
+        elif oper == 'LIKE':
+            pattern = self._next()[1]
+            regex = re.compile(''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c)
+                                       for c in pattern), re.I | re.S)
+            test = lambda record: regex.fullmatch(str(record.get(field) or '')) is not None
+        elif oper == 'IS':
+            if self._peek('NOT'):
+                self._next()
+                negate = not negate
+            self._expect('NULL')
+            test = lambda record: record.get(field) in (None, '')
+        elif oper in ('=', '!=', '<>', '<', '<=', '>', '>='):
+            value = self._next()[1]
+            test = self._comparison(field, oper, value)
+        else:
+            raise QuerySyntaxError('Unsupported operator %r' % oper)
+
+        if negate:
+            return lambda record: not test(record)
+        return test
+
+    @staticmethod
+    def _comparison(field, oper, value):
+        def coerce(left, right):
+            try:
+                return float(left), float(right)
+            except (TypeError, ValueError):
+                return str(left or '').lower(), str(right or '').lower()
+
+        def test(record):
+            left, right = coerce(record.get(field), value)
+            if oper == '=':
+                return left == right
+            if oper in ('!=', '<>'):
+                return left != right
+            if oper == '<':
+                return left < right
+            if oper == '<=':
+                return left <= right
+            if oper == '>':
+                return left > right
+            return left >= right
+        return test
+
+
+class Dataset:
+    """Synthetic records of a few SugarCRM modules plus their relationships."""
+
+    def __init__(self, records=100, modules=DEFAULT_MODULES, extra_fields=0, seed=0):
+        """Generate a dataset.
+
+        Keyword arguments:
+        records -- number of records per module, or a dict module -> count
+        modules -- names of the modules to generate
+        extra_fields -- number of filler varchar fields per module, used to
+                        mimic wide modules such as Accounts with 150+ fields
+        seed -- random seed, datasets with the same arguments are identical
+        """
+        self.lock = threading.RLock()
+        self.modules = OrderedDict()
+        self.records = {}
+        # Attachments and document revisions: id -> (filename, content)
+        self.files = {}
+        # Document revision id -> (document id, revision)
+        self.revisions = {}
+        # (module, id) -> link name -> related ids
+        self.links = defaultdict(lambda: defaultdict(list))
+        self._random = random.Random(seed)
+
+        for module in modules:
+            fields = OrderedDict(BASE_FIELDS)
+            fields.update(MODULE_FIELDS.get(module, {}))
+            for i in range(extra_fields):
+                fields['field_%d_c' % i] = 'varchar'
+            self.modules[module] = {
+                'table_name': module.lower(),
+                'fields': fields,
+                'links': OrderedDict((other.lower(), other)
+                                     for other in modules if other != module),
+            }
+
+        for module in modules:
+            size = records.get(module, 0) if isinstance(records, dict) else records
+            self.records[module] = OrderedDict()
+            for i in range(size):
+                record = self._make_record(module, i)
+                self.records[module][record['id']] = record
+
+        if 'Accounts' in self.records and 'Contacts' in self.records:
+            accounts = list(self.records['Accounts'])
+            if accounts:
+                for i, contact in enumerate(self.records['Contacts'].values()):
+                    account_id = accounts[i % len(accounts)]
+                    contact['account_id'] = account_id
+                    self.link('Contacts', contact['id'], 'accounts', [account_id])
+
+    def _make_record(self, module, index):
+        rnd = self._random
+        record = {}
+        for field, field_type in self.modules[module]['fields'].items():
+            if field == 'id':
+                value = str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+            elif field == 'name':
+                value = '%s %d' % (module[:-1], index)
+            elif field == 'deleted':
+                value = '0'
+            elif field_type in ('datetime', 'datetimecombo'):
+                value = '20%02d-%02d-%02d %02d:%02d:00' % (
+                    rnd.randint(10, 25), rnd.randint(1, 12), rnd.randint(1, 28),
+                    rnd.randint(0, 23), rnd.randint(0, 59))
+            elif field_type == 'date':
+                value = '20%02d-%02d-%02d' % (rnd.randint(10, 25), rnd.randint(1, 12),
+                                              rnd.randint(1, 28))
+            elif field_type == 'enum':
+                value = rnd.choice(ENUM_OPTIONS.get(field, ['A', 'B']))
+            elif field_type == 'currency':
+                value = '%.2f' % (rnd.randint(100, 1000000) / 100.0)
+            elif field_type == 'int':
+                value = str(rnd.randint(0, 100))
+            elif field_type == 'text':
+                value = 'Description of %s %d & more' % (module, index)
+            elif field_type in ('relate', 'assigned_user_name', 'id'):
+                value = '1'
+            else:
+                value = '%s-%d' % (field, index)
+            record[field] = value
+        return record
+
+    def module_fields(self, module):
+        meta = self.modules[module]
+        fields = OrderedDict()
+        for field, field_type in meta['fields'].items():
+            fields[field] = {
+                'name': field,
+                'type': field_type,
+                'group': '',
+                'id_name': '',
+                'label': field.replace('_', ' ').title() + ':',
+                'required': 1 if field in ('id', 'name') else 0,
+                'options': dict((o, o) for o in ENUM_OPTIONS.get(field, [])),
+                'related_module': '',
+                'calculated': False,
+                'len': '',
+            }
+        link_fields = OrderedDict()
+        for link, other in meta['links'].items():
+            link_fields[link] = {
+                'name': link,
+                'type': 'link',
+                'relationship': '_'.join(sorted([module.lower(), other.lower()])),
+                'module': other,
+                'bean_name': other[:-1],
+            }
+        return {'module_name': module, 'table_name': meta['table_name'],
+                'module_fields': fields, 'link_fields': link_fields}
+
+    def link(self, module, record_id, link, related_ids, delete=False):
+        """Link (or unlink) records, mirroring the relationship on both sides."""
+        other = self.modules[module]['links'].get(link)
+        if other is None:
+            return 0
+        changed = 0
+        for related_id in related_ids:
+            if related_id not in self.records.get(other, {}):
+                continue
+            forward = self.links[(module, record_id)][link]
+            backward = self.links[(other, related_id)][module.lower()]
+            if delete:
+                if related_id in forward:
+                    forward.remove(related_id)
+                    backward.remove(record_id)
+                    changed += 1
+            elif related_id not in forward:
+                forward.append(related_id)
+                backward.append(record_id)
+                changed += 1
+        return changed
+
+
+class StubSugarcrm:
+    """Implementation of the REST v4 methods over a Dataset.
+
+    Each public `do_<method>` receives the positional `rest_data` arguments
+    after the session id and returns the JSON-serializable response.
+    """
+
+    def __init__(self, dataset, username=None, password=None, max_entries_per_page=20):
+        self.dataset = dataset
+        self.username = username
+        self.password = password
+        # get_entry_list results without max_results are capped to this, as
+        # list_max_entries_per_page does on a real server.
+        self.max_entries_per_page = max_entries_per_page
+        self.sessions = set()
+
+    def dispatch(self, method, args):
+        handler = getattr(self, 'do_' + method, None)
+        if handler is None:
+            return INVALID_REQUEST
+        if isinstance(args, dict):
+            args = list(args.values())
+        if method == 'login':
+            return handler(*args)
+        if not args or args[0] not in self.sessions:
+            return INVALID_SESSION
+        with self.dataset.lock:
+            return handler(*args[1:])
+
+    def expire_sessions(self):
+        """Invalidate every session, forcing clients to login again."""
+        self.sessions.clear()
+
+    # Helpers
+
+    def _records(self, module):
+        return self.dataset.records[module]
+
+    @staticmethod
+    def _name_value_list(record, fields=None):
+        if not fields:
+            fields = list(record.keys())
+        return OrderedDict((f, {'name': f, 'value': record.get(f, '')})
+                           for f in fields)
+
+    def _entry(self, module, record, fields=None):
+        return {'id': record['id'], 'module_name': module,
+                'name_value_list': self._name_value_list(record, fields)}
+
+    def _link_list(self, module, record_id, link_name_to_fields_array):
+        blocks = []
+        if not isinstance(link_name_to_fields_array, list):
+            return blocks
+        for spec in link_name_to_fields_array:
+            link, fields = spec.get('name'), spec.get('value') or []
+            other = self.dataset.modules[module]['links'].get(link)
+            records = []
+            if other:
+                for related_id in self.dataset.links[(module, record_id)][link]:
+                    related = self._records(other).get(related_id)
+                    if related is not None:
+                        records.append(self._name_value_list(related, fields))
+            blocks.append({'name': link, 'records': records})
+        return blocks
+
+    @staticmethod
+    def _order(records, order_by):
+        for part in reversed([p.strip() for p in (order_by or '').split(',') if p.strip()]):
+            column, _, direction = part.partition(' ')
+            field = column.rsplit('.', 1)[-1]
+            records.sort(key=lambda r: str(r.get(field) or ''),
+                         reverse=direction.strip().lower() == 'desc')
+        return records
+
+    def _select(self, module, query, deleted):
+        # Like SugarCRM, deleted=1 selects the deleted records only.
+        match = QueryMatcher(query)
+        return [r for r in self._records(module).values()
+                if (str(r.get('deleted')) == '1') == bool(int(deleted or 0)) and match(r)]
+
+    @staticmethod
+    def _to_dict(name_value_list):
+        if isinstance(name_value_list, dict):
+            return dict((k, v['value'] if isinstance(v, dict) else v)
+                        for k, v in name_value_list.items())
+        return dict((nv['name'], nv['value']) for nv in name_value_list)
+
+    # REST v4 methods
+
+    def do_login(self, user_auth, application_name='', name_value_list=None):
+        if self.username is not None:
+            expected = hashlib.md5(self.password.encode('utf-8')).hexdigest()
+            if user_auth.get('user_name') != self.username or \
+                    user_auth.get('password') not in (expected, self.password):
+                return INVALID_LOGIN
+        session = uuid.uuid4().hex
+        self.sessions.add(session)
+        return {'id': session, 'module_name': 'Users',
+                'name_value_list': {'user_id': {'name': 'user_id', 'value': '1'},
+                                    'user_name': {'name': 'user_name',
+                                                  'value': user_auth.get('user_name')}}}
+
+    def do_logout(self, *args):
+        return None
+
+    def do_get_server_info(self, *args):
+        return {'flavor': 'CE', 'version': '6.5.26', 'gmt_time': _now()}
+
+    def do_get_user_id(self, *args):
+        return '1'
+
+    def do_get_available_modules(self, *args):
+        return {'modules': [{'module_key': m, 'module_label': m,
+                             'favorite_enabled': False, 'acls': []}
+                            for m in self.dataset.modules]}
+
+    def do_get_module_fields(self, module, fields=None):
+        if module not in self.dataset.modules:
+            return MISSING_MODULE
+        result = self.dataset.module_fields(module)
+        if fields:
+            result['module_fields'] = OrderedDict((k, v) for k, v in result['module_fields'].items()
+                                                  if k in fields)
+        return result
+
+    def do_get_entries_count(self, module, query='', deleted=0):
+        if module not in self.dataset.modules:
+            return MISSING_MODULE
+        return {'result_count': str(len(self._select(module, query, deleted)))}
+
+    def do_get_entry_list(self, module, query='', order_by='', offset=0, select_fields=None,
+                          link_name_to_fields_array=None, max_results=None, deleted=0,
+                          favorites=False):
+        if module not in self.dataset.modules:
+            return MISSING_MODULE
+        records = self._order(self._select(module, query, deleted), order_by)
+        offset = int(offset or 0)
+        page = records[offset:offset + (int(max_results or 0) or self.max_entries_per_page)]
+        return {
+            'result_count': len(page),
+            'total_count': str(len(records)),
+            'next_offset': offset + len(page),
+            # Generators are encoded item by item, see _encode().
+            'entry_list': (self._entry(module, r, select_fields) for r in page),
+            'relationship_list': (
+                {'link_list': self._link_list(module, r['id'], link_name_to_fields_array)}
+                for r in page) if isinstance(link_name_to_fields_array, list) else [],
+        }
+
+    def do_get_entries(self, module, ids, select_fields=None, link_name_to_fields_array=None,
+                       track_view=False):
+        if module not in self.dataset.modules:
+            return MISSING_MODULE
+        records = [self._records(module)[i] for i in ids if i in self._records(module)]
+        return {
+            'entry_list': [self._entry(module, r, select_fields) for r in records],
+            'relationship_list': [
+                {'link_list': self._link_list(module, r['id'], link_name_to_fields_array)}
+                for r in records] if link_name_to_fields_array else [],
+        }
+
+    def do_get_entry(self, module, record_id, select_fields=None,
+                     link_name_to_fields_array=None, track_view=False):
+        return self.do_get_entries(module, [record_id], select_fields,
+                                   link_name_to_fields_array)
+
+    def do_set_entry(self, module, name_value_list, track_view=False):
+        if module not in self.dataset.modules:
+            return MISSING_MODULE
+        values = self._to_dict(name_value_list)
+        records = self._records(module)
+        record_id = values.get('id')
+        if record_id and record_id in records and not values.get('new_with_id'):
+            record = records[record_id]
+        else:
+            record_id = record_id or str(uuid.uuid4())
+            record = dict((f, '') for f in self.dataset.modules[module]['fields'])
+            record.update({'id': record_id, 'deleted': '0', 'date_entered': _now(),
+                           'created_by': '1', 'modified_user_id': '1'})
+            records[record_id] = record
+        values.pop('new_with_id', None)
+        for field, value in values.items():
+            if field in record:
+                record[field] = value if value is not None else ''
+        record['date_modified'] = _now()
+        sent = [f for f in values if f in record]
+        return {'id': record_id, 'entry_list': self._name_value_list(record, sent)}
+
+    def do_set_entries(self, module, name_value_lists):
+        if module not in self.dataset.modules:
+            return MISSING_MODULE
+        return {'ids': [self.do_set_entry(module, nvl)['id'] for nvl in name_value_lists]}
+
+    def do_get_relationships(self, module, record_id, link_field_name, related_module_query='',
+                             related_fields=None, related_module_link_name_to_fields_array=None,
+                             deleted=0, order_by='', offset=0, limit=False):
+        if module not in self.dataset.modules:
+            return MISSING_MODULE
+        other = self.dataset.modules[module]['links'].get(link_field_name)
+        if other is None:
+            return {'entry_list': [], 'relationship_list': []}
+        match = QueryMatcher(related_module_query)
+        related = [self._records(other)[i]
+                   for i in self.dataset.links[(module, record_id)][link_field_name]
+                   if i in self._records(other)]
+        related = self._order([r for r in related if match(r)], order_by)
+        offset = int(offset or 0)
+        related = related[offset:offset + int(limit)] if limit else related[offset:]
+        return {
+            'entry_list': [self._entry(other, r, related_fields) for r in related],
+            'relationship_list': [
+                self._link_list(other, r['id'], related_module_link_name_to_fields_array)
+                for r in related],
+        }
+
+    def do_search_by_module(self, search_string, modules, offset=0, max_results=10,
+                            assigned_user_id='', select_fields=None, unified_search_only=True,
+                            favorites=False):
+        needle = (search_string or '').replace('%', '').strip().lower()
+        offset = int(offset or 0)
+        blocks = []
+        for module in modules:
+            if module not in self.dataset.modules:
+                continue
+            hits = [r for r in self._records(module).values()
+                    if r.get('deleted') in ('0', 0) and
+                    any(needle in str(r.get(f) or '').lower()
+                        for f in ('name', 'first_name', 'last_name', 'email1'))]
+            hits = hits[offset:offset + int(max_results)] if max_results else hits[offset:]
+            blocks.append({'name': module,
+                           'records': [self._name_value_list(r, select_fields) for r in hits]})
+        return {'entry_list': blocks}
+
+    def do_get_report_entries(self, ids, select_fields=None):
+        reports = []
+        for report_id in ids:
+            if report_id not in self._records('Reports') or \
+                    REPORTED_MODULE not in self.dataset.records:
+                reports.append([])
+                continue
+            fields = select_fields or REPORT_FIELDS
+            reports.append([self._name_value_list(r, fields)
+                            for r in self._records(REPORTED_MODULE).values()])
+        return {'field_list': [list(select_fields or REPORT_FIELDS) for _ in ids],
+                'entry_list': reports}
+
+    def do_set_note_attachment(self, note):
+        if note.get('id') not in self._records('Notes'):
+            return _error('No Records', 'No records', 40)
+        content = base64.b64decode(note.get('file') or '')
+        self.dataset.files[note['id']] = (note.get('filename', ''), content)
+        self._records('Notes')[note['id']]['filename'] = note.get('filename', '')
+        return {'id': note['id']}
+
+    def do_get_note_attachment(self, note_id):
+        record = self._records('Notes').get(note_id)
+        if record is None:
+            return _error('No Records', 'No records', 40)
+        filename, content = self.dataset.files.get(note_id, ('', b''))
+        return {'note_attachment': {'id': note_id, 'filename': filename,
+                                    'file': base64.b64encode(content).decode('ascii'),
+                                    'related_module_id': record.get('parent_id', ''),
+                                    'related_module_name': record.get('parent_type', '')}}
+
+    def do_set_document_revision(self, revision):
+        document = self._records('Documents').get(revision.get('id'))
+        if document is None:
+            return _error('No Records', 'No records', 40)
+        revision_id = str(uuid.uuid4())
+        content = base64.b64decode(revision.get('file') or '')
+        self.dataset.files[revision_id] = (revision.get('filename', ''), content)
+        self.dataset.revisions[revision_id] = (document['id'], revision.get('revision', ''))
+        document['document_revision_id'] = revision_id
+        document['revision'] = revision.get('revision', '')
+        return {'id': revision_id}
+
+    def do_get_document_revision(self, revision_id):
+        if revision_id not in self.dataset.revisions:
+            return _error('No Records', 'No records', 40)
+        document_id, revision = self.dataset.revisions[revision_id]
+        filename, content = self.dataset.files[revision_id]
+        return {'document_revision': {
+            'id': revision_id, 'revision': revision, 'filename': filename,
+            'document_name': self._records('Documents')[document_id]['document_name'],
+            'file': base64.b64encode(content).decode('ascii')}}
+
+    def do_set_relationship(self, module, record_id, link_field_name, related_ids,
+                            name_value_list=None, delete=0):
+        return self.do_set_relationships([module], [record_id], [link_field_name],
+                                         [related_ids], [name_value_list or []], [delete])
+
+    def do_set_relationships(self, module_names, module_ids, link_field_names, related_ids,
+                             name_value_lists=None, delete_array=None):
+        result = {'created': 0, 'failed': 0, 'deleted': 0}
+        for i, (module, record_id, link) in enumerate(zip(module_names, module_ids,
+                                                          link_field_names)):
+            delete = bool(int((delete_array or [])[i])) if i < len(delete_array or []) else False
+            ids = related_ids[i]
+            if module not in self.dataset.modules or \
+                    record_id not in self._records(module) or \
+                    link not in self.dataset.modules[module]['links']:
+                result['failed'] += 1
+                continue
+            other = self.dataset.modules[module]['links'][link]
+            self.dataset.link(module, record_id, link, ids, delete=delete)
+            if any(i not in self._records(other) for i in ids):
+                result['failed'] += 1
+            else:
+                result['deleted' if delete else 'created'] += 1
+        return result
+
+
+class StubServer:
+    """Serve a StubSugarcrm on a local port in a background thread.
+
+    Keyword arguments:
+    dataset -- Dataset to serve; created from **dataset_kwargs if omitted
+    latency -- seconds to sleep before answering each request
+    username, password -- credentials to enforce (any login by default)
+    compression -- gzip responses for clients sending Accept-Encoding: gzip
+    max_entries_per_page -- entries of get_entry_list results when the
+                            client gives no max_results
+    """
+
+    def __init__(self, dataset=None, latency=0.0, username=None, password=None,
+                 compression=True, host='127.0.0.1', port=0, max_entries_per_page=20,
+                 **dataset_kwargs):
+        self.dataset = dataset or Dataset(**dataset_kwargs)
+        self.backend = StubSugarcrm(self.dataset, username, password, max_entries_per_page)
+        self.latency = latency
+        self.compression = compression
+        self.calls = Counter()
+        # Bytes received and sent over the wire, and sent before compression.
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.bytes_out_decoded = 0
+        self._stats_lock = threading.Lock()
+        self._httpd = _ThreadingHTTPServer((host, port), _StubRequestHandler)
+        self._httpd.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return 'http://%s:%d/service/v4/rest.php' % (host, port)
+
+    @property
+    def round_trips(self):
+        return sum(self.calls.values())
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.calls.clear()
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.bytes_out_decoded = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                            name='sugarcrm-stub', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def connect(self, **kwargs):
+        """Return a Sugarcrm connection logged into this server."""
+        from .sugarcrm import Sugarcrm
+        return Sugarcrm(self.url, self.backend.username or 'admin',
+                        self.backend.password or 'admin', **kwargs)
+
+    def handle(self, body, content_encoding='', accept_encoding=''):
+        """Handle a raw request body, return the response body and its
+        Content-Encoding.
+        """
+        wire_size = len(body)
+        if content_encoding == 'gzip':
+            body = gzip.decompress(body)
+        form = urllib.parse.parse_qs(body.decode('utf-8'))
+        method = form.get('method', [''])[0]
+        rest_data = json.loads(form.get('rest_data', ['[]'])[0])
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            result = self.backend.dispatch(method, rest_data)
+        except Exception as e:
+            result = _error('Stub Error', '%s: %s' % (type(e).__name__, e), 1000)
+        with self._stats_lock:
+            self.calls[method] += 1
+            self.bytes_in += wire_size
+        if self.compression and 'gzip' in accept_encoding:
+            return self._compress(self._encode(result)), 'gzip'
+        return self._encode(result), ''
+
+    def _encode(self, result, block_size=64 * 1024):
+        """Yield the JSON encoding of result by blocks of about block_size
+        bytes. Generator members of the top-level object are encoded as arrays
+        one item at a time, so large responses are never held in memory.
+        """
+        def dumps(value):
+            # Like PHP's json_encode, escape slashes.
+            return json.dumps(value).replace('/', '\\/')
+
+        def pieces():
+            if not isinstance(result, dict):
+                yield dumps(result)
+                return
+            yield '{'
+            for i, (key, value) in enumerate(result.items()):
+                yield '%s%s: ' % (', ' if i else '', dumps(key))
+                if isinstance(value, types.GeneratorType):
+                    yield '['
+                    for j, item in enumerate(value):
+                        yield '%s%s' % (', ' if j else '', dumps(item))
+                    yield ']'
+                else:
+                    yield dumps(value)
+            yield '}'
+
+        block, size = [], 0
+        for piece in pieces():
+            block.append(piece)
+            size += len(piece)
+            if size >= block_size:
+                yield self._count(''.join(block).encode('utf-8'), 'bytes_out_decoded')
+                block, size = [], 0
+        yield self._count(''.join(block).encode('utf-8'), 'bytes_out_decoded')
+
+    def _compress(self, blocks):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for block in blocks:
+            yield compressor.compress(block)
+        yield compressor.flush()
+
+    def _count(self, data, counter):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + len(data))
+        return data
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _StubRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            parts = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    break
+                parts.append(self.rfile.read(size))
+                self.rfile.readline()
+            body = b''.join(parts)
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        blocks, encoding = self.server.stub.handle(
+            body, self.headers.get('Content-Encoding', ''),
+            self.headers.get('Accept-Encoding', ''))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for block in blocks:
+            if block:
+                self.server.stub._count(block, 'bytes_out')
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(block), block))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def log_message(self, format, *args):
+        pass
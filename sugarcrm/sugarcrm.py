@@ -1,9 +1,44 @@
 from six.moves import urllib
+from collections import namedtuple
+from contextlib import contextmanager
+import gzip
 import hashlib
 import json
+import logging
+import threading
+import time
+import zlib
 
 from .sugarerror import SugarError, SugarUnhandledException, is_error
-from .settings import API_URL, USERNAME, PASSWORD
+from .streaming import iter_json_object
+from .search import Searcher, DEFAULT_SEARCH_MODULES
+from . import bulk, schema, writebehind
+from .settings import (COMPRESS_REQUESTS, SCHEMA_CACHE_TTL, SCHEMA_SNAPSHOT,
+                       SCHEMA_SNAPSHOT_CHECK)
+
+log = logging.getLogger(__name__)
+
+# A single round-trip to the SugarCRM server.
+# response_size is the decoded body size, wire_size what went over the
+# network (smaller when the response was compressed).
+CallRecord = namedtuple('CallRecord', 'method module query duration response_size wire_size')
+
+# Responses are read and decompressed by chunks of this size.
+CHUNK_SIZE = 64 * 1024
+
+# Request bodies from this size on are gzipped when compression is enabled.
+COMPRESS_MIN_SIZE = 64 * 1024
+
+# Callables invoked with every CallRecord, whatever the connection.
+_call_listeners = []
+
+# Methods whose first argument after the session is a module name.
+_MODULE_METHODS = {'get_module_fields', 'get_entries_count', 'get_entry', 'get_entries',
+                   'get_entry_list', 'set_entry', 'set_entries', 'set_relationship',
+                   'get_relationships'}
+
+# Position of the query string in the arguments of the methods taking one.
+_QUERY_ARG = {'get_entry_list': 1, 'get_entries_count': 1, 'get_relationships': 3}
 
 
 class Sugarcrm:
@@ -13,13 +48,24 @@ class Sugarcrm:
     server.
     """
 
-    def __init__(self, url, username, password, is_ldap_member=False):
+    def __init__(self, url, username, password, is_ldap_member=False,
+                 compress_requests=COMPRESS_REQUESTS, schema_snapshot=SCHEMA_SNAPSHOT,
+                 check_snapshot=SCHEMA_SNAPSHOT_CHECK, schema_ttl=SCHEMA_CACHE_TTL):
         """Constructor for Sugarcrm connection.
 
         Keyword arguments:
         url -- string URL of the sugarcrm REST API
         username -- username to allow login upon construction
         password -- password to allow login upon construction
+        compress_requests -- gzip large request bodies; the web server must
+                             decode them (e.g. Apache 'SetInputFilter DEFLATE')
+        schema_snapshot -- path of a module metadata snapshot to use instead
+                           of fetching it, see sugarcrm.schema
+        check_snapshot -- compare the snapshot's server version with
+                          get_server_info and ignore it when they differ;
+                          snapshots of another URL are always ignored
+        schema_ttl -- seconds module schemas are kept before being fetched
+                      again, None to keep them for the connection's life
         """
         # url which is is called every time a request is made.
         self._url = url
@@ -27,16 +73,64 @@ class Sugarcrm:
         self._username = username
         self._password = password
         self._isldap = is_ldap_member
+        self._compress_requests = compress_requests
+
+        # Bytes sent, received over the wire and received after decoding.
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+
+        # Lists collecting the calls made while capture_calls() is active.
+        self._captures = []
+
+        # Set by close(): callable returning the connection used instead.
+        self.closed = False
+        self._reopen = None
 
         # String which holds the session id of the connection, required at
         # every call after 'login'.
         # Attempt to login.
         self._session = self.login()
 
+        # Results of get_module_fields, the module schemas rarely change:
+        # module name -> (expiry timestamp, schema).
+        self._schemas = {}
+        self._schema_ttl = schema_ttl
+        self._schemas_lock = threading.Lock()
+        self._searcher = None
+        self._write_queue = None
+        self._write_queue_lock = threading.Lock()
+        if writebehind.WRITE_BEHIND_PATH:
+            # Resume the writes queued before a restart.
+            self.get_write_queue()
+
         # Add modules containers
         self.modules = {}
-        self.rst_modules = dict((m['module_key'], m)
-                                for m in self.get_available_modules()['modules'])
+        snapshot = self._load_snapshot(schema_snapshot, check_snapshot)
+        if snapshot is not None:
+            for module_name, module_schema in snapshot['modules'].items():
+                self._set_schema(module_name, module_schema)
+            available_modules = snapshot['available_modules']
+        else:
+            available_modules = self.get_available_modules()['modules']
+        self.rst_modules = dict((m['module_key'], m) for m in available_modules)
+
+    def _load_snapshot(self, path, check):
+        if not path:
+            return None
+        snapshot = schema.load_snapshot(path)
+        if snapshot is not None and snapshot.get('url') != self._url:
+            log.warning('SugarCRM schema snapshot %s was taken from %s, not %s; '
+                        'fetching the metadata instead', path, snapshot.get('url'), self._url)
+            return None
+        if snapshot is not None and check:
+            version = schema.server_version(self.get_server_info())
+            if version != snapshot['server_version']:
+                log.warning('SugarCRM schema snapshot %s was taken from %s, the server runs %s; '
+                            'fetching the metadata instead', path, snapshot['server_version'],
+                            version)
+                return None
+        return snapshot
 
     def __getitem__(self, key):
         if key not in self.rst_modules:
@@ -46,6 +140,79 @@ class Sugarcrm:
             self.modules[key] = SugarEntry(self, key)
         return self.modules[key]
 
+    def get_module_schema(self, module_name):
+        """Return get_module_fields(module_name), fetched again once
+        schema_ttl seconds passed or after invalidate_schema().
+        """
+        cached = self._schemas.get(module_name)
+        if cached is not None and cached[0] > time.time():
+            return cached[1]
+        return self._set_schema(module_name, self.get_module_fields(module_name))
+
+    def _set_schema(self, module_name, module_schema):
+        expires = time.time() + self._schema_ttl if self._schema_ttl else float('inf')
+        with self._schemas_lock:
+            self._schemas[module_name] = (expires, module_schema)
+        return module_schema
+
+    def invalidate_schema(self, module_name=None):
+        """Forget the schema of module_name, or of every module, e.g. after
+        a field was added in Studio. Entries created from then on use the
+        new schema.
+        """
+        with self._schemas_lock:
+            if module_name is None:
+                self._schemas.clear()
+                self.modules.clear()
+            else:
+                self._schemas.pop(module_name, None)
+                self.modules.pop(module_name, None)
+
+    def search(self, search_string, modules=None, fields=None, max_results=10):
+        """Search several modules concurrently, return a dict module -> entries.
+
+        Keyword arguments:
+        search_string -- text to look for
+        modules -- modules to search, Accounts, Contacts, Leads and
+                   Opportunities by default
+        fields -- fields to return for each hit
+        max_results -- maximum number of hits per module
+
+        Results are cached for SUGAR_CRM_SEARCH_CACHE_TTL seconds.
+        """
+        return self._get_searcher().search(search_string, modules or DEFAULT_SEARCH_MODULES,
+                                           fields, max_results)
+
+    def iter_search(self, search_string, modules=None, fields=None, max_results=10):
+        """Like search(), but yield (module, entries) pairs as soon as each
+        module answers.
+        """
+        return self._get_searcher().iter_search(search_string,
+                                                modules or DEFAULT_SEARCH_MODULES,
+                                                fields, max_results)
+
+    def _get_searcher(self):
+        if self._searcher is None:
+            self._searcher = Searcher(self)
+        return self._searcher
+
+    def get_write_queue(self):
+        """Return the WriteBehindQueue of SugarEntry.save(write_behind=True)."""
+        with self._write_queue_lock:
+            if self._write_queue is None:
+                self._write_queue = writebehind.WriteBehindQueue(
+                    self, writebehind.get_backend(self))
+        return self._write_queue
+
+    def flush(self, timeout=None):
+        """Wait until the writes queued by SugarEntry.save() are sent.
+
+        Returns False if timeout seconds passed first.
+        """
+        if self._write_queue is None:
+            return True
+        return self._write_queue.flush(timeout)
+
     def get_user_id(self, *args):
         return self._method_call('get_user_id', *args)
 
@@ -70,6 +237,17 @@ class Sugarcrm:
     def get_entry_list(self, *args):
         return self._method_call('get_entry_list', *args)
 
+    def iter_entry_list(self, *args):
+        """Same arguments as get_entry_list, but yield the items of the
+        'entry_list' as soon as they are received.
+        """
+        return self._method_stream('get_entry_list', ('entry_list',), *args)
+
+    def iter_report_rows(self, report_id, select_fields=None):
+        """Yield the rows of a saved report as soon as they are received."""
+        return self._method_stream('get_report_entries', {'entry_list': 2},
+                                   [report_id], select_fields or [])
+
     def set_entry(self, *args):
         return self._method_call('set_entry', *args)
 
@@ -123,7 +301,27 @@ class Sugarcrm:
     def logout(self, *args):
         return self._method_call('logout', args)
 
+    def close(self, reopen=None):
+        """Log out of the server for good.
+
+        Keyword arguments:
+        reopen -- callable returning the connection later calls are made
+                  with instead, e.g. the current connection of an alias of
+                  sugarcrm.connections; this one logs in again by default
+        """
+        self.logout()
+        self.closed = True
+        self._reopen = reopen
+
+    def _current(self):
+        """Return the connection to call: this one, or the one returned by
+        the reopen callable once it was closed.
+        """
+        return self if self._reopen is None else self._reopen()
+
     def _method_call(self, method_name, *args):
+        if self._reopen is not None:
+            return self._reopen()._method_call(method_name, *args)
         try:
             result = self._sendRequest(method_name,
                                        [self._session] + list(args))
@@ -147,6 +345,53 @@ class Sugarcrm:
 
         return result
 
+    def _method_stream(self, method_name, stream_keys, *args):
+        """Streaming counterpart of _method_call.
+
+        Yields the items of the stream_keys arrays of the response while it
+        is being downloaded, see iter_json_object(). Errors are handled as in
+        _method_call.
+        """
+        if self._reopen is not None:
+            for item in self._reopen()._method_stream(method_name, stream_keys, *args):
+                yield item
+            return
+        for attempt in range(2):
+            members = {}
+            for key, value, is_item in self._streamRequest(method_name,
+                                                           [self._session] + list(args),
+                                                           stream_keys):
+                if is_item:
+                    yield value
+                else:
+                    members[key] = value
+            if not is_error(members):
+                return
+            error = SugarError(members)
+            if error.is_invalid_session and not attempt:
+                # Try to recover if session ID was lost
+                self._session = self.login()
+            elif error.is_missing_module or error.is_null_response:
+                return
+            else:
+                raise SugarUnhandledException('%d, %s - %s' %
+                                              (error.number,
+                                               error.name,
+                                               error.description))
+
+    def _streamRequest(self, method, data, stream_keys):
+        """Sends an API request to the server, yields the (key, value, is_item)
+        members of the response as they are parsed, see iter_json_object().
+        """
+        start = time.time()
+        sizes = [0, 0]
+        try:
+            for member in iter_json_object(self._read_chunks(self._open(method, data), sizes),
+                                           stream_keys):
+                yield member
+        finally:
+            self._record_call(method, data, time.time() - start, sizes[1], sizes[0])
+
     def _sendRequest(self, method, data):
         """Sends an API request to the server, returns a dictionary with the
         server's response.
@@ -159,12 +404,13 @@ class Sugarcrm:
         data -- parameters to the function being called, should be in a list
                 sorted by order of items
         """
-        data = json.dumps(data)
-        args = {'method': method, 'input_type': 'json',
-                'response_type': 'json', 'rest_data': data}
-        params = urllib.parse.urlencode(args).encode('utf-8')
-        response = urllib.request.urlopen(self._url, params)
-        response = response.read().strip()
+        start = time.time()
+        sizes = [0, 0]
+        try:
+            response = b''.join(self._read_chunks(self._open(method, data), sizes)).strip()
+        finally:
+            # Failed calls, e.g. HTTP errors, are recorded too.
+            self._record_call(method, data, time.time() - start, sizes[1], sizes[0])
         if not response:
             raise SugarError({'name': 'Empty Result',
                               'description': 'No data from SugarCRM.',
@@ -177,6 +423,110 @@ class Sugarcrm:
             raise SugarError(result)
         return result
 
+    def _open(self, method, data):
+        """Post an API request, return the HTTP response."""
+        args = {'method': method, 'input_type': 'json',
+                'response_type': 'json', 'rest_data': json.dumps(data)}
+        params = urllib.parse.urlencode(args).encode('utf-8')
+        headers = {}
+        if self._compress_requests and len(params) >= COMPRESS_MIN_SIZE:
+            params = gzip.compress(params)
+            headers['Content-Encoding'] = 'gzip'
+        self.bytes_sent += len(params)
+        return self._post(params, headers)
+
+    def _post(self, body, headers=None):
+        """Post a request body to the API URL, return the HTTP response.
+
+        body may also be an iterable of bytes, sent with chunked transfer
+        encoding unless a Content-Length header is given.
+        """
+        all_headers = {'Accept-Encoding': 'gzip, deflate',
+                       'Content-Type': 'application/x-www-form-urlencoded'}
+        all_headers.update(headers or {})
+        return urllib.request.urlopen(urllib.request.Request(self._url, body, all_headers))
+
+    def _read_chunks(self, response, sizes):
+        """Yield the body of a response by chunks, decompressing on the fly.
+
+        sizes -- two items list, incremented by the wire and decoded sizes
+        """
+        # Closed in any case, e.g. when the consumer stops iterating early
+        # and the generator is closed.
+        try:
+            encoding = response.headers.get('Content-Encoding', '').strip().lower()
+            decompressor = None
+            if encoding in ('gzip', 'x-gzip'):
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            elif encoding == 'deflate':
+                decompressor = zlib.decompressobj()
+            first = True
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                sizes[0] += len(chunk)
+                self.bytes_received += len(chunk)
+                if decompressor is not None:
+                    try:
+                        chunk = decompressor.decompress(chunk)
+                    except zlib.error:
+                        # Some servers send raw deflate data without zlib header.
+                        if encoding != 'deflate' or not first:
+                            raise
+                        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                        chunk = decompressor.decompress(chunk)
+                first = False
+                if chunk:
+                    sizes[1] += len(chunk)
+                    self.bytes_decoded += len(chunk)
+                    yield chunk
+            if decompressor is not None:
+                chunk = decompressor.flush()
+                if chunk:
+                    sizes[1] += len(chunk)
+                    self.bytes_decoded += len(chunk)
+                    yield chunk
+        finally:
+            response.close()
+
+    def _record_call(self, method, data, duration, response_size, wire_size):
+        module = query = None
+        if isinstance(data, list) and len(data) > 1:
+            args = data[1:]
+            if method in _MODULE_METHODS:
+                module = args[0]
+            if method in _QUERY_ARG and len(args) > _QUERY_ARG[method]:
+                query = args[_QUERY_ARG[method]]
+        record = CallRecord(method, module, query, duration, response_size, wire_size)
+        log.debug('%s %s %r (%.3fs, %d bytes, %d on the wire)', method, module or '',
+                  query or '', duration, response_size, wire_size)
+        for calls in self._captures:
+            calls.append(record)
+        for listener in _call_listeners:
+            listener(record)
+
+    @contextmanager
+    def capture_calls(self):
+        """Record every call made through this connection.
+
+        Yields a list which receives a CallRecord (method, module, query,
+        duration, response_size) per round-trip to the server.
+        """
+        calls = []
+        self._captures.append(calls)
+        try:
+            yield calls
+        finally:
+            self._captures.remove(calls)
+
+    @contextmanager
+    def assert_max_calls(self, num):
+        """Fail with AssertionError if the block makes more than num calls."""
+        with self.capture_calls() as calls:
+            yield calls
+        _check_max_calls(calls, num)
+
     def relate(self, main, *secondary, **kwargs):
         """
           Relate two or more SugarEntry objects.
@@ -199,6 +549,21 @@ class Sugarcrm:
                            'value': '%d' % (i + 1)}] for i in range(len(secondary))])
         return self.set_relationships(*args)
 
+    def bulk_relate(self, links, chunk_size=100, max_workers=4):
+        """
+          Relate many (parent, child, link_name) triples, across any number
+          of parents and modules, with chunked concurrent set_relationships
+          calls. Returns a BulkRelateResult listing the failed triples.
+        """
+        return bulk.bulk_relate(self, links, False, chunk_size, max_workers)
+
+    def bulk_unrelate(self, links, chunk_size=100, max_workers=4):
+        """
+          Remove the relationships of many (parent, child, link_name) triples,
+          see bulk_relate().
+        """
+        return bulk.bulk_relate(self, links, True, chunk_size, max_workers)
+
     @property
     def password(self):
         """
@@ -213,9 +578,49 @@ class Sugarcrm:
         return result
 
 
-def get_connection(url=API_URL, username=USERNAME, password=PASSWORD):
-    if url and username and password:
-        return Sugarcrm(url, username, password)
-    raise SugarError({'name': 'Empty connection settings',
-                      'description': 'Empty connection settings',
-                      'number': 10})
+def _check_max_calls(calls, num):
+    if len(calls) > num:
+        raise AssertionError(
+            '%d calls to SugarCRM were made, expected at most %d:\n%s' % (
+                len(calls), num,
+                '\n'.join('  %s %s %s' % (c.method, c.module or '', c.query or '')
+                          for c in calls)))
+
+
+@contextmanager
+def capture_calls():
+    """Record the calls made through every connection, see Sugarcrm.capture_calls()."""
+    calls = []
+    _call_listeners.append(calls.append)
+    try:
+        yield calls
+    finally:
+        _call_listeners.remove(calls.append)
+
+
+@contextmanager
+def assert_max_calls(num):
+    """Fail with AssertionError if the block makes more than num calls through
+    any connection.
+    """
+    with capture_calls() as calls:
+        yield calls
+    _check_max_calls(calls, num)
+
+
+def get_connection(url=None, username=None, password=None, using=None):
+    """Return a connection to a SugarCRM instance.
+
+    Keyword arguments:
+    url, username, password -- log in to this instance with a new connection
+    using -- alias of sugarcrm.connections to get a shared connection from,
+             'default' (SUGAR_CRM_URL, ...) when neither url nor using is given
+    """
+    if url or username or password:
+        if url and username and password:
+            return Sugarcrm(url, username, password)
+        raise SugarError({'name': 'Empty connection settings',
+                          'description': 'Empty connection settings',
+                          'number': 10})
+    from .connections import connections, DEFAULT_CONNECTION_ALIAS
+    return connections[using or DEFAULT_CONNECTION_ALIAS]
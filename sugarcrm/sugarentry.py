@@ -1,34 +1,49 @@
 from __future__ import print_function
 
 import logging
+import os
+import uuid
 
 import six
-from six.moves.html_parser import HTMLParser
 from collections import defaultdict
 from itertools import count
 
 from .sugarcrm import get_connection
 from .sugarquerylist import QueryList
-from .sugarerror import ObjectDoesNotExist, MultipleObjectsReturned
+from . import reports, transfer
+from .sugarerror import ObjectDoesNotExist, MultipleObjectsReturned, SugarError
+from .settings import DEFAULT_FIELDS, WRITE_BEHIND, TYPED_FIELDS
+from .fields import to_python, to_sugar, unescape
 
 from .rest_framework import Meta
 
-
-HTMLP = HTMLParser()
-
 log = logging.getLogger(__name__)
 
 
 class SugarEntry:
     """Define an entry of a SugarCRM module."""
+
+    # Fields fetched by queries which don't call only() or defer(). None
+    # falls back to settings.SUGAR_CRM_DEFAULT_FIELDS, then to all fields.
+    default_fields = None
+
+    # Server computed fields reloaded by save() after creating an entry.
+    refresh_fields = ()
+
+    # Convert field values to Python types on access, see sugarcrm.fields.
+    # None falls back to settings.SUGAR_CRM_TYPED_FIELDS.
+    typed_fields = None
+
     _hashes = defaultdict(count(1).next if hasattr(count(1), 'next') else count(1).__next__)
 
-    def __init__(self, connection=None, module_name=None, **initial_values):
+    def __init__(self, connection=None, module_name=None, using=None, **initial_values):
         """Represents a new or an existing entry.
 
         Keyword arguments:
         connection -- Sugarcrm object to connect to a server
         name -- name of SugarCRM module that this class will represent
+        using -- alias of the connection to use when connection isn't given,
+                 see sugarcrm.connections
         initial_values -- initial field values
         """
 
@@ -36,14 +51,15 @@ class SugarEntry:
             self.module_name = module_name
 
         self._meta = Meta(self.module_name)
+        self._using = using
 
         if connection:
             self._connection = connection
         else:
-            self._connection = get_connection()
+            self._connection = get_connection(using=using)
 
-        # Get the module fields through SugarCRM API.
-        result = self._connection.get_module_fields(self.module_name)
+        # Get the module fields through SugarCRM API, once per connection.
+        result = self._connection.get_module_schema(self.module_name)
         if result is None:
             return
 
@@ -59,6 +75,8 @@ class SugarEntry:
 
         # Keep a mapping 'field_name' => value for every valid field retrieved.
         self._fields = {}
+        # Values of _fields converted by to_python(), when typed_fields is set.
+        self._converted = {}
         self._dirty_fields = []
 
         # Allow initial fields in constructor.
@@ -101,13 +119,19 @@ class SugarEntry:
                                                       list(fieldlist), 1, 0)
         if not res['entry_list'] or not res['entry_list'][0]['name_value_list']:
             for field in fieldlist:
-                self[field] = ''
+                self._set_clean(field, '')
             return
         for prop, obj in list(res['entry_list'][0]['name_value_list'].items()):
-            if obj['value']:
-                self[prop] = HTMLP.unescape(obj['value'])
+            if not obj['value']:
+                self._set_clean(prop, '')
+            elif self._is_typed():
+                # Unescaped on access.
+                self._set_clean(prop, obj['value'])
             else:
-                self[prop] = ''
+                self._set_clean(prop, unescape(obj['value']))
+
+    def _is_typed(self):
+        return TYPED_FIELDS if self.typed_fields is None else self.typed_fields
 
     def __getitem__(self, field_name):
         """Return the value of the field 'field_name' of this SugarEntry.
@@ -126,14 +150,27 @@ class SugarEntry:
 
         if field_name not in self._fields:
             self._retrieve([field_name])
-        return self._fields[field_name]
-    
+        if not self._is_typed():
+            return self._fields[field_name]
+        try:
+            return self._converted[field_name]
+        except KeyError:
+            value = to_python(self._available_fields[field_name], self._fields[field_name])
+            self._converted[field_name] = value
+            return value
+
+    def __getattr__(self, name):
+        # Only called when normal lookup fails: fields as attributes, those
+        # not loaded yet retrieved once the entry has an id, e.g. after save().
+        fields = self.__dict__.get('_fields')
+        if fields is not None and name in self._available_fields and \
+                (name in fields or fields.get('id')):
+            return self[name]
+        raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+
     def __setattr__(self, key, value):
         if hasattr(self, '_available_fields') and key in self._available_fields:
-            self.__dict__[key] = value
-            self._fields[key] = value
-            if key not in self._dirty_fields:
-                self._dirty_fields.append(key)
+            self[key] = value
         else:
             super(SugarEntry, self).__setattr__(key, value)
 
@@ -146,8 +183,10 @@ class SugarEntry:
         """
 
         if field_name in self._available_fields:
-            self.__dict__[field_name] = value
+            if self._is_typed():
+                value = to_sugar(self._available_fields[field_name], value)
             self._fields[field_name] = value
+            self._converted.pop(field_name, None)
             if field_name not in self._dirty_fields:
                 self._dirty_fields.append(field_name)
         else:
@@ -169,7 +208,7 @@ class SugarEntry:
         """
 
         if fields is None:
-            fields = list(self._available_fields.keys())
+            fields = self.get_default_fields()
         if links_to_names is None:
             links_to_names = []
 
@@ -189,11 +228,7 @@ class SugarEntry:
             result['total'] = 0
 
         for idx, record in enumerate(resp_data['entry_list']):
-            entry = SugarEntry(self._connection, self.module_name)
-            for key, obj in list(record['name_value_list'].items()):
-                val = obj['value']
-                setattr(entry, key, val)
-            entry.related_beans = defaultdict(list)
+            entry = self._entry_from_record(record)
             try:
                 linked = resp_data['relationship_list'][idx]
                 for block in linked['link_list']:
@@ -204,48 +239,123 @@ class SugarEntry:
         result['entries'] = entry_list
         return result
 
+    def _iter_search(self, query_str, order_by='', offset='', limit='', fields=None):
+        """Yield the entries matching a query while the response is being
+        downloaded. Arguments are the same as _search(); related entries are
+        sent after the entry list by the server, hence not supported.
+        """
+        if fields is None:
+            fields = self.get_default_fields()
+        for record in self._connection.iter_entry_list(self.module_name, query_str, order_by,
+                                                       offset, fields, [], limit, 0):
+            yield self._entry_from_record(record)
+
+    def _entry_from_record(self, record):
+        """Build an entry of this module from an 'entry_list' record."""
+        entry = type(self)(self._connection, self.module_name, using=self._using)
+        for key, obj in list(record['name_value_list'].items()):
+            if key in entry._available_fields:
+                entry._set_clean(key, obj['value'])
+            else:
+                setattr(entry, key, obj['value'])
+        entry.related_beans = defaultdict(list)
+        return entry
+
     def fields(self):
         return self._fields
 
-    def save(self):
+    def get_default_fields(self):
+        """Return the fields fetched when a query has no explicit projection."""
+        fields = self.default_fields or DEFAULT_FIELDS.get(self.module_name)
+        if not fields:
+            return list(self._available_fields.keys())
+        fields = [f for f in fields if f in self._available_fields]
+        if 'id' not in fields:
+            fields.insert(0, 'id')
+        return fields
+
+    def save(self, update_fields=None, refresh_fields=None, write_behind=None):
         """Save this entry in the SugarCRM server.
 
         If the 'id' field is blank, it creates a new entry and sets the
         'id' value.
+
+        Keyword arguments:
+        update_fields -- if set, only these dirty fields are sent; the other
+                         dirty fields are kept for a later save()
+        refresh_fields -- fields computed by the server to reload with a
+                          single get_entry after creating the entry.
+                          Defaults to the refresh_fields class attribute;
+                          other fields are loaded lazily on access.
+        write_behind -- queue the fields to be sent in the background with
+                        the other saves of this entry, see
+                        sugarcrm.writebehind. Defaults to
+                        settings.SUGAR_CRM_WRITE_BEHIND.
         """
-        is_new_object = True
+        is_new_object = self['id'] == ''
+
+        saved_fields = set(self._dirty_fields)
+        if update_fields is not None:
+            saved_fields &= set(update_fields)
+
+        if WRITE_BEHIND if write_behind is None else write_behind:
+            if is_new_object:
+                self._set_clean('id', str(uuid.uuid4()))
+            self._connection.get_write_queue().put(
+                self.module_name, self['id'],
+                dict((field, self._fields[field]) for field in saved_fields if field != 'id'),
+                new=is_new_object)
+            self._dirty_fields = [f for f in self._dirty_fields if f not in saved_fields]
+            return
 
-        # If 'id' wasn't blank, it's added to the list of dirty fields; this
-        # way the entry will be updated in the SugarCRM connection.
-        if self['id'] != '':
-            self._dirty_fields.append('id')
-            is_new_object = False
+        # If 'id' wasn't blank, it's added to the saved fields; this way the
+        # entry will be updated in the SugarCRM connection.
+        if not is_new_object:
+            saved_fields.add('id')
 
         # nvl is the name_value_list, which has the list of attributes.
         nvl = []
-        for field in set(self._dirty_fields):
+        for field in saved_fields:
             # Define an individual name_value record.
-            nv = dict(name=field, value=self[field])
+            nv = dict(name=field, value=self._fields[field])
             nvl.append(nv)
 
         # Use the API's set_entry to update the entry in SugarCRM.
         result = self._connection.set_entry(self.module_name, nvl)
         try:
-            setattr(self, 'id', result['id'])
+            self._set_clean('id', result['id'])
         except:
             print(result)
+            return
 
-        # fetch all fields for new object
-        if is_new_object:
-            obj = self.objects.get(id=self.id)
+        # set_entry answers with the stored values of the fields it received.
+        for field, obj in (result.get('entry_list') or {}).items():
+            if field in self._available_fields:
+                self._set_clean(field, obj['value'])
 
-            for field, value in obj.fields().items():
-                setattr(self, field, value)
-        self._dirty_fields = []
+        if is_new_object:
+            if refresh_fields is None:
+                refresh_fields = self.refresh_fields
+            if refresh_fields:
+                self._refresh(refresh_fields)
+        self._dirty_fields = [f for f in self._dirty_fields if f not in saved_fields]
+
+    def _set_clean(self, field_name, value):
+        """Store a value coming from the server, without marking it dirty."""
+        self._fields[field_name] = value
+        self._converted.pop(field_name, None)
+
+    def _refresh(self, fieldlist):
+        """Reload the given fields with a single get_entry call."""
+        res = self._connection.get_entry(self.module_name, self['id'], list(fieldlist))
+        if not res or not res['entry_list']:
+            return
+        for field, obj in res['entry_list'][0]['name_value_list'].items():
+            self._set_clean(field, obj['value'])
 
     def delete(self):
         self.deleted = 1
-        self.save()
+        self.save(update_fields=['deleted'])
 
     def relate(self, *related, **kwargs):
         """
@@ -287,22 +397,19 @@ class SugarEntry:
                                               links_to_fields)
         entries = []
         for idx, elem in enumerate(result['entry_list']):
-            entry = SugarEntry(module)
+            entry = SugarEntry(connection, module.module_name)
             for name, field in list(elem['name_value_list'].items()):
                 val = field['value']
-                entry._fields[name] = HTMLP.unescape(val) if isinstance(val, basestring) else val
-                entry.related_beans = defaultdict(list)
-                #                 try:
-                linked = result['relationship_list'][idx]
-                for relmod in linked:
-                    for record in relmod['records']:
-                        relentry = {}
-                        for fname, fmap in record.items():
-                            rfield = fmap['value']
-                            relentry[fname] = HTMLP.unescape(rfield) if isinstance(rfield, six.string_types) else val
-                        entry.related_beans[relmod['name']].append(relentry)
-                        #                 except:
-                        #                     pass
+                entry._fields[name] = val if entry._is_typed() else unescape(val)
+            entry.related_beans = defaultdict(list)
+            linked = result['relationship_list'][idx] if idx < len(result['relationship_list']) else []
+            for relmod in linked:
+                for record in relmod['records']:
+                    relentry = {}
+                    for fname, fmap in record.items():
+                        rfield = fmap['value']
+                        relentry[fname] = unescape(rfield)
+                    entry.related_beans[relmod['name']].append(relentry)
 
             entries.append(entry)
 
@@ -317,7 +424,7 @@ class SugarEntry:
         specific objects by calling 'filter' and 'exclude' on the returned
         object.
         """
-        return QueryList(self, fields=None, links_to_names=None)
+        return QueryList(self, fields=None, links_to_names=None, using=self._using)
 
 
 class Call(SugarEntry):
@@ -335,6 +442,53 @@ class Contact(SugarEntry):
 class Document(SugarEntry):
     module_name = "Documents"
 
+    def download_revision(self, dest, revision_id=None, progress=None):
+        """Stream a revision of this document to a path or binary file object.
+
+        Keyword arguments:
+        dest -- path or binary file object to write to
+        revision_id -- revision to download, the current one by default
+        progress -- callable(received_bytes, None) called after each chunk
+
+        Returns the revision metadata (id, document_name, revision, filename).
+        """
+        result = transfer.download(self._connection, 'get_document_revision',
+                                   revision_id or self['document_revision_id'], dest,
+                                   progress)
+        return (result or {}).get('document_revision')
+
+    def upload_revision(self, source, revision, filename=None, chunk_size=transfer.CHUNK_SIZE,
+                        progress=None):
+        """Stream a path or binary file object as a new revision of this
+        document, return the id of the revision.
+
+        Keyword arguments:
+        source -- path or binary file object to upload
+        revision -- revision number or label
+        filename -- name of the file, defaults to the source's name
+        chunk_size -- bytes of the file read and encoded at a time
+        progress -- callable(sent_bytes, total_bytes) called after each chunk
+        """
+        source_name = filename
+        if source_name is None:
+            source_name = os.path.basename(source if isinstance(source, six.string_types)
+                                           else getattr(source, 'name', '') or '')
+        result = transfer.upload(self._connection, 'set_document_revision',
+                                 {'id': self['id'], 'document_name': self['document_name'],
+                                  'revision': revision, 'filename': source_name},
+                                 source, chunk_size, progress)
+        if not result:
+            raise SugarError({'name': 'Empty Result',
+                              'description': 'No data from SugarCRM.',
+                              'number': 0})
+        revision_id = result.get('id') if isinstance(result, dict) else None
+        if not revision_id or revision_id in (-1, '-1'):
+            raise SugarError({'name': 'Revision Not Created',
+                              'description': 'set_document_revision returned %r' % (result,),
+                              'number': 0})
+        self._set_clean('document_revision_id', revision_id)
+        return revision_id
+
 
 class Email(SugarEntry):
     module_name = "Emails"
@@ -351,6 +505,35 @@ class Module(SugarEntry):
 class Note(SugarEntry):
     module_name = "Notes"
 
+    def download(self, dest, progress=None):
+        """Stream the attachment of this note to a path or binary file object.
+
+        Keyword arguments:
+        dest -- path or binary file object to write to
+        progress -- callable(received_bytes, None) called after each chunk
+
+        Returns the attachment metadata (id, filename, related_module_id, ...).
+        """
+        result = transfer.download(self._connection, 'get_note_attachment', self['id'], dest,
+                                   progress)
+        return (result or {}).get('note_attachment')
+
+    def upload(self, source, filename=None, chunk_size=transfer.CHUNK_SIZE, progress=None):
+        """Stream a path or binary file object as the attachment of this note.
+
+        Keyword arguments:
+        source -- path or binary file object to upload
+        filename -- name of the attachment, defaults to the source's name
+        chunk_size -- bytes of the file read and encoded at a time
+        progress -- callable(sent_bytes, total_bytes) called after each chunk
+        """
+        if filename is None:
+            filename = os.path.basename(source if isinstance(source, six.string_types)
+                                        else getattr(source, 'name', '') or '')
+        transfer.upload(self._connection, 'set_note_attachment',
+                        {'id': self['id'], 'filename': filename}, source, chunk_size, progress)
+        self._set_clean('filename', filename)
+
 
 class Opportunity(SugarEntry):
     module_name = "Opportunities"
@@ -375,6 +558,19 @@ class Quote(SugarEntry):
 class Report(SugarEntry):
     module_name = "Reports"
 
+    def execute(self, fields=None, ttl=None, cache=True):
+        """Run this saved report and return its rows as a ReportTable.
+
+        Keyword arguments:
+        fields -- columns to return, all by default
+        ttl -- seconds the result is reused for, SUGAR_CRM_REPORT_CACHE_TTL
+               by default; it is refreshed in the background before expiry
+        cache -- set to False to always run the report on the server
+        """
+        if not cache:
+            return reports.fetch(self._connection, self['id'], fields)
+        return reports.execute(self._connection, self['id'], fields, ttl)
+
 
 class User(SugarEntry):
     module_name = "Users"
@@ -35,7 +35,7 @@ def is_error(data):
         if data['name'] in ('Module Does Not Exist',):
             return True
         return data["name"] is not None and data["description"] is not None
-    except KeyError:
+    except (KeyError, TypeError):
         return False
 
 
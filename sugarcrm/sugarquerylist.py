@@ -2,23 +2,131 @@ from __future__ import unicode_literals
 
 import copy
 import logging
+import threading
+from concurrent.futures import Future, wait
 
 from six.moves import html_parser
 
+from . import aggregates, bulk
+from .connections import connections
+from .executor import start_thread
+from .fields import to_sugar
+from .replica import get_read_replica, get_replica
+from .settings import AGGREGATE_PAGE_SIZE, QUERY_WINDOW_SIZE
+
 HTMLP = html_parser.HTMLParser()
 
 log = logging.getLogger(__name__)
 
 
+class _WindowCache:
+    """Sparse cache of the pages of a query's results read by index or slice.
+
+    Missing pages are fetched together, one request per contiguous run.
+    When a read starts where the previous one stopped, the next page is
+    fetched in a background thread.
+    """
+
+    def __init__(self, queryset, page_size):
+        self._queryset = queryset
+        self.page_size = page_size
+        self._pages = {}
+        # Page -> Future of its background fetch.
+        self._pending = {}
+        # Number of results, known once a short page was read.
+        self._end = None
+        self._last_stop = None
+        self._lock = threading.Lock()
+
+    def get(self, start, stop):
+        """Return the entries from start to stop."""
+        size = self.page_size
+        if self._end is not None:
+            stop = min(stop, self._end)
+        with self._lock:
+            sequential = start == self._last_stop
+            self._last_stop = stop
+        if start >= stop:
+            return []
+        first, last = start // size, (stop - 1) // size
+        self._load(first, last)
+        entries = []
+        with self._lock:
+            for page in range(first, last + 1):
+                entries.extend(self._pages.get(page, ()))
+        if sequential:
+            self._prefetch(last + 1)
+        return entries[start - first * size:stop - first * size]
+
+    def _beyond_end(self, page):
+        return self._end is not None and page * self.page_size >= self._end
+
+    def _load(self, first, last):
+        with self._lock:
+            pending = [self._pending[p] for p in range(first, last + 1) if p in self._pending]
+        # A failed prefetch leaves its page missing, it is fetched again below.
+        wait(pending)
+        with self._lock:
+            missing = [p for p in range(first, last + 1)
+                       if p not in self._pages and not self._beyond_end(p)]
+        runs = []
+        for page in missing:
+            if runs and runs[-1][1] == page - 1:
+                runs[-1][1] = page
+            else:
+                runs.append([page, page])
+        for run_first, run_last in runs:
+            self._fetch(run_first, run_last)
+
+    def _fetch(self, first, last):
+        size = self.page_size
+        qs = self._queryset._chain()
+        qs.set_limits(first * size, (last + 1) * size)
+        entries = list(qs.iterator())
+        with self._lock:
+            for page in range(first, last + 1):
+                chunk = entries[(page - first) * size:(page - first + 1) * size]
+                if chunk:
+                    self._pages[page] = chunk
+                if len(chunk) < size:
+                    self._end = page * size + len(chunk)
+                    break
+
+    def _prefetch(self, page):
+        with self._lock:
+            if page in self._pages or page in self._pending or self._beyond_end(page):
+                return
+            future = self._pending[page] = Future()
+
+        def run():
+            try:
+                self._fetch(page, page)
+                future.set_result(None)
+            except Exception as e:
+                log.warning('Cannot prefetch %s entries: %s', self._queryset, e)
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._pending[page]
+
+        start_thread(run)
+
+
 class QueryList:
     """Query a SugarCRM module for specific entries."""
 
-    def __init__(self, entry, query='', order_by='', limit='', offset='', fields=None, links_to_names=None):
+    def __init__(self, entry, query='', order_by='', limit='', offset='', fields=None, links_to_names=None,
+                 lookups=None, using=None, values=None, annotations=None):
         """Constructor for QueryList.
 
         Keyword arguments:
         entry -- SugarEntry object to query
         query -- SQL query to be passed to the API
+        lookups -- the (negated, filter kwargs) pairs query was built from,
+                   ANDed together; used to run the query on a replica
+        using -- alias of the backend to read from, see using()
+        values -- fields of the dicts yielded instead of entries, see values()
+        annotations -- aggregates computed per group of values, see annotate()
         """
 
         self.model = entry
@@ -32,12 +140,17 @@ class QueryList:
         self._sent = 0
         self._fields = fields
         self._links_to_names = links_to_names
+        self._lookups = lookups or []
+        self._using = using
+        self._values = values
+        self._annotations = annotations
+        self._window = None
 
     def __deepcopy__(self, memo):
         """Don't populate the QuerySet's cache."""
         obj = self.__class__()
         for k, v in self.__dict__.items():
-            if k == '_result_cache':
+            if k in ('_result_cache', '_window'):
                 obj.__dict__[k] = None
             else:
                 obj.__dict__[k] = copy.deepcopy(v, memo)
@@ -46,8 +159,17 @@ class QueryList:
     def __repr__(self):
         return '<%s %s>' % (self.__class__.__name__, self.model.module_name)
 
+    def _replica(self):
+        # Replicas don't store relationships.
+        if self._links_to_names:
+            return None
+        return get_read_replica(self.model.module_name, self._using)
+
     def _fetch_all(self):
         # run query
+        if self._result_cache is None and (self._replica() is not None or
+                                           self._values is not None):
+            self._result_cache = list(self.iterator())
         if self._result_cache is None:
             result = self.model._search(self._query, self._order_by, self._offset, self._limit, self._fields,
                                         self._links_to_names)
@@ -59,9 +181,55 @@ class QueryList:
         return len(self._result_cache)
 
     def __iter__(self):
+        if self._result_cache is None and not self._links_to_names and self._annotations is None:
+            return self._iter_and_cache()
         self._fetch_all()
         return iter(self._result_cache)
 
+    def _iter_and_cache(self):
+        # Hand out the entries while they are downloaded, cache them once
+        # the whole response has been read. A loop left early (break, an
+        # exception) closes the response and caches nothing: the next
+        # iteration fetches the entries again. Keeping the partial result
+        # would mean keeping the response, and its socket, open until then.
+        if self._result_cache is not None:
+            # Fetched before the first entry was asked for, e.g. by the
+            # __len__() call of list(queryset).
+            for entry in self._result_cache:
+                yield entry
+            return
+        entries = []
+        for entry in self.iterator():
+            entries.append(entry)
+            yield entry
+        self._result_cache = entries
+
+    def iterator(self):
+        """Iterate over the entries as soon as they are parsed from the
+        response, without caching them.
+
+        Memory use stays around one entry whatever the size of the result,
+        which suits exports and other single pass jobs.
+        """
+        if self._annotations is not None:
+            return iter(self._annotate_groups())
+        entries = self._iter_entries()
+        if self._values is not None:
+            return (dict((f, entry[f]) for f in self._values) for entry in entries)
+        return entries
+
+    def _iter_entries(self):
+        replica = self._replica()
+        if replica is not None:
+            return replica.search(self.model, self._lookups, self._order_by, self._offset,
+                                  self._limit, self._fields)
+        if self._links_to_names:
+            result = self.model._search(self._query, self._order_by, self._offset, self._limit,
+                                        self._fields, self._links_to_names)
+            return iter(result.get('entries', []))
+        return self.model._iter_search(self._query, self._order_by, self._offset, self._limit,
+                                       self._fields)
+
     def __bool__(self):
         self._fetch_all()
         return bool(self._result_cache)
@@ -82,8 +250,12 @@ class QueryList:
         if self._result_cache is not None:
             return self._result_cache[k]
 
+        if self._annotations is not None:
+            # Groups are computed from all the entries at once.
+            self._fetch_all()
+            return self._result_cache[k]
+
         if isinstance(k, slice):
-            qs = self._chain()
             if k.start is not None:
                 start = int(k.start)
             else:
@@ -93,15 +265,31 @@ class QueryList:
             else:
                 stop = None
 
+            if stop is not None and QUERY_WINDOW_SIZE:
+                entries = self._get_window().get(start or 0, stop)
+                return entries[::k.step] if k.step else entries
+
+            qs = self._chain()
             qs.set_limits(start, stop)
             qs._fetch_all()
             return qs._result_cache[::k.step] if k.step else qs._result_cache
 
+        if QUERY_WINDOW_SIZE:
+            entries = self._get_window().get(k, k + 1)
+            if not entries:
+                raise IndexError('QueryList index out of range')
+            return entries[0]
+
         qs = self._chain()
         qs.set_limits(k, k + 1)
         qs._fetch_all()
         return qs._result_cache[0]
 
+    def _get_window(self):
+        if self._window is None:
+            self._window = _WindowCache(self, QUERY_WINDOW_SIZE)
+        return self._window
+
     def _chain(self, **kwargs):
         """
         Return a copy of the current QuerySet that's ready for another
@@ -122,7 +310,11 @@ class QueryList:
                          limit=self._limit,
                          offset=self._offset,
                          fields=self._fields,
-                         links_to_names=self._links_to_names)
+                         links_to_names=self._links_to_names,
+                         lookups=self._lookups,
+                         using=self._using,
+                         values=self._values,
+                         annotations=self._annotations)
 
     def set_limits(self, low=None, high=None):
         """
@@ -240,26 +432,14 @@ class QueryList:
         """
 
         if self._query != '':
-            query = '(%s) AND (%s)' % (self._query, self._build_query(**query))
+            query_str = '(%s) AND (%s)' % (self._query, self._build_query(**query))
         else:
-            query = self._build_query(**query)
+            query_str = self._build_query(**query)
 
-        return QueryList(self.model,
-                         query,
-                         order_by=self._order_by,
-                         limit=self._limit,
-                         offset=self._offset,
-                         fields=self._fields,
-                         links_to_names=self._links_to_names)
+        return self._chain(_query=query_str, _lookups=self._lookups + [(False, query)])
 
     def all(self):
-        return QueryList(self.model,
-                         self._query,
-                         order_by=self._order_by,
-                         limit=self._limit,
-                         offset=self._offset,
-                         fields=self._fields,
-                         links_to_names=self._links_to_names)
+        return self._chain()
 
     def exclude(self, **query):
         """Filter this QueryList, returning a new QueryList, as in filter(),
@@ -267,17 +447,11 @@ class QueryList:
         """
 
         if self._query != '':
-            query = '(%s) AND NOT (%s)' % (self._query, self._build_query(**query))
+            query_str = '(%s) AND NOT (%s)' % (self._query, self._build_query(**query))
         else:
-            query = 'NOT (%s)' % self._build_query(**query)
+            query_str = 'NOT (%s)' % self._build_query(**query)
 
-        return QueryList(self.model,
-                         query,
-                         order_by=self._order_by,
-                         fields=self._fields,
-                         limit=self._limit,
-                         offset=self._offset,
-                         links_to_names=self._links_to_names)
+        return self._chain(_query=query_str, _lookups=self._lookups + [(True, query)])
 
     def remove_invalid_fields(self, fields):
         valid_fields = []
@@ -313,15 +487,13 @@ class QueryList:
             if desc:
                 order_by = f'{order_by} desc'
 
-        return QueryList(self.model,
-                         self._query,
-                         order_by=order_by,
-                         fields=self._fields,
-                         limit=self._limit,
-                         offset=self._offset,
-                         links_to_names=self._links_to_names)
+        return self._chain(_order_by=order_by)
 
     def count(self):
+        if self._annotations is not None:
+            return len(self)
+        if self._total == -1 and self._replica() is not None:
+            self._total = self._replica().count(self.model, self._lookups)
         if self._total == -1:
             result = self.model._connection.get_entries_count(self.model.module_name, self._query, 0)
 
@@ -334,6 +506,141 @@ class QueryList:
         for obj in self._result_cache[:1]:
             return obj
 
+    def using(self, alias):
+        """Return a QueryList reading from the backend registered as alias.
+
+        Aliases of replicas (see sugarcrm.replica) route reads to the local
+        copy. Aliases of connections (see sugarcrm.connections) query that
+        SugarCRM instance; 'default' forces the live API even for modules
+        configured in SUGAR_CRM_READ_REPLICA_MODULES.
+        """
+        if get_replica(alias) is None and alias in connections:
+            model = type(self.model)(connections[alias], self.model.module_name, using=alias)
+            return self._chain(model=model, _using=alias)
+        return self._chain(_using=alias)
+
+    def update(self, **fields):
+        """Set fields on every entry of this QueryList, return their number.
+
+        Only the ids of the entries are downloaded, from the server even if
+        reads go to a replica, and the entries are updated with concurrent
+        set_entries calls of 100 entries.
+        """
+        for field in fields:
+            if field not in self.model._available_fields or field == 'id':
+                raise AttributeError("Invalid field '%s'" % field)
+        # Python values, e.g. dates and decimals, sent as the API's strings.
+        fields = dict((field, to_sugar(self.model._available_fields[field], value))
+                      for field, value in fields.items())
+        # Every id is read before writing: updates, such as the deleted flag,
+        # would move entries in and out of the pages still to be read.
+        ids = list(self._iter_ids())
+        updated = bulk.bulk_update(self.model._connection, self.model.module_name, ids, fields)
+        self._result_cache = None
+        self._window = None
+        return updated
+
+    def _iter_ids(self, page_size=AGGREGATE_PAGE_SIZE):
+        """Yield the ids of the entries, read from the server page by page.
+
+        The server caps the entries of a response (list_max_entries_per_page
+        when no size is given), so pages are read until an empty one. Whole
+        queries are paged by id; sliced ones by offset, in their own order.
+        """
+        model = self.model
+        if self._offset or self._limit:
+            offset = int(self._offset or 0)
+            remaining = int(self._limit) if self._limit else None
+            while remaining is None or remaining > 0:
+                size = page_size if remaining is None else min(page_size, remaining)
+                ids = [entry['id'] for entry in model._iter_search(
+                    self._query, self._order_by or '%s.id' % model._table, offset, size, ['id'])]
+                if not ids:
+                    return
+                for record_id in ids:
+                    yield record_id
+                offset += len(ids)
+                if remaining is not None:
+                    remaining -= len(ids)
+            return
+
+        last_id = None
+        while True:
+            query = self._query
+            if last_id is not None:
+                after = "%s.id > '%s'" % (model._table, last_id.replace("'", "''"))
+                query = '(%s) AND %s' % (query, after) if query else after
+            ids = [entry['id'] for entry in model._iter_search(
+                query, '%s.id' % model._table, 0, page_size, ['id'])]
+            if not ids:
+                return
+            for record_id in ids:
+                yield record_id
+            last_id = ids[-1]
+
+    def delete(self):
+        """Mark every entry of this QueryList as deleted, return their number."""
+        return self.update(deleted=1)
+
+    def values(self, *_fields):
+        """Return a QueryList yielding dicts of the given fields instead of
+        entries. Followed by annotate(), the entries are grouped by these
+        fields.
+        """
+        fields = self.remove_invalid_fields(_fields) or list(self.model.get_default_fields())
+
+        return self._chain(_values=fields, _fields=fields)
+
+    @staticmethod
+    def _aliases(args, kwargs):
+        named = dict((aggregate.default_alias, aggregate) for aggregate in args)
+        named.update(kwargs)
+        return named
+
+    def aggregate(self, *args, **kwargs):
+        """Return a dict alias -> value of aggregates computed over the
+        entries, e.g. aggregate(Sum('amount'), n=Count('id')) returns
+        {'amount__sum': ..., 'n': ...}. See sugarcrm.aggregates.
+        """
+        named = self._aliases(args, kwargs)
+        if named and all(isinstance(a, aggregates.Count) and a.counts_rows()
+                         for a in named.values()):
+            total = self.count()
+            return dict((alias, total) for alias in named)
+        return aggregates.compute(self, (), named)[()]
+
+    def annotate(self, *args, **kwargs):
+        """Return a QueryList yielding one dict per group of values(), with
+        the given aggregates computed over the group's entries.
+        """
+        if self._values is None:
+            raise TypeError('annotate() must follow values(): aggregates are computed per group')
+        annotations = dict(self._annotations or {})
+        annotations.update(self._aliases(args, kwargs))
+
+        return self._chain(_annotations=annotations)
+
+    def _annotate_groups(self):
+        annotations = self._annotations
+        groups = None
+        if len(self._values) == 1 and all(isinstance(a, aggregates.Count) and a.counts_rows()
+                                          for a in annotations.values()):
+            counts = aggregates.count_groups(self, self._values[0])
+            if counts is not None:
+                groups = dict((key, dict((alias, count) for alias in annotations))
+                              for key, count in counts.items())
+        if groups is None:
+            groups = aggregates.compute(self, self._values, annotations)
+
+        field, _, direction = (self._order_by or '').partition(' ')
+        if field in self._values:
+            position = self._values.index(field)
+            keys = sorted(groups, key=lambda key: key[position],
+                          reverse=direction.strip().lower() == 'desc')
+        else:
+            keys = sorted(groups)
+        return [dict(list(zip(self._values, key)) + list(groups[key].items())) for key in keys]
+
     def only(self, *_fields):
         fields = self._fields
         valid_fields = self.remove_invalid_fields(_fields)
@@ -341,13 +648,17 @@ class QueryList:
         if valid_fields:
             fields = valid_fields
 
-        return QueryList(self.model,
-                         self._query,
-                         order_by=self._order_by,
-                         fields=fields,
-                         limit=self._limit,
-                         offset=self._offset,
-                         links_to_names=self._links_to_names)
+        return self._chain(_fields=fields)
+
+    def defer(self, *_fields):
+        """Return a QueryList which doesn't fetch the given fields.
+
+        Deferred fields are still loaded on access, with an extra request.
+        """
+        fields = self._fields or self.model.get_default_fields()
+        fields = [f for f in fields if f not in _fields or f == 'id']
+
+        return self._chain(_fields=fields)
 
     def links_to_names(self, *_links_to_names):
         links_to_names = self._links_to_names
@@ -355,10 +666,4 @@ class QueryList:
         if _links_to_names:
             links_to_names = _links_to_names
 
-        return QueryList(self.model,
-                         self._query,
-                         order_by=self._order_by,
-                         fields=self._fields,
-                         limit=self._limit,
-                         offset=self._offset,
-                         links_to_names=links_to_names)
+        return self._chain(_links_to_names=links_to_names)
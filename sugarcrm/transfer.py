@@ -0,0 +1,309 @@
+"""Streaming transfer of note attachments and document revisions.
+
+The REST API carries files base64-encoded inside the JSON request and
+response. Going through _sendRequest would hold the file several times in
+memory (raw, base64, JSON, URL-encoded), so uploads are encoded chunk by
+chunk straight into the HTTP request body, and downloads are decoded chunk
+by chunk from the response into the destination file.
+"""
+import base64
+import json
+import mmap
+import os
+import re
+import time
+
+import six
+from six.moves import urllib
+
+from .executor import ThreadPoolExecutor
+from .sugarerror import SugarError, SugarUnhandledException, is_error
+
+# Raw bytes read per chunk; a multiple of 3 so base64 chunks can be joined.
+CHUNK_SIZE = 3 * 64 * 1024
+
+_FILE_PLACEHOLDER = '@@sugarcrm-file@@'
+
+_FILE_KEY_RE = re.compile(r'"file"\s*:\s*"')
+
+
+class _Source:
+    """Readable binary data: a path (memory-mapped) or a file object."""
+
+    def __init__(self, source):
+        self._file = None
+        self._map = None
+        if isinstance(source, six.string_types):
+            self._file = open(source, 'rb')
+            try:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be mapped.
+                pass
+            fileobj = self._file
+        else:
+            fileobj = source
+        self._fileobj = fileobj
+        try:
+            self._start = fileobj.tell()
+            fileobj.seek(0, os.SEEK_END)
+            self.size = fileobj.tell() - self._start
+            fileobj.seek(self._start)
+        except (AttributeError, OSError):
+            self._start = None
+            self.size = None
+
+    @property
+    def seekable(self):
+        return self.size is not None
+
+    def chunks(self, chunk_size):
+        if self._map is not None:
+            for offset in range(0, len(self._map), chunk_size):
+                yield self._map[offset:offset + chunk_size]
+            return
+        if self._start is not None:
+            self._fileobj.seek(self._start)
+        while True:
+            chunk = self._fileobj.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+
+
+def _quoted_base64(chunk):
+    # base64 only needs '+', '/' and '=' escaped in a form body.
+    return urllib.parse.quote_plus(base64.b64encode(chunk).decode('ascii')).encode('ascii')
+
+
+def _quoted_size(chunk):
+    encoded = base64.b64encode(chunk)
+    return len(encoded) + 2 * (encoded.count(b'+') + encoded.count(b'/') + encoded.count(b'='))
+
+
+def upload(connection, method, values, source, chunk_size=CHUNK_SIZE, progress=None):
+    """Call an upload method such as set_note_attachment, streaming the file.
+
+    Keyword arguments:
+    connection -- Sugarcrm connection
+    method -- 'set_note_attachment' or 'set_document_revision'
+    values -- the method's argument, without its 'file' member
+    source -- path or binary file object to upload
+    progress -- callable(sent_bytes, total_bytes) called after each chunk;
+                total_bytes is None for non seekable file objects
+    """
+    connection = connection._current()
+    source = _Source(source)
+    try:
+        for attempt in range(2):
+            result = _upload(connection, method, values, source, chunk_size, progress)
+            if not is_error(result):
+                return result
+            error = SugarError(result)
+            if error.is_invalid_session and not attempt and source.seekable:
+                connection._session = connection.login()
+                continue
+            raise SugarUnhandledException('%d, %s - %s' %
+                                          (error.number, error.name, error.description))
+    finally:
+        source.close()
+
+
+def _upload(connection, method, values, source, chunk_size, progress):
+    values = dict(values, file=_FILE_PLACEHOLDER)
+    rest_data = json.dumps([connection._session, values])
+    before, after = rest_data.split(json.dumps(_FILE_PLACEHOLDER))
+    head = (urllib.parse.urlencode({'method': method, 'input_type': 'json',
+                                    'response_type': 'json'}) +
+            '&rest_data=' + urllib.parse.quote_plus(before + '"')).encode('ascii')
+    tail = urllib.parse.quote_plus('"' + after).encode('ascii')
+
+    headers = {}
+    if source.seekable:
+        size = len(head) + len(tail) + sum(_quoted_size(c) for c in source.chunks(chunk_size))
+        headers['Content-Length'] = str(size)
+
+    def body():
+        sent = 0
+        yield head
+        for chunk in source.chunks(chunk_size):
+            yield _quoted_base64(chunk)
+            sent += len(chunk)
+            if progress is not None:
+                progress(sent, source.size)
+        yield tail
+
+    start = time.time()
+    sizes = [0, 0]
+    counted = _Counter(body())
+    try:
+        response = b''.join(connection._read_chunks(connection._post(counted, headers), sizes))
+    finally:
+        connection.bytes_sent += counted.size
+        connection._record_call(method, None, time.time() - start, sizes[1], sizes[0])
+    return json.loads(response.decode('utf-8')) if response.strip() else None
+
+
+class _Counter:
+    """Iterable of bytes counting what went through it."""
+
+    def __init__(self, iterable):
+        self._iterable = iterable
+        self.size = 0
+
+    def __iter__(self):
+        for data in self._iterable:
+            self.size += len(data)
+            yield data
+
+
+def download(connection, method, record_id, dest, progress=None):
+    """Call a download method such as get_note_attachment, streaming the file.
+
+    The base64 'file' member of the response is decoded into dest as it is
+    received. Returns the other members of the response's object, e.g.
+    {'note_attachment': {'id': ..., 'filename': ..., 'file': ''}}.
+
+    Keyword arguments:
+    connection -- Sugarcrm connection
+    method -- 'get_note_attachment' or 'get_document_revision'
+    record_id -- id of the note or of the document revision
+    dest -- path or binary file object to write to
+    progress -- callable(received_bytes, None) called after each chunk
+    """
+    connection = connection._current()
+    fileobj = open(dest, 'wb') if isinstance(dest, six.string_types) else dest
+    start_position = None
+    try:
+        start_position = fileobj.tell()
+    except (AttributeError, OSError):
+        pass
+    try:
+        for attempt in range(2):
+            result = _download(connection, method, record_id, fileobj, progress)
+            if not is_error(result):
+                return result
+            error = SugarError(result)
+            if error.is_invalid_session and not attempt:
+                connection._session = connection.login()
+                if start_position is not None:
+                    fileobj.seek(start_position)
+                continue
+            raise SugarUnhandledException('%d, %s - %s' %
+                                          (error.number, error.name, error.description))
+    finally:
+        if fileobj is not dest:
+            fileobj.close()
+
+
+def _download(connection, method, record_id, fileobj, progress):
+    start = time.time()
+    sizes = [0, 0]
+    args = {'method': method, 'input_type': 'json', 'response_type': 'json',
+            'rest_data': json.dumps([connection._session, record_id])}
+    params = urllib.parse.urlencode(args).encode('utf-8')
+    connection.bytes_sent += len(params)
+    decoder = _FileMemberDecoder(fileobj, progress)
+    try:
+        for chunk in connection._read_chunks(connection._post(params), sizes):
+            decoder.feed(chunk.decode('latin-1'))
+    finally:
+        connection._record_call(method, None, time.time() - start, sizes[1], sizes[0])
+    text = decoder.close()
+    return json.loads(text.encode('latin-1').decode('utf-8')) if text.strip() else None
+
+
+class _FileMemberDecoder:
+    """Split a JSON response into its base64 "file" member, decoded into a
+    file object, and the rest of the document with "file" set to "".
+
+    Text is fed as latin-1 so every byte maps to one character and chunk
+    boundaries can't split a character.
+    """
+
+    def __init__(self, fileobj, progress=None):
+        self._fileobj = fileobj
+        self._progress = progress
+        self._rest = []
+        self._pending = ''
+        self._base64 = ''
+        self._written = 0
+        self._state = 'before'
+
+    def feed(self, text):
+        self._pending += text
+        if self._state == 'before':
+            match = _FILE_KEY_RE.search(self._pending)
+            if match is None:
+                # Keep enough text to match a key split over two chunks.
+                self._rest.append(self._pending[:-64])
+                self._pending = self._pending[-64:]
+                return
+            self._rest.append(self._pending[:match.start()] + '"file": ""')
+            self._pending = self._pending[match.end():]
+            self._state = 'file'
+        if self._state == 'file':
+            self._feed_file()
+        if self._state == 'after':
+            self._rest.append(self._pending)
+            self._pending = ''
+
+    def _feed_file(self):
+        text = self._pending
+        parts = []
+        pos = 0
+        while True:
+            end = min([i for i in (text.find('"', pos), text.find('\\', pos)) if i != -1] or
+                      [len(text)])
+            parts.append(text[pos:end])
+            if end == len(text):
+                pos = end
+                break
+            if text[end] == '"':
+                pos = end + 1
+                self._state = 'after'
+                break
+            if end + 1 == len(text):
+                # Escape sequence split over two chunks.
+                pos = end
+                break
+            escaped = text[end + 1]
+            if escaped == '/':
+                parts.append('/')
+            elif escaped not in 'nrt':
+                raise ValueError('Unexpected escape \\%s in base64 data' % escaped)
+            pos = end + 2
+        self._pending = text[pos:]
+        self._base64 += ''.join(parts)
+        usable = len(self._base64) if self._state == 'after' else len(self._base64) // 4 * 4
+        if usable:
+            data = base64.b64decode(self._base64[:usable])
+            self._base64 = self._base64[usable:]
+            self._fileobj.write(data)
+            self._written += len(data)
+            if self._progress is not None:
+                self._progress(self._written, None)
+
+    def close(self):
+        if self._state == 'file':
+            raise ValueError('Truncated file data')
+        self._rest.append(self._pending)
+        return ''.join(self._rest)
+
+
+def transfer_many(transfers, max_workers=4):
+    """Run transfers concurrently, return their results in order.
+
+    transfers -- iterable of callables, e.g. functools.partial(note.download, path).
+    At most max_workers transfers, each buffering a few chunks, run at once,
+    which bounds memory use. The first exception raised is propagated.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(transfer) for transfer in transfers]
+        return [future.result() for future in futures]
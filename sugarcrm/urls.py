@@ -0,0 +1,8 @@
+from django.urls import path
+
+from .webhooks import logic_hook
+
+urlpatterns = [
+    path('hooks/', logic_hook, name='sugarcrm-logic-hook'),
+    path('hooks/<str:using>/', logic_hook, name='sugarcrm-logic-hook'),
+]
@@ -0,0 +1,91 @@
+"""Django view receiving SugarCRM logic hook notifications.
+
+Include sugarcrm.urls in the project's URLconf and post from after_save,
+after_delete, after_relationship_add and after_relationship_delete logic
+hooks a JSON body signed with SUGAR_CRM_WEBHOOK_SECRET:
+
+    $body = json_encode(array('event' => $event, 'module' => $bean->module_dir,
+                              'id' => $bean->id));
+    $signature = hash_hmac('sha256', $body, $secret);
+    // POST $body to https://app.example.com/sugarcrm/hooks/ with the
+    // header "X-Sugarcrm-Signature: $signature"
+
+Relationship events also carry 'related_module', 'related_id' and 'link'.
+A list of events may be posted at once. Posting to hooks/<alias>/ tells
+which connection of sugarcrm.connections the hook belongs to; give each
+tenant its own secret with 'WEBHOOK_SECRET' in SUGAR_CRM_CONNECTIONS, so
+one tenant cannot post the events of another. Every event sends the
+signals of sugarcrm.signals, which invalidate the caches.
+"""
+import hashlib
+import hmac
+import json
+import logging
+
+import six
+from django.http import HttpResponseBadRequest, HttpResponseForbidden, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .connections import DEFAULT_CONNECTION_ALIAS, connections
+from .signals import record_changed, relationship_changed
+
+log = logging.getLogger(__name__)
+
+RECORD_EVENTS = ('after_save', 'after_delete')
+RELATIONSHIP_EVENTS = ('after_relationship_add', 'after_relationship_delete')
+
+SIGNATURE_HEADER = 'HTTP_X_SUGARCRM_SIGNATURE'
+
+
+def _valid_signature(body, signature, secret):
+    if not secret or not signature:
+        return False
+    expected = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def _valid_event(event):
+    if not isinstance(event, dict):
+        return False
+    keys = ('module', 'id')
+    if event.get('event') in RELATIONSHIP_EVENTS:
+        keys += ('related_module', 'related_id')
+    elif event.get('event') not in RECORD_EVENTS:
+        return False
+    return all(isinstance(event.get(key), six.string_types) and event[key] for key in keys)
+
+
+def dispatch(event, using=DEFAULT_CONNECTION_ALIAS):
+    """Send the signals of a validated logic hook event."""
+    if event['event'] in RELATIONSHIP_EVENTS:
+        relationship_changed.send(sender=using, module_name=event['module'],
+                                  record_id=event['id'], related_module=event['related_module'],
+                                  related_id=event['related_id'], link=event.get('link'),
+                                  event=event['event'])
+        for module_name, record_id in ((event['module'], event['id']),
+                                       (event['related_module'], event['related_id'])):
+            record_changed.send(sender=using, module_name=module_name, record_id=record_id,
+                                event=event['event'])
+    else:
+        record_changed.send(sender=using, module_name=event['module'], record_id=event['id'],
+                            event=event['event'])
+
+
+@csrf_exempt
+@require_POST
+def logic_hook(request, using=DEFAULT_CONNECTION_ALIAS):
+    if not _valid_signature(request.body, request.META.get(SIGNATURE_HEADER),
+                            connections.get_webhook_secret(using)):
+        return HttpResponseForbidden('Invalid signature')
+    try:
+        events = json.loads(request.body.decode('utf-8'))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid JSON')
+    if not isinstance(events, list):
+        events = [events]
+    if not all(_valid_event(event) for event in events):
+        return HttpResponseBadRequest('Invalid event')
+    for event in events:
+        dispatch(event, using)
+    return JsonResponse({'events': len(events)})
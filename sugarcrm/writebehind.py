@@ -0,0 +1,312 @@
+"""Write-behind queue of SugarEntry saves.
+
+With SUGAR_CRM_WRITE_BEHIND = True (or save(write_behind=True)), save()
+doesn't call set_entry: the dirty fields are queued and merged with the
+fields already queued for the same record, and a background thread sends
+them with set_entries once SUGAR_CRM_WRITE_BEHIND_DELAY seconds passed.
+Several saves of a record within that delay cost a single update.
+
+New entries get their id client side (a uuid, created with new_with_id),
+so later saves of the entry are merged into its creation. Fields computed
+by the server aren't reloaded; they are loaded on access after the write.
+
+Records are written in the order they were saved, each batch being sent
+after the previous one succeeded. Failed batches are retried
+SUGAR_CRM_WRITE_BEHIND_RETRIES times, then kept in the queue's `failed`
+list. flush() waits for every queued write, e.g. at the end of a test:
+
+    connection.flush()
+
+Pending writes are kept in memory, or in the SQLite database at
+SUGAR_CRM_WRITE_BEHIND_PATH so they survive a restart of the process.
+Processes sharing the database queue their writes together; a single one
+at a time, holding a lease on the queue, sends them, which keeps them in
+order. At exit, a process waits SUGAR_CRM_WRITE_BEHIND_EXIT_TIMEOUT
+seconds at most for its writes.
+"""
+import atexit
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .settings import (WRITE_BEHIND_DELAY, WRITE_BEHIND_RETRIES, WRITE_BEHIND_PATH,
+                       WRITE_BEHIND_EXIT_TIMEOUT)
+
+log = logging.getLogger(__name__)
+
+_queues = weakref.WeakSet()
+
+
+class MemoryBackend:
+    """Pending writes in a dict, lost when the process exits."""
+
+    def __init__(self):
+        # (module_name, id) -> (new, values), oldest first.
+        self._pending = OrderedDict()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, module_name, record_id, values, new):
+        key = (module_name, record_id)
+        old_new, old_values = self._pending.pop(key, (False, {}))
+        self._pending[key] = (old_new or new, dict(old_values, **values))
+
+    def take(self, limit):
+        """Remove and return up to limit (module_name, id, new, values) tuples."""
+        items = []
+        while self._pending and len(items) < limit:
+            (module_name, record_id), (new, values) = self._pending.popitem(last=False)
+            items.append((module_name, record_id, new, values))
+        return items
+
+    def acquire(self, owner, duration):
+        """Return whether owner may send the writes; always, in a single process."""
+        return True
+
+    def release(self, owner):
+        pass
+
+
+class SQLiteBackend:
+    """Pending writes in a SQLite database, shared by the processes using it.
+
+    name -- identifies the queue, e.g. the server URL, so several queues
+            can share a database
+    """
+
+    def __init__(self, path, name=''):
+        # Transactions are begun explicitly, see _transaction().
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._name = name
+        with self._transaction():
+            self._db.execute('CREATE TABLE IF NOT EXISTS sugarcrm_write_behind '
+                             '(queue TEXT, module TEXT, id TEXT, new INTEGER, "values" TEXT, '
+                             'seq INTEGER, PRIMARY KEY (queue, module, id))')
+            self._db.execute('CREATE TABLE IF NOT EXISTS sugarcrm_write_behind_lease '
+                             '(queue TEXT PRIMARY KEY, owner TEXT, expires REAL)')
+
+    @contextmanager
+    def _transaction(self):
+        # Take the write lock upfront, so reads and writes of a transaction
+        # aren't interleaved with those of other processes.
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM sugarcrm_write_behind WHERE queue = ?',
+                                (self._name,)).fetchone()[0]
+
+    def put(self, module_name, record_id, values, new):
+        with self._transaction():
+            row = self._db.execute('SELECT new, "values" FROM sugarcrm_write_behind '
+                                   'WHERE queue = ? AND module = ? AND id = ?',
+                                   (self._name, module_name, record_id)).fetchone()
+            if row is not None:
+                new = new or bool(row[0])
+                values = dict(json.loads(row[1]), **values)
+            seq = self._db.execute('SELECT COALESCE(MAX(seq), 0) + 1 FROM sugarcrm_write_behind'
+                                   ).fetchone()[0]
+            self._db.execute('INSERT OR REPLACE INTO sugarcrm_write_behind '
+                             'VALUES (?, ?, ?, ?, ?, ?)',
+                             (self._name, module_name, record_id, int(new), json.dumps(values),
+                              seq))
+
+    def take(self, limit):
+        with self._transaction():
+            rows = self._db.execute('SELECT module, id, new, "values" FROM sugarcrm_write_behind '
+                                    'WHERE queue = ? ORDER BY seq LIMIT ?',
+                                    (self._name, limit)).fetchall()
+            self._db.executemany('DELETE FROM sugarcrm_write_behind '
+                                 'WHERE queue = ? AND module = ? AND id = ?',
+                                 [(self._name, row[0], row[1]) for row in rows])
+        return [(module_name, record_id, bool(new), json.loads(values))
+                for module_name, record_id, new, values in rows]
+
+    def acquire(self, owner, duration):
+        """Take or renew the lease on the queue for duration seconds, return
+        whether owner holds it.
+        """
+        now = time.time()
+        with self._transaction():
+            row = self._db.execute('SELECT owner, expires FROM sugarcrm_write_behind_lease '
+                                   'WHERE queue = ?', (self._name,)).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+            self._db.execute('INSERT OR REPLACE INTO sugarcrm_write_behind_lease '
+                             'VALUES (?, ?, ?)', (self._name, owner, now + duration))
+        return True
+
+    def release(self, owner):
+        with self._transaction():
+            self._db.execute('DELETE FROM sugarcrm_write_behind_lease '
+                             'WHERE queue = ? AND owner = ?', (self._name, owner))
+
+
+class WriteBehindQueue:
+    """Coalesce the writes of a connection and send them in the background.
+
+    Keyword arguments:
+    connection -- Sugarcrm connection the writes are sent through
+    backend -- MemoryBackend (default) or SQLiteBackend storing the writes
+    delay -- seconds writes wait for other writes of the same record
+    batch_size -- records per set_entries call
+    retries -- attempts after a failed set_entries call, with exponential
+               backoff
+    """
+
+    # Seconds the lease on a shared queue is taken for, renewed before each
+    # batch; a process dying with it blocks the queue that long.
+    lease_duration = 60
+
+    # Seconds between attempts to take the lease held by another process.
+    lease_poll = 1.0
+
+    def __init__(self, connection, backend=None, delay=WRITE_BEHIND_DELAY, batch_size=100,
+                 retries=WRITE_BEHIND_RETRIES, backoff=0.5):
+        self._connection = connection
+        self._backend = backend if backend is not None else MemoryBackend()
+        self.delay = delay
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        # (module_name, id, new, values) of the writes given up on.
+        self.failed = []
+        self._cond = threading.Condition()
+        self._in_flight = False
+        self._flush_waiters = 0
+        self._thread = None
+        self._owner = uuid.uuid4().hex
+        _queues.add(self)
+        with self._cond:
+            if len(self._backend):
+                # Writes left by a previous process.
+                self._start()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._backend) + (1 if self._in_flight else 0)
+
+    def put(self, module_name, record_id, values, new=False):
+        """Queue values of the record, merged over those already queued.
+
+        new -- create the record with this id
+        """
+        with self._cond:
+            self._backend.put(module_name, record_id, values, new)
+            self._start()
+            self._cond.notify_all()
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='sugarcrm-write-behind',
+                                            daemon=True)
+            self._thread.start()
+
+    def flush(self, timeout=None):
+        """Send the queued writes now and wait until they are written.
+
+        Returns False if timeout seconds passed first.
+        """
+        with self._cond:
+            if self._thread is None and not len(self._backend):
+                return True
+            self._flush_waiters += 1
+            self._cond.notify_all()
+            try:
+                return self._cond.wait_for(lambda: not len(self._backend) and
+                                           not self._in_flight, timeout)
+            finally:
+                self._flush_waiters -= 1
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._backend))
+                if not self._backend.acquire(self._owner, self.lease_duration):
+                    # Another process sends the writes; wake flush() callers
+                    # from time to time so they see its progress.
+                    self._cond.wait(self.lease_poll)
+                    self._cond.notify_all()
+                    continue
+                # Give other saves of the same records a chance to be merged.
+                deadline = time.time() + self.delay
+                while not self._flush_waiters and time.time() < deadline:
+                    self._cond.wait(deadline - time.time())
+                items = self._backend.take(self.batch_size)
+                self._in_flight = True
+            try:
+                self._send(items)
+            finally:
+                with self._cond:
+                    self._in_flight = False
+                    if not len(self._backend):
+                        # Let other processes send their writes right away.
+                        self._backend.release(self._owner)
+                    self._cond.notify_all()
+
+    def _send(self, items):
+        modules = OrderedDict()
+        for module_name, record_id, new, values in items:
+            name_value_list = [{'name': 'id', 'value': record_id}]
+            if new:
+                name_value_list.append({'name': 'new_with_id', 'value': True})
+            name_value_list.extend({'name': field, 'value': value}
+                                   for field, value in values.items() if field != 'id')
+            modules.setdefault(module_name, []).append(name_value_list)
+
+        for module_name, name_value_lists in modules.items():
+            for attempt in range(self.retries + 1):
+                try:
+                    result = self._connection.set_entries(module_name, name_value_lists)
+                    if not result or 'ids' not in result:
+                        raise ValueError('Unexpected set_entries response %r' % (result,))
+                    break
+                except Exception as e:
+                    if attempt == self.retries:
+                        log.error('Giving up writing %d %s records: %s',
+                                  len(name_value_lists), module_name, e)
+                        self.failed.extend(item for item in items if item[0] == module_name)
+                    else:
+                        log.warning('Cannot write %d %s records, retrying: %s',
+                                    len(name_value_lists), module_name, e)
+                        time.sleep(self.backoff * 2 ** attempt)
+
+
+def get_backend(connection):
+    if WRITE_BEHIND_PATH:
+        return SQLiteBackend(WRITE_BEHIND_PATH, connection._url)
+    return MemoryBackend()
+
+
+def flush(timeout=None):
+    """Wait for the queued writes of every connection, timeout seconds at
+    most in all.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    flushed = True
+    for queue in list(_queues):
+        remaining = None if deadline is None else max(0, deadline - time.time())
+        flushed = queue.flush(remaining) and flushed
+    return flushed
+
+
+def _flush_at_exit():
+    if not flush(WRITE_BEHIND_EXIT_TIMEOUT):
+        log.warning('SugarCRM writes still queued after %ss at exit, they are %s',
+                    WRITE_BEHIND_EXIT_TIMEOUT,
+                    'kept in %s' % WRITE_BEHIND_PATH if WRITE_BEHIND_PATH else 'lost')
+
+
+atexit.register(_flush_at_exit)
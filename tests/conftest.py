@@ -0,0 +1,27 @@
+import django
+import pytest
+from django.conf import settings
+
+# sugarcrm.settings reads the Django settings when it is imported.
+if not settings.configured:
+    settings.configure(
+        SECRET_KEY='tests',
+        INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth', 'sugarcrm'],
+        ROOT_URLCONF='sugarcrm.urls',
+        ALLOWED_HOSTS=['*'],
+        SUGAR_CRM_WEBHOOK_SECRET='secret',
+    )
+    django.setup()
+
+from sugarcrm.stubserver import StubServer  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    with StubServer(records=50) as server:
+        yield server
+
+
+@pytest.fixture
+def connection(server):
+    return server.connect()
@@ -0,0 +1,92 @@
+from collections import defaultdict
+
+import pytest
+
+from sugarcrm import Avg, Count, Max, Min, Sum, aggregates
+from sugarcrm.stubserver import StubServer
+from sugarcrm.sugarentry import Opportunity
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(aggregates, 'numpy', None)
+    return request.param
+
+
+@pytest.fixture
+def opportunities():
+    # More entries than the server returns without max_results.
+    with StubServer(records={'Opportunities': 137}) as server:
+        yield server, Opportunity(server.connect())
+
+
+def expected(server, group_by=None):
+    groups = defaultdict(list)
+    for record in server.dataset.records['Opportunities'].values():
+        groups[record[group_by] if group_by else None].append(record)
+    return dict((key, {
+        'sum': sum(float(r['amount']) for r in records),
+        'avg': sum(float(r['amount']) for r in records) / len(records),
+        'min': min(int(r['probability']) for r in records),
+        'max': max(int(r['probability']) for r in records),
+        'count': len(records),
+    }) for key, records in groups.items())
+
+
+def test_aggregate(backend, opportunities):
+    server, model = opportunities
+    result = model.objects.aggregate(Sum('amount'), Avg('amount'), Min('probability'),
+                                     Max('probability'), n=Count('id'))
+    totals = expected(server)[None]
+    assert result['amount__sum'] == pytest.approx(totals['sum'])
+    assert result['amount__avg'] == pytest.approx(totals['avg'])
+    assert result['probability__min'] == totals['min']
+    assert result['probability__max'] == totals['max']
+    assert result['n'] == totals['count']
+
+
+def test_aggregate_by_small_pages(backend, opportunities):
+    server, model = opportunities
+    result = aggregates.compute(model.objects.all(), (), {'total': Sum('amount')},
+                                page_size=10)
+    assert result[()]['total'] == pytest.approx(expected(server)[None]['sum'])
+
+
+def test_aggregate_of_no_entries(backend, opportunities):
+    server, model = opportunities
+    result = model.objects.filter(name='nothing').aggregate(Sum('amount'), Max('amount'))
+    assert result == {'amount__sum': None, 'amount__max': None}
+
+
+def test_annotate(backend, opportunities):
+    server, model = opportunities
+    rows = list(model.objects.values('sales_stage').annotate(
+        total=Sum('amount'), n=Count('id'), low=Min('probability')))
+    groups = expected(server, 'sales_stage')
+    assert sorted(row['sales_stage'] for row in rows) == sorted(groups)
+    for row in rows:
+        group = groups[row['sales_stage']]
+        assert row['total'] == pytest.approx(group['sum'])
+        assert row['n'] == group['count']
+        assert row['low'] == group['min']
+
+
+def test_count_of_enum_groups_uses_counts(opportunities):
+    server, model = opportunities
+    server.reset_stats()
+    rows = list(model.objects.values('sales_stage').annotate(n=Count('id')))
+    groups = expected(server, 'sales_stage')
+    assert dict((row['sales_stage'], row['n']) for row in rows) == dict(
+        (key, group['count']) for key, group in groups.items())
+    assert server.calls['get_entry_list'] == 0
+
+
+def test_annotate_requires_values(opportunities):
+    server, model = opportunities
+    with pytest.raises(TypeError):
+        model.objects.annotate(Sum('amount'))
+    with pytest.raises(TypeError):
+        model.objects.filter(name='x').annotate(total=Sum('amount'))
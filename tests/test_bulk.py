@@ -0,0 +1,118 @@
+import pytest
+
+from sugarcrm.bulk import _record
+from sugarcrm.stubserver import StubServer
+from sugarcrm.sugarentry import Account, Contact
+from sugarcrm.sugarquerylist import QueryList
+
+
+@pytest.fixture
+def server():
+    # Several times the 20 entries returned without max_results.
+    with StubServer(records={'Accounts': 250, 'Contacts': 10}) as server:
+        yield server
+
+
+def live(server, module_name='Accounts'):
+    return [r for r in server.dataset.records[module_name].values() if r['deleted'] == '0']
+
+
+def links(server, account):
+    return server.dataset.links[('Accounts', account['id'])]['contacts']
+
+
+def test_stub_caps_pages_without_max_results(connection):
+    assert len(connection.get_entry_list('Accounts', '', '', 0, ['id'], [], '', 0)
+               ['entry_list']) == 20
+    assert len(connection.get_entry_list('Accounts', '', '', 0, ['id'], [], 30, 0)
+               ['entry_list']) == 30
+
+
+@pytest.mark.parametrize('page_size', [7, 20, 1000])
+def test_ids_are_read_page_by_page(server, connection, page_size):
+    ids = list(Account(connection).objects.all()._iter_ids(page_size))
+    assert sorted(ids) == sorted(server.dataset.records['Accounts'])
+
+
+def test_ids_of_a_slice(server, connection):
+    queryset = Account(connection).objects.all()._chain(_offset=10, _limit=45)
+    ids = list(queryset._iter_ids(page_size=20))
+    assert len(ids) == len(set(ids)) == 45
+
+
+def test_update_every_entry(server, connection):
+    assert Account(connection).objects.all().update(description='bulk') == 250
+    assert all(r['description'] == 'bulk' for r in server.dataset.records['Accounts'].values())
+
+
+def test_update_filtered_entries(server, connection):
+    matching = [r['id'] for r in live(server) if r['name'].startswith('Account 1')]
+    updated = Account(connection).objects.filter(name__startswith='Account 1').update(
+        description='ones')
+    assert updated == len(matching) > 20
+    assert sorted(r['id'] for r in live(server) if r['description'] == 'ones') == \
+        sorted(matching)
+
+
+def test_update_rejects_unknown_fields(connection):
+    with pytest.raises(AttributeError):
+        Account(connection).objects.all().update(no_such_field='x')
+    with pytest.raises(AttributeError):
+        Account(connection).objects.all().update(id='x')
+
+
+def test_delete(server, connection):
+    assert Account(connection).objects.all().delete() == 250
+    assert live(server) == []
+    assert Account(connection).objects.count() == 0
+
+
+def test_delete_reads_every_id_before_writing(server, connection, monkeypatch):
+    """Deleted entries leave the query: with offset pages read between the
+    writes, every other page would be skipped.
+    """
+    monkeypatch.setattr(QueryList._iter_ids, '__defaults__', (15,))
+    queryset = Account(connection).objects.all()._chain(_offset=0, _limit=100)
+    assert queryset.delete() == 100
+    assert len(live(server)) == 150
+
+
+def test_bulk_relate(server, connection):
+    accounts = Account(connection).objects.all()[:3]
+    contacts = Contact(connection).objects.all()[5:7]
+    result = connection.bulk_relate([(account, contact['id'], 'contacts')
+                                     for account in accounts for contact in contacts],
+                                    chunk_size=2)
+    assert (result.created, result.failed, result.calls) == (3, [], 2)
+    assert all(c['id'] in links(server, a) for a in accounts for c in contacts)
+
+    result = connection.bulk_unrelate([(('Accounts', accounts[0]['id']), contact)
+                                       for contact in contacts])
+    assert (result.deleted, result.failed, result.calls) == (1, [], 1)
+    assert not any(c['id'] in links(server, accounts[0]) for c in contacts)
+
+
+def test_failed_links_are_isolated(server, connection):
+    account = Account(connection).objects.all()[0]
+    contacts = Contact(connection).objects.all()[5:8]
+    triples = [(account, c['id'], 'contacts') for c in contacts]
+    missing = (account, 'no-such-contact', 'contacts')
+    result = connection.bulk_relate(triples[:2] + [missing] + triples[2:])
+    assert result.failed == [missing]
+    assert all(c['id'] in links(server, account) for c in contacts)
+
+
+def test_records_given_as_lists_or_tuples(connection):
+    account = Account(connection).objects.all()[0]
+    assert _record(['Accounts', 'x']) == ('Accounts', 'x')
+    assert _record(('Accounts', 'x')) == ('Accounts', 'x')
+    assert _record(account) == ('Accounts', account['id'])
+
+
+def test_bulk_relate_with_lists(server, connection):
+    account = Account(connection).objects.all()[0]
+    contacts = Contact(connection).objects.all()[:3]
+    result = connection.bulk_relate([(['Accounts', account['id']], ['Contacts', c['id']],
+                                      'contacts') for c in contacts])
+    assert (result.created, result.failed) == (1, [])
+    assert all(c['id'] in links(server, account) for c in contacts)
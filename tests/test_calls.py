@@ -0,0 +1,48 @@
+import pytest
+
+from sugarcrm import sugarcrm
+from sugarcrm.stubserver import StubServer
+
+QUERY = "accounts.name = 'Account 1'"
+
+
+def test_capture_calls(connection):
+    with connection.capture_calls() as calls:
+        connection.get_entry_list('Accounts', QUERY, '', 0, ['id'], [], 10, 0)
+        connection.get_entries_count('Accounts', '', 0)
+    assert [(c.method, c.module) for c in calls] == [('get_entry_list', 'Accounts'),
+                                                     ('get_entries_count', 'Accounts')]
+    assert (calls[0].query, calls[1].query) == (QUERY, '')
+    assert calls[0].response_size > 0 and calls[0].duration >= 0
+    # Calls after the block aren't recorded.
+    connection.get_entries_count('Accounts', '', 0)
+    assert len(calls) == 2
+
+
+def test_captures_are_per_connection(server, connection):
+    other = server.connect()
+    with connection.capture_calls() as calls, sugarcrm.capture_calls() as all_calls:
+        other.get_entries_count('Accounts', '', 0)
+        connection.get_entries_count('Contacts', '', 0)
+    assert [c.module for c in calls] == ['Contacts']
+    assert [c.module for c in all_calls] == ['Accounts', 'Contacts']
+
+
+def test_assert_max_calls(connection):
+    with connection.assert_max_calls(1):
+        connection.get_entries_count('Accounts', '', 0)
+    with pytest.raises(AssertionError) as excinfo:
+        with sugarcrm.assert_max_calls(1):
+            connection.get_entries_count('Accounts', '', 0)
+            connection.get_entries_count('Contacts', '', 0)
+    assert 'get_entries_count Contacts' in str(excinfo.value)
+
+
+def test_failed_calls_are_recorded(connection):
+    with StubServer(records=0) as stopped:
+        pass
+    connection._url = stopped.url
+    with connection.capture_calls() as calls:
+        with pytest.raises(Exception):
+            connection.get_entries_count('Accounts', '', 0)
+    assert [call.method for call in calls] == ['get_entries_count']
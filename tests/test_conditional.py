@@ -0,0 +1,107 @@
+import pytest
+from rest_framework import serializers, viewsets
+from rest_framework.test import APIRequestFactory
+
+from sugarcrm.rest_framework import conditional
+from sugarcrm.rest_framework.conditional import ConditionalResponseMixin
+from sugarcrm.signals import record_changed
+from sugarcrm.sugarentry import Account
+
+
+class AccountSerializer(serializers.Serializer):
+    id = serializers.CharField()
+    name = serializers.CharField()
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    conditional._validators.clear()
+    conditional._pages.clear()
+
+
+@pytest.fixture
+def view(connection):
+    class AccountViewSet(ConditionalResponseMixin, viewsets.ReadOnlyModelViewSet):
+        serializer_class = AccountSerializer
+
+        def get_queryset(self):
+            return Account(connection).objects.filter(name__startswith='Account 1')
+
+    return AccountViewSet
+
+
+def get(view, action, path='/accounts/', **kwargs):
+    headers = dict((k, v) for k, v in kwargs.items() if k.startswith('HTTP_'))
+    params = dict((k, v) for k, v in kwargs.items() if not k.startswith('HTTP_'))
+    request = APIRequestFactory().get(path, **headers)
+    return view.as_view({'get': action})(request, **params)
+
+
+def test_list(server, view):
+    response = get(view, 'list')
+    assert response.status_code == 200
+    assert sorted(row['name'] for row in response.data) == sorted(
+        r['name'] for r in server.dataset.records['Accounts'].values()
+        if r['name'].startswith('Account 1'))
+    assert response['ETag'].startswith('W/"')
+    assert response['Last-Modified']
+
+
+def test_list_not_modified(server, view):
+    etag = get(view, 'list')['ETag']
+    server.reset_stats()
+    response = get(view, 'list', HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    # The validator is reused.
+    assert sum(server.calls.values()) == 0
+
+
+def test_list_not_modified_since(server, view):
+    last_modified = get(view, 'list')['Last-Modified']
+    assert get(view, 'list', HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 304
+
+
+def test_pages_are_cached(server, view):
+    first = get(view, 'list')
+    server.reset_stats()
+    again = get(view, 'list')
+    assert again.status_code == 200
+    assert again.data == first.data
+    assert sum(server.calls.values()) == 0
+    # By path.
+    get(view, 'list', path='/accounts/?page=2')
+    assert server.calls['get_entry_list'] == 1
+
+
+def test_changes_invalidate_validators(server, view):
+    etag = get(view, 'list')['ETag']
+    record = next(r for r in server.dataset.records['Accounts'].values()
+                  if r['name'].startswith('Account 1'))
+    record['date_modified'] = '2030-01-01 00:00:00'
+    # Reused until a logic hook reports the change.
+    assert get(view, 'list', HTTP_IF_NONE_MATCH=etag).status_code == 304
+    record_changed.send(sender='default', module_name='Accounts', record_id=record['id'],
+                        event='after_save')
+    response = get(view, 'list', HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+
+
+def test_retrieve(server, view):
+    record = next(r for r in server.dataset.records['Accounts'].values()
+                  if r['name'].startswith('Account 1'))
+    response = get(view, 'retrieve', pk=record['id'])
+    assert (response.status_code, response.data['name']) == (200, record['name'])
+    server.reset_stats()
+    assert get(view, 'retrieve', pk=record['id'],
+               HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304
+    # Only the entry's date_modified is read.
+    assert dict(server.calls) == {'get_entry_list': 1}
+
+    record['date_modified'] = '2030-01-01 00:00:00'
+    assert get(view, 'retrieve', pk=record['id'],
+               HTTP_IF_NONE_MATCH=response['ETag']).status_code == 200
+
+
+def test_retrieve_missing_entries(view):
+    assert get(view, 'retrieve', pk='no-such-id').status_code == 404
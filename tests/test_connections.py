@@ -0,0 +1,120 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+from sugarcrm.connections import ConnectionHandler, connections, register_connection
+from sugarcrm.stubserver import StubServer
+from sugarcrm.sugarentry import Account
+from sugarcrm.sugarerror import SugarError
+
+
+def make_handler(server, aliases=('a', 'b', 'c'), **kwargs):
+    return ConnectionHandler(dict((alias, {'URL': server.url, 'USERNAME': 'admin',
+                                           'PASSWORD': alias}) for alias in aliases), **kwargs)
+
+
+def test_connections_are_shared(server):
+    handler = make_handler(server)
+    server.reset_stats()
+    assert handler['a'] is handler['a']
+    assert handler['a'] is not handler['b']
+    assert server.calls['login'] == 2
+
+
+def test_concurrent_logins(server):
+    handler = make_handler(server)
+    server.reset_stats()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(handler['a'])) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(map(id, results))) == 1
+    assert server.calls['login'] == 1
+
+
+def test_least_recently_used_are_logged_out(server):
+    handler = make_handler(server, max_connections=2)
+    a, b = handler['a'], handler['b']
+    handler['a']
+    server.reset_stats()
+    handler['c']
+    assert server.calls['logout'] == 1
+    assert len(handler) == 2
+    assert handler['a'] is a
+    assert handler['b'] is not b
+
+
+def test_idle_connections_are_logged_out(server, monkeypatch):
+    handler = make_handler(server, idle_timeout=60)
+    a = handler['a']
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 30)
+    assert handler['b'] and len(handler) == 2
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    server.reset_stats()
+    assert handler['b'] and len(handler) == 1
+    assert server.calls['logout'] == 1
+    assert handler['a'] is not a
+
+
+def test_holders_of_evicted_connections_use_the_alias(server):
+    handler = make_handler(server, max_connections=1)
+    a = handler['a']
+    queryset = Account(a).objects.all()
+    handler['b']
+    assert a.closed and handler.get_open('a') is None
+    server.reset_stats()
+    # The entry logs in through the registry, which evicts 'b' in turn.
+    assert queryset.count() == 50
+    assert (server.calls['login'], server.calls['logout']) == (1, 1)
+    assert handler.get_open('a') is not a and len(handler) == 1
+    queryset.count()
+    assert server.calls['login'] == 1
+
+
+def test_close(server):
+    handler = make_handler(server)
+    handler['a'], handler['b']
+    server.reset_stats()
+    handler.close('a')
+    assert len(handler) == 1
+    handler.close()
+    assert len(handler) == 0
+    assert server.calls['logout'] == 2
+
+
+def test_configure_replaces_the_connection(server):
+    handler = make_handler(server)
+    a = handler['a']
+    with StubServer(records=1) as other:
+        handler.configure('a', other.url, 'admin', 'admin')
+        assert handler['a'] is not a
+        assert handler['a']._url == other.url
+
+
+@pytest.mark.parametrize('alias', ['unknown', 'empty'])
+def test_missing_settings(server, alias):
+    handler = ConnectionHandler({'empty': {'URL': '', 'USERNAME': '', 'PASSWORD': ''}})
+    with pytest.raises(SugarError):
+        handler[alias]
+
+
+def test_entries_and_queries_use_the_alias(server):
+    alias = 'tenant-%s' % uuid.uuid4().hex[:8]
+    register_connection(alias, server.url, 'admin', 'admin')
+    try:
+        account = Account(using=alias)
+        assert account._connection is connections[alias]
+        entry = account.objects.all()[0]
+        assert entry._connection is connections[alias]
+        assert entry['id'] in server.dataset.records['Accounts']
+
+        queryset = Account(server.connect()).objects.using(alias)
+        assert queryset.model._connection is connections[alias]
+        assert queryset.count() == len(server.dataset.records['Accounts'])
+    finally:
+        connections.close(alias)
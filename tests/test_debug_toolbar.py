@@ -0,0 +1,47 @@
+import re
+
+import pytest
+
+pytest.importorskip('debug_toolbar')
+
+from sugarcrm.debug_toolbar import SugarCRMPanel  # noqa: E402
+
+
+class Store:
+    def save_panel(self, request_id, panel_id, stats):
+        pass
+
+
+class Toolbar:
+    request_id = 'request'
+    store = Store()
+
+    def __init__(self):
+        self.stats = {}
+
+
+def test_panel_renders_the_calls_of_the_request(connection):
+    panel = SugarCRMPanel(Toolbar(), None)
+    panel.enable_instrumentation()
+    try:
+        connection.get_entry_list('Accounts', "accounts.name = '<b>'", '', 0, ['id'], [], 10, 0)
+        connection.get_entries_count('Contacts', '', 0)
+    finally:
+        panel.disable_instrumentation()
+    # Calls after the request aren't listed.
+    connection.get_entries_count('Accounts', '', 0)
+    panel.generate_stats(None, None)
+
+    content = panel.content
+    assert re.findall(r'<tr><td>(\w+)</td><td>(\w+)</td>', content) == [
+        ('get_entry_list', 'Accounts'), ('get_entries_count', 'Contacts')]
+    assert '&lt;b&gt;' in content and '<b>' not in content
+    assert len(re.findall(r'<td>\d+\.\d{2}</td>', content)) == 2
+    assert re.search(r'<p>2 calls, \d+\.\d{2}ms, \d+ bytes</p>', content)
+    assert re.match(r'2 calls in \d+\.\d{2}ms$', panel.nav_subtitle)
+
+
+def test_empty_panel(connection):
+    panel = SugarCRMPanel(Toolbar(), None)
+    panel.generate_stats(None, None)
+    assert '<p>0 calls, 0.00ms, 0 bytes</p>' in panel.content
@@ -0,0 +1,117 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+from sugarcrm.fields import EnumValue, to_python, to_sugar, unescape
+from sugarcrm.sugarentry import Opportunity, Task
+
+UTC = datetime.timezone.utc
+
+
+class TypedOpportunity(Opportunity):
+    typed_fields = True
+
+
+class TypedTask(Task):
+    typed_fields = True
+
+
+@pytest.mark.parametrize('meta, value, expected', [
+    ({'type': 'int'}, '42', 42),
+    ({'type': 'currency'}, '10.50', Decimal('10.50')),
+    ({'type': 'float'}, '0.25', 0.25),
+    ({'type': 'bool'}, '1', True),
+    ({'type': 'bool'}, '0', False),
+    ({'type': 'date'}, '2024-02-29', datetime.date(2024, 2, 29)),
+    ({'type': 'datetime'}, '2024-02-29 13:45:00',
+     datetime.datetime(2024, 2, 29, 13, 45, tzinfo=UTC)),
+    ({'type': 'multienum'}, '^a^,^b^', ['a', 'b']),
+    ({'type': 'varchar'}, 'Fish &amp; Chips', 'Fish & Chips'),
+    ({'type': 'int'}, '', None),
+    ({'type': 'date'}, 'not a date', 'not a date'),
+])
+def test_to_python(meta, value, expected):
+    assert to_python(meta, value) == expected
+
+
+@pytest.mark.parametrize('meta, value', [
+    ({'type': 'int'}, 42),
+    ({'type': 'currency'}, Decimal('10.50')),
+    ({'type': 'bool'}, True),
+    ({'type': 'bool'}, False),
+    ({'type': 'date'}, datetime.date(2024, 2, 29)),
+    ({'type': 'datetime'}, datetime.datetime(2024, 2, 29, 13, 45, tzinfo=UTC)),
+    ({'type': 'multienum'}, ['a', 'b']),
+    ({'type': 'varchar'}, 'text'),
+])
+def test_round_trip(meta, value):
+    assert to_python(meta, to_sugar(meta, value)) == value
+
+
+def test_aware_datetimes_are_sent_in_utc():
+    value = datetime.datetime(2024, 1, 1, 12, 0, tzinfo=datetime.timezone(
+        datetime.timedelta(hours=2)))
+    assert to_sugar({'type': 'datetime'}, value) == '2024-01-01 10:00:00'
+
+
+def test_enum_label():
+    value = to_python({'type': 'enum', 'options': {'cw': {'name': 'cw', 'value': 'Closed Won'}}},
+                      'cw')
+    assert isinstance(value, EnumValue)
+    assert (value, value.label) == ('cw', 'Closed Won')
+
+
+def test_unescape_leaves_plain_values():
+    assert unescape('plain') == 'plain'
+    assert unescape(None) is None
+    assert unescape('&lt;b&gt;') == '<b>'
+
+
+def test_entries_convert_their_fields(server, connection):
+    entry = TypedOpportunity(connection).objects.all()[0]
+    record = server.dataset.records['Opportunities'][entry['id']]
+    assert entry['amount'] == Decimal(record['amount'])
+    assert entry['probability'] == int(record['probability'])
+    assert entry['date_closed'] == datetime.datetime.strptime(
+        record['date_closed'], '%Y-%m-%d').date()
+    assert entry['date_modified'].tzinfo is UTC
+    assert entry['sales_stage'] == record['sales_stage']
+    assert entry.amount == entry['amount']
+
+
+def test_untyped_entries_keep_strings(server, connection):
+    entry = Opportunity(connection).objects.all()[0]
+    assert entry['amount'] == server.dataset.records['Opportunities'][entry['id']]['amount']
+
+
+def test_typed_values_are_saved(server, connection):
+    entry = TypedOpportunity(connection).objects.all()[0]
+    entry['amount'] = Decimal('1234.50')
+    entry['probability'] = 75
+    entry['date_closed'] = datetime.date(2030, 1, 31)
+    entry.save()
+    record = server.dataset.records['Opportunities'][entry['id']]
+    assert (record['amount'], record['probability'], record['date_closed']) == \
+        ('1234.50', '75', '2030-01-31')
+
+    reloaded = TypedOpportunity(connection).objects.get(id=entry['id'])
+    assert (reloaded['amount'], reloaded['probability'], reloaded['date_closed']) == \
+        (Decimal('1234.50'), 75, datetime.date(2030, 1, 31))
+
+
+def test_bulk_updates_send_typed_values(server, connection):
+    queryset = TypedOpportunity(connection).objects.filter(name__startswith='Opportunitie 1')
+    updated = queryset.update(amount=Decimal('99.90'), date_closed=datetime.date(2030, 2, 1))
+    records = [r for r in server.dataset.records['Opportunities'].values()
+               if r['name'].startswith('Opportunitie 1')]
+    assert updated == len(records) > 0
+    assert all((r['amount'], r['date_closed']) == ('99.90', '2030-02-01') for r in records)
+
+
+def test_datetimes_round_trip(connection):
+    entry = TypedTask(connection).objects.all()[0]
+    start = datetime.datetime(2031, 5, 6, 7, 8, tzinfo=UTC)
+    entry['date_start'] = start
+    entry.save()
+    assert TypedTask(connection).objects.get(id=entry['id'])['date_start'] == start
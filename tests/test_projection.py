@@ -0,0 +1,79 @@
+from rest_framework import serializers
+
+from sugarcrm import sugarentry
+from sugarcrm.rest_framework import FieldProjectionMixin
+from sugarcrm.sugarentry import Account
+
+
+class NamedAccount(Account):
+    default_fields = ['name']
+
+
+def test_all_fields_by_default(connection):
+    entry = Account(connection).objects.all()[0]
+    assert set(entry.fields()) == set(entry._available_fields)
+
+
+def test_default_fields(connection):
+    entry = NamedAccount(connection).objects.all()[0]
+    assert sorted(entry.fields()) == ['id', 'name']
+
+
+def test_default_fields_setting(connection, monkeypatch):
+    monkeypatch.setitem(sugarentry.DEFAULT_FIELDS, 'Accounts', ['name', 'industry', 'no_such_field'])
+    entry = Account(connection).objects.all()[0]
+    assert sorted(entry.fields()) == ['id', 'industry', 'name']
+
+
+def test_defer(server, connection):
+    entry = Account(connection).objects.defer('description', 'id').all()[0]
+    assert 'description' not in entry.fields()
+    assert 'id' in entry.fields()
+    server.reset_stats()
+    record = server.dataset.records['Accounts'][entry['id']]
+    # Loaded on access.
+    assert entry['description'] == record['description']
+    assert server.calls['get_entry_list'] == 1
+
+
+def test_defer_after_only(connection):
+    queryset = Account(connection).objects.only('name', 'industry').defer('industry')
+    assert queryset._fields == ['name']
+    assert sorted(NamedAccount(connection).objects.defer('name')._fields) == ['id']
+
+
+class AccountSerializer(serializers.Serializer):
+    id = serializers.CharField()
+    name = serializers.CharField()
+    kind = serializers.CharField(source='account_type')
+    summary = serializers.SerializerMethodField()
+
+    def get_summary(self, obj):
+        return obj['name']
+
+
+class AccountView:
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+    def get_queryset(self):
+        return self.queryset
+
+    def get_serializer_class(self):
+        return AccountSerializer
+
+
+class ProjectedAccountView(FieldProjectionMixin, AccountView):
+    pass
+
+
+def test_field_projection_mixin(connection):
+    view = ProjectedAccountView(Account(connection).objects.all())
+    assert view.get_projection_fields() == ['account_type', 'id', 'name']
+    assert view.get_queryset()._fields == ['account_type', 'id', 'name']
+
+
+def test_field_projection_keeps_explicit_projections(connection):
+    queryset = Account(connection).objects.only('description')
+    assert ProjectedAccountView(queryset).get_queryset()._fields == ['description']
@@ -0,0 +1,149 @@
+import uuid
+
+import pytest
+
+from sugarcrm.replica import SQLiteReplica, register_replica
+from sugarcrm.sugarentry import Account, Opportunity
+
+
+@pytest.fixture
+def model(connection):
+    return Opportunity(connection)
+
+
+@pytest.fixture
+def replica(server, model):
+    """A replica holding a copy of the server's Opportunities."""
+    replica = SQLiteReplica()
+    replica.upsert(model, [dict(record) for record in
+                           server.dataset.records['Opportunities'].values()])
+    replica.alias = 'replica-%s' % uuid.uuid4().hex[:8]
+    register_replica(replica.alias, replica)
+    return replica
+
+
+def server_ids(connection, queryset):
+    result = connection.get_entry_list('Opportunities', queryset._query, '', 0, ['id'], [],
+                                       1000, 0)
+    return sorted(entry['id'] for entry in result['entry_list'])
+
+
+def test_where(replica, model):
+    where, params = replica._where(model, [
+        (False, {'name__startswith': 'a_b%'}),
+        (True, {'amount__gt': 5, 'sales_stage__in': ('Closed Won', 'Closed Lost')}),
+        (False, {'pk': 'x', 'no_such_field': 1}),
+    ])
+    assert where == ('''("name" LIKE ? ESCAPE '\\') AND NOT (CAST("amount" AS REAL) > ? AND '''
+                     '''"sales_stage" IN (?, ?)) AND ("id" = ?)''')
+    assert params == ['a\\_b\\%%', 5, 'Closed Won', 'Closed Lost', 'x']
+
+
+def test_unsupported_lookups(replica, model):
+    with pytest.raises(LookupError):
+        replica._where(model, [(False, {'name__regex': 'x'})])
+
+
+def test_fields_never_synced_are_null(model):
+    replica = SQLiteReplica()
+    replica.upsert(model, [{'id': '1', 'name': 'x'}])
+    assert replica._where(model, [(False, {'amount': 1})]) == (
+        '(CAST(NULL AS REAL) = ?)', [1])
+    assert replica.count(model, [(False, {'amount': 1})]) == 0
+
+
+@pytest.mark.parametrize('method, lookups', [
+    # The stub names them 'Opportunitie <n>'.
+    ('filter', {'name': 'Opportunitie 1'}),
+    ('filter', {'name__exact': 'Opportunitie 12'}),
+    ('filter', {'name__contains': 'ie 1'}),
+    ('filter', {'name__startswith': 'Opportunitie 2'}),
+    ('filter', {'sales_stage__in': ['Closed Won', 'Prospecting']}),
+    ('filter', {'amount__gt': 5000}),
+    ('filter', {'amount__lt': '5000.5'}),
+    ('filter', {'probability__gte': 50, 'sales_stage': 'Negotiation/Review'}),
+    ('filter', {'probability__lte': 30}),
+    ('exclude', {'sales_stage': 'Closed Lost'}),
+])
+def test_lookups_match_the_server(connection, model, replica, method, lookups):
+    queryset = getattr(model.objects, method)(**lookups)
+    expected = server_ids(connection, queryset)
+    assert expected
+    routed = queryset.using(replica.alias)
+    assert sorted(entry['id'] for entry in routed) == expected
+    assert routed.count() == len(expected)
+
+
+def test_chained_filters(connection, model, replica):
+    queryset = model.objects.filter(amount__gt=1000).exclude(probability__lt=20).filter(
+        name__contains='1')
+    assert sorted(e['id'] for e in queryset.using(replica.alias)) == \
+        server_ids(connection, queryset)
+
+
+def test_like_wildcards_are_escaped(model):
+    replica = SQLiteReplica()
+    replica.upsert(model, [{'id': '1', 'name': 'a_b%c'}, {'id': '2', 'name': 'axbyc'}])
+    assert [e['id'] for e in replica.search(model, [(False, {'name__startswith': 'a_b%'})])] \
+        == ['1']
+    assert [e['id'] for e in replica.search(model, [(False, {'name__contains': '_'})])] == ['1']
+
+
+def test_order_and_slices(server, model, replica):
+    names = sorted((r['name'] for r in server.dataset.records['Opportunities'].values()),
+                   reverse=True)
+    entries = replica.search(model, [], 'opportunities.name desc', 5, 10, ['name'])
+    assert [e['name'] for e in entries] == names[5:15]
+    assert [e['name'] for e in model.objects.using(replica.alias).order_by('-name')[:3]] == \
+        names[:3]
+
+
+def test_modules_not_replicated(connection, replica):
+    model = Account(connection)
+    assert list(replica.search(model, [])) == []
+    assert replica.count(model, []) == 0
+
+
+def live_ids(server):
+    return sorted(r['id'] for r in server.dataset.records['Opportunities'].values()
+                  if str(r['deleted']) == '0')
+
+
+def test_sync(server, model):
+    replica = SQLiteReplica()
+    assert replica.sync(model, page_size=7) == len(live_ids(server))
+    assert sorted(e['id'] for e in replica.search(model, [])) == live_ids(server)
+
+    records = sorted(server.dataset.records['Opportunities'].values(), key=lambda r: r['id'])
+    last_sync = max(r['date_modified'] for r in records)
+    unchanged = len([r for r in records[3:] if r['date_modified'] == last_sync])
+    for record in records[:2]:
+        record.update({'deleted': '1', 'date_modified': '2099-01-01 00:00:00'})
+    records[2].update({'name': 'Renamed', 'date_modified': '2099-01-01 00:00:00'})
+    server.reset_stats()
+    # The changed records, live and deleted, and those of the last sync date.
+    assert replica.sync(model, page_size=7) == 3 + unchanged
+    assert server.calls['get_entry_list'] == 2
+    assert sorted(e['id'] for e in replica.search(model, [])) == live_ids(server)
+    assert [e['id'] for e in replica.search(model, [(False, {'name': 'Renamed'})])] == \
+        [records[2]['id']]
+    assert replica.count(model, [(False, {'pk': records[0]['id']})]) == 0
+
+
+def test_full_sync_removes_deleted_records(server, model):
+    replica = SQLiteReplica()
+    replica.sync(model)
+    record = next(r for r in server.dataset.records['Opportunities'].values()
+                  if str(r['deleted']) == '0')
+    record['deleted'] = '1'
+    replica.sync(model, full=True)
+    assert sorted(e['id'] for e in replica.search(model, [])) == live_ids(server)
+
+
+def test_stub_selects_deleted_records_only(server, connection):
+    record = next(iter(server.dataset.records['Opportunities'].values()))
+    record['deleted'] = '1'
+    deleted = connection.get_entry_list('Opportunities', '', '', 0, ['id'], [], 1000, 1)
+    assert [entry['id'] for entry in deleted['entry_list']] == [record['id']]
+    assert connection.get_entries_count('Opportunities', '', 0)['result_count'] == \
+        str(len(live_ids(server)))
@@ -0,0 +1,102 @@
+import math
+import threading
+import time
+
+import pytest
+
+from sugarcrm import reports
+from sugarcrm.sugarentry import Report
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    reports.clear_cache()
+    yield
+    reports.clear_cache()
+
+
+@pytest.fixture
+def report(connection):
+    return Report(connection).objects.all()[0]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_execute(server, report):
+    table = report.execute()
+    records = list(server.dataset.records['Opportunities'].values())
+    assert len(table) == len(records)
+    assert table.column_names == ['name', 'amount', 'sales_stage', 'probability']
+    assert list(table['amount']) == [float(r['amount']) for r in records]
+    assert list(table['name']) == [r['name'] for r in records]
+    assert next(iter(table))['sales_stage'] == records[0]['sales_stage']
+
+
+def test_results_are_cached(server, report):
+    table = report.execute(fields=['name', 'amount'])
+    server.reset_stats()
+    assert report.execute(fields=['name', 'amount']) is table
+    assert server.calls['get_report_entries'] == 0
+    report.execute(fields=['name'])
+    assert report.execute(fields=['name', 'amount'], cache=False) is not table
+    assert server.calls['get_report_entries'] == 2
+
+
+def test_results_expire(server, report, monkeypatch):
+    table = report.execute(ttl=60)
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    server.reset_stats()
+    assert report.execute(ttl=60) is not table
+    assert server.calls['get_report_entries'] == 1
+
+
+def test_refresh_ahead(server, connection, report, monkeypatch):
+    table = report.execute(ttl=100)
+    key = reports._cache_key(connection, report['id'], None)
+    now = time.time()
+    server.reset_stats()
+    monkeypatch.setattr(time, 'time', lambda: now + 50)
+    assert report.execute(ttl=100) is table
+    assert server.calls['get_report_entries'] == 0
+
+    # Past REFRESH_AHEAD of the ttl, the cached table is still returned and
+    # a fresh one fetched in the background.
+    release = threading.Event()
+    fetch = reports.fetch
+
+    def slow_fetch(*args):
+        release.wait(5)
+        return fetch(*args)
+    monkeypatch.setattr(reports, 'fetch', slow_fetch)
+    monkeypatch.setattr(time, 'time', lambda: now + 85)
+    assert report.execute(ttl=100) is table
+    # A single refresh at a time.
+    assert report.execute(ttl=100) is table
+    release.set()
+    wait_for(lambda: reports._cache.get(key) is not table)
+    assert server.calls['get_report_entries'] == 1
+
+
+@pytest.mark.parametrize('with_numpy', [True, False])
+def test_columns(monkeypatch, with_numpy):
+    if with_numpy:
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(reports, 'numpy', None)
+    table = reports.ReportTable.from_rows([
+        {'name': {'name': 'name', 'value': 'a'}, 'amount': {'name': 'amount', 'value': '1.5'}},
+        [{'name': 'name', 'value': 'b'}, {'name': 'amount', 'value': ''},
+         {'name': 'stage', 'value': 'Won'}],
+        {'amount': '3', 'stage': '2'},
+    ])
+    assert len(table) == 3
+    amount = list(table['amount'])
+    assert amount[0] == 1.5 and math.isnan(amount[1]) and amount[2] == 3
+    assert list(table['name']) == ['a', 'b', None]
+    assert list(table['stage']) == [None, 'Won', '2']
@@ -0,0 +1,152 @@
+import datetime
+import io
+import json
+import time
+from decimal import Decimal
+
+import pytest
+from django.core.management import call_command
+
+from sugarcrm import schema
+from sugarcrm.connections import connections, register_connection
+from sugarcrm.fields import EnumValue
+from sugarcrm.stubserver import StubServer
+from sugarcrm.sugarcrm import Sugarcrm
+
+METADATA_CALLS = ('get_available_modules', 'get_module_fields')
+
+
+@pytest.fixture
+def snapshot_path(tmp_path, connection):
+    path = str(tmp_path / 'schema.json')
+    schema.save_snapshot(schema.take_snapshot(connection, ['Accounts', 'Contacts']), path)
+    return path
+
+
+def metadata_calls(server):
+    return dict((method, server.calls[method]) for method in METADATA_CALLS
+                if server.calls[method])
+
+
+def test_snapshot_contents(server, snapshot_path):
+    snapshot = schema.load_snapshot(snapshot_path)
+    assert snapshot['format'] == schema.SNAPSHOT_FORMAT
+    assert snapshot['url'] == server.url
+    assert sorted(snapshot['modules']) == ['Accounts', 'Contacts']
+    assert snapshot['modules']['Accounts'] == server.connect().get_module_fields('Accounts')
+
+
+def test_connection_uses_the_snapshot(server, snapshot_path):
+    server.reset_stats()
+    connection = Sugarcrm(server.url, 'admin', 'admin', schema_snapshot=snapshot_path)
+    connection.get_module_schema('Accounts')
+    assert metadata_calls(server) == {}
+    connection.get_module_schema('Leads')
+    assert metadata_calls(server) == {'get_module_fields': 1}
+
+
+def test_snapshot_of_another_url_is_ignored(snapshot_path):
+    with StubServer(records=1) as other:
+        connection = Sugarcrm(other.url, 'admin', 'admin', schema_snapshot=snapshot_path,
+                              check_snapshot=False)
+        connection.get_module_schema('Accounts')
+        assert metadata_calls(other) == {'get_available_modules': 1, 'get_module_fields': 1}
+
+
+def test_snapshot_of_another_version_is_ignored(server, snapshot_path):
+    with open(snapshot_path) as f:
+        snapshot = json.load(f)
+    snapshot['server_version'] = 'CE 1.0'
+    schema.save_snapshot(snapshot, snapshot_path)
+    server.reset_stats()
+    connection = Sugarcrm(server.url, 'admin', 'admin', schema_snapshot=snapshot_path)
+    connection.get_module_schema('Accounts')
+    assert metadata_calls(server) == {'get_available_modules': 1, 'get_module_fields': 1}
+
+    server.reset_stats()
+    unchecked = Sugarcrm(server.url, 'admin', 'admin', schema_snapshot=snapshot_path,
+                         check_snapshot=False)
+    unchecked.get_module_schema('Accounts')
+    assert metadata_calls(server) == {}
+
+
+@pytest.mark.parametrize('content', ['not json', '{"format": 0}', '{"format": 1}', '{}'])
+def test_unusable_snapshots(tmp_path, content):
+    path = tmp_path / 'schema.json'
+    path.write_text(content)
+    assert schema.load_snapshot(str(path)) is None
+
+
+def test_missing_snapshot(tmp_path, server):
+    path = str(tmp_path / 'missing.json')
+    assert schema.load_snapshot(path) is None
+    connection = Sugarcrm(server.url, 'admin', 'admin', schema_snapshot=path)
+    assert 'Accounts' in connection.rst_modules
+
+
+def test_inspectsugar_snapshots_each_alias(tmp_path, server):
+    register_connection('schema-test', server.url, 'admin', 'admin')
+    try:
+        path = str(tmp_path / 'schema.json')
+        call_command('inspectsugar', 'Accounts', using='schema-test', output=path,
+                     stdout=io.StringIO())
+    finally:
+        connections.close('schema-test')
+    snapshot = schema.load_snapshot(path)
+    assert (snapshot['url'], list(snapshot['modules'])) == (server.url, ['Accounts'])
+
+
+@pytest.mark.parametrize('module_name, expected', [
+    ('Opportunities', 'Opportunity'),
+    ('Accounts', 'Account'),
+    ('Addresses', 'Address'),
+    ('Bugs_Tracker', 'BugsTracker'),
+    ('ProspectLists', 'ProspectList'),
+])
+def test_class_names(module_name, expected):
+    assert schema.class_name(module_name) == expected
+
+
+def test_schemas_expire(server, monkeypatch):
+    connection = Sugarcrm(server.url, 'admin', 'admin', schema_ttl=60)
+    connection.get_module_schema('Accounts')
+    server.reset_stats()
+    connection.get_module_schema('Accounts')
+    assert metadata_calls(server) == {}
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    connection.get_module_schema('Accounts')
+    assert metadata_calls(server) == {'get_module_fields': 1}
+
+
+def test_invalidate_schema(server, connection):
+    connection['Accounts']
+    server.reset_stats()
+    connection.invalidate_schema('Accounts')
+    assert 'Accounts' not in connection.modules
+    connection['Accounts']
+    assert metadata_calls(server) == {'get_module_fields': 1}
+
+
+def test_generated_classes(connection):
+    snapshot = schema.take_snapshot(connection, ['Accounts', 'Opportunities'])
+    source = schema.generate_classes(snapshot)
+    namespace = {}
+    exec(compile(source, 'sugarcrm_models.py', 'exec'), namespace)
+    assert namespace['Account'].module_name == 'Accounts'
+    opportunity = namespace['Opportunity']
+    assert (opportunity.module_name, opportunity.typed_fields) == ('Opportunities', True)
+    annotations = opportunity.__annotations__
+    assert annotations['amount'] is Decimal
+    assert annotations['probability'] is int
+    assert annotations['date_closed'] is datetime.date
+    assert annotations['date_entered'] is datetime.datetime
+    assert annotations['deleted'] is bool
+    assert annotations['sales_stage'] is EnumValue
+    assert annotations['name'] is str
+
+    # The annotations are the types of the values of typed entries.
+    entry = opportunity(connection).objects.all()[0]
+    for field in ('amount', 'probability', 'date_closed', 'date_entered', 'sales_stage',
+                  'name'):
+        assert isinstance(entry[field], annotations[field])
@@ -0,0 +1,74 @@
+import time
+
+from sugarcrm.cache import TTLCache
+from sugarcrm.search import Searcher
+
+
+def names(entries):
+    return sorted(entry['name'] for entry in entries)
+
+
+def test_search(server, connection):
+    results = connection.search('account 1', modules=['Contacts', 'Accounts'],
+                                fields=['id', 'name'], max_results=100)
+    # In the order of the modules, whatever the order they answered in.
+    assert list(results) == ['Contacts', 'Accounts']
+    assert results['Contacts'] == []
+    assert names(results['Accounts']) == sorted(
+        r['name'] for r in server.dataset.records['Accounts'].values()
+        if r['name'].startswith('Account 1'))
+    assert all(type(entry).__name__ == 'SugarEntry' and entry.module_name == 'Accounts'
+               for entry in results['Accounts'])
+
+
+def test_iter_search(connection):
+    pairs = list(connection.iter_search('1', fields=['id', 'name']))
+    assert sorted(module for module, entries in pairs) == [
+        'Accounts', 'Contacts', 'Leads', 'Opportunities']
+    assert all(entries for module, entries in pairs)
+
+
+def test_results_are_cached(server, connection):
+    first = connection.search('Account 1', modules=['Accounts'], fields=['id', 'name'])
+    server.reset_stats()
+    again = connection.search('  account 1 ', modules=['Accounts'], fields=['id', 'name'])
+    assert server.calls['search_by_module'] == 0
+    assert names(again['Accounts']) == names(first['Accounts'])
+    # Cached entries aren't shared between searches.
+    assert again['Accounts'][0] is not first['Accounts'][0]
+    connection.search('Account 1', modules=['Accounts'], fields=['id', 'name'], max_results=3)
+    assert server.calls['search_by_module'] == 1
+
+
+def test_results_expire(server, connection, monkeypatch):
+    searcher = Searcher(connection, ttl=30)
+    searcher.search('Account 1', ['Accounts'])
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 31)
+    server.reset_stats()
+    searcher.search('Account 1', ['Accounts'])
+    assert server.calls['search_by_module'] == 1
+
+
+def test_clear(server, connection):
+    searcher = Searcher(connection)
+    searcher.search('Account 1', ['Accounts'])
+    searcher.clear()
+    server.reset_stats()
+    searcher.search('Account 1', ['Accounts'])
+    assert server.calls['search_by_module'] == 1
+
+
+def test_unknown_modules(connection):
+    assert connection.search('1', modules=['NoSuchModule']) == {'NoSuchModule': []}
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(60, maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+    cache.set('d', 4, ttl=-1)
+    assert cache.get('d', 'expired') == 'expired'
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from sugarcrm.streaming import iter_json_object
+from sugarcrm.sugarentry import Account
+
+
+def chunked(data, size):
+    data = data.encode('utf-8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+DOCUMENT = {
+    'result_count': 3,
+    'entry_list': [{'id': '1', 'name': 'café ☃'}, {'id': '2', 'name': 'a "quoted" \\ name'},
+                   {'id': '3', 'values': [1, 2.5, -3e2, True, False, None]}],
+    'relationship_list': [],
+    'next_offset': 3,
+}
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 1024])
+def test_streams_items_whatever_the_chunk_size(size):
+    members = list(iter_json_object(chunked(json.dumps(DOCUMENT), size), ('entry_list',)))
+    assert [m for m in members if m[2]] == [('entry_list', e, True)
+                                            for e in DOCUMENT['entry_list']]
+    assert [(k, v) for k, v, is_item in members if not is_item] == [
+        ('result_count', 3), ('relationship_list', []), ('next_offset', 3)]
+
+
+def test_members_keep_their_order():
+    members = list(iter_json_object(chunked(json.dumps(DOCUMENT), 3), ('entry_list',)))
+    assert [m[0] for m in members] == ['result_count', 'entry_list', 'entry_list',
+                                       'entry_list', 'relationship_list', 'next_offset']
+
+
+def test_nested_depth():
+    document = {'entry_list': [[{'id': 1}, {'id': 2}], [{'id': 3}]]}
+    members = list(iter_json_object(chunked(json.dumps(document), 4), {'entry_list': 2}))
+    assert [v for k, v, is_item in members] == [{'id': 1}, {'id': 2}, {'id': 3}]
+
+
+def test_keys_not_streamed_are_whole_values():
+    members = list(iter_json_object(chunked(json.dumps(DOCUMENT), 5)))
+    assert dict((k, v) for k, v, is_item in members) == DOCUMENT
+
+
+@pytest.mark.parametrize('document', ['null', '', '{}', '  {  }  '])
+def test_empty_documents(document):
+    assert list(iter_json_object(chunked(document, 1))) == []
+
+
+def test_rejects_other_documents():
+    with pytest.raises(ValueError):
+        list(iter_json_object(chunked('[1, 2]', 1)))
+
+
+def test_matches_the_whole_response(connection):
+    streamed = [record['id'] for record in connection.iter_entry_list(
+        'Accounts', '', '', 0, ['id', 'name'], [], 50, 0)]
+    whole = connection.get_entry_list('Accounts', '', '', 0, ['id', 'name'], [], 50, 0)
+    assert streamed == [record['id'] for record in whole['entry_list']]
+    assert len(streamed) == 50
+
+
+def test_querysets_are_fetched_once(server, connection):
+    queryset = Account(connection).objects.all()
+    server.reset_stats()
+    # list() asks for the length between iter() and the first entry.
+    entries = list(queryset)
+    assert len(entries) == len(queryset) == 20
+    assert [entry['id'] for entry in queryset] == [entry['id'] for entry in entries]
+    assert server.calls['get_entry_list'] == 1
+
+
+def test_loops_left_early_cache_nothing(server, connection):
+    queryset = Account(connection).objects.all()
+    server.reset_stats()
+    for entry in queryset:
+        break
+    assert len(list(queryset)) == 20
+    assert server.calls['get_entry_list'] == 2
@@ -0,0 +1,67 @@
+import pytest
+
+from sugarcrm.stubserver import Dataset, QueryMatcher, QuerySyntaxError
+from sugarcrm.sugarentry import Account
+
+RECORD = {'name': "O'Brien & Co", 'amount': '250.50', 'status': 'New', 'description': ''}
+
+
+def test_datasets_are_reproducible():
+    assert Dataset(records=5).records == Dataset(records=5).records
+    assert Dataset(records=5, seed=1).records != Dataset(records=5).records
+
+
+def test_dataset_sizes():
+    dataset = Dataset(records={'Accounts': 3, 'Contacts': 7})
+    assert (len(dataset.records['Accounts']), len(dataset.records['Contacts'])) == (3, 7)
+    assert len(dataset.records['Leads']) == 0
+    # Contacts are spread over the accounts.
+    account_id = next(iter(dataset.records['Accounts']))
+    assert len(dataset.links[('Accounts', account_id)]['contacts']) == 3
+
+
+@pytest.mark.parametrize('query, matches', [
+    ('', True),
+    ('accounts.name = "o\'brien & co"', True),
+    ("name = 'O''Brien & Co'", True),
+    ('accounts.name LIKE "O%"', True),
+    ('name LIKE "%Co_"', False),
+    ('amount > 100', True),
+    ('amount <= 250', False),
+    ("status IN ('New','Closed')", True),
+    ("status NOT IN ('New')", False),
+    ('description IS NULL', True),
+    ('(amount > 1000 OR status = "New") AND NOT (name = "x")', True),
+])
+def test_query_matcher(query, matches):
+    assert QueryMatcher(query)(RECORD) is matches
+
+
+def test_query_syntax_errors():
+    with pytest.raises(QuerySyntaxError):
+        QueryMatcher('name = ')
+    with pytest.raises(QuerySyntaxError):
+        QueryMatcher('(name = "x"')
+
+
+def test_queries_are_served(server, connection):
+    server.reset_stats()
+    names = [e['name'] for e in Account(connection).objects.filter(name__startswith='Account 1')]
+    assert sorted(names) == sorted(
+        r['name'] for r in server.dataset.records['Accounts'].values()
+        if r['name'].startswith('Account 1'))
+    assert server.calls['get_entry_list'] == 1
+
+
+def test_entries_are_stored(server, connection):
+    account = Account(connection)
+    account.name = 'Stored'
+    account.save()
+    assert server.dataset.records['Accounts'][account['id']]['name'] == 'Stored'
+
+
+def test_expired_sessions_log_in_again(server, connection):
+    server.backend.expire_sessions()
+    server.reset_stats()
+    assert int(connection.get_entries_count('Accounts', '', 0)['result_count']) == 50
+    assert server.calls['login'] == 1
@@ -0,0 +1,75 @@
+import pytest
+
+from sugarcrm.sugarentry import Account
+
+
+class RefreshedAccount(Account):
+    refresh_fields = ('date_entered',)
+
+
+def test_create_without_refetch(server, connection):
+    account = Account(connection)
+    server.reset_stats()
+    account['name'] = 'Created'
+    account.save()
+    assert account['id']
+    assert dict(server.calls) == {'set_entry': 1}
+    assert server.dataset.records['Accounts'][account['id']]['name'] == 'Created'
+    # Fields set_entry didn't return are loaded on access.
+    assert account['date_entered'] == \
+        server.dataset.records['Accounts'][account['id']]['date_entered']
+    assert server.calls['get_entry_list'] == 1
+
+
+def test_fields_as_attributes_are_loaded_lazily(server, connection):
+    account = Account(connection)
+    # New entries have nothing to load.
+    with pytest.raises(AttributeError):
+        account.date_entered
+    account.name = 'Created'
+    account.save()
+    server.reset_stats()
+    assert account.date_entered == \
+        server.dataset.records['Accounts'][account['id']]['date_entered']
+    assert dict(server.calls) == {'get_entry_list': 1}
+    assert account.name == 'Created'
+    with pytest.raises(AttributeError):
+        account.no_such_field
+
+
+def test_refresh_fields(server, connection):
+    account = RefreshedAccount(connection)
+    server.reset_stats()
+    account['name'] = 'Refreshed'
+    account.save()
+    assert dict(server.calls) == {'set_entry': 1, 'get_entry': 1}
+    record = server.dataset.records['Accounts'][account['id']]
+    assert account.fields()['date_entered'] == record['date_entered']
+
+    other = Account(connection)
+    other['name'] = 'Refreshed too'
+    server.reset_stats()
+    other.save(refresh_fields=['date_modified', 'created_by'])
+    assert dict(server.calls) == {'set_entry': 1, 'get_entry': 1}
+    assert other.fields()['created_by'] == '1'
+
+
+def test_update_fields(server, connection):
+    account = Account(connection).objects.all()[0]
+    record = server.dataset.records['Accounts'][account['id']]
+    description = record['description']
+    account['name'] = 'Partly saved'
+    account['description'] = 'Saved later'
+    account.save(update_fields=['name'])
+    assert (record['name'], record['description']) == ('Partly saved', description)
+    account.save()
+    assert record['description'] == 'Saved later'
+
+
+def test_delete_sends_the_deleted_flag_only(server, connection):
+    account = Account(connection).objects.all()[0]
+    record = server.dataset.records['Accounts'][account['id']]
+    account['name'] = 'Not saved'
+    account.delete()
+    assert str(record['deleted']) == '1'
+    assert record['name'] != 'Not saved'
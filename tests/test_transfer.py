@@ -0,0 +1,117 @@
+import base64
+import functools
+import io
+import json
+
+import pytest
+
+from sugarcrm import transfer
+from sugarcrm.sugarentry import Document, Note
+from sugarcrm.sugarerror import SugarError
+
+# Its base64 encoding has many '/', escaped as '\/' by the server.
+CONTENT = bytes(range(256)) * 3000
+
+
+class Unseekable:
+    """Binary stream without tell() or seek(), sent with chunked encoding."""
+
+    def __init__(self, data):
+        self._stream = io.BytesIO(data)
+
+    def read(self, size):
+        return self._stream.read(size)
+
+
+@pytest.fixture
+def note(connection):
+    return Note(connection).objects.all()[0]
+
+
+@pytest.mark.parametrize('make_source', [
+    lambda path: str(path),
+    lambda path: open(str(path), 'rb'),
+    lambda path: Unseekable(path.read_bytes()),
+], ids=['path', 'file', 'unseekable'])
+def test_upload_and_download(tmp_path, server, note, make_source):
+    path = tmp_path / 'upload.bin'
+    path.write_bytes(CONTENT)
+    sent = []
+    note.upload(make_source(path), filename='upload.bin', chunk_size=3 * 1000,
+                progress=lambda done, total: sent.append((done, total)))
+    assert server.dataset.files[note['id']] == ('upload.bin', CONTENT)
+    assert sent[-1][0] == len(CONTENT)
+
+    received = io.BytesIO()
+    metadata = note.download(received)
+    assert received.getvalue() == CONTENT
+    assert metadata['filename'] == 'upload.bin'
+    assert metadata['file'] == ''
+
+
+def test_retry_after_session_loss(tmp_path, server, note):
+    path = tmp_path / 'upload.bin'
+    path.write_bytes(CONTENT)
+    server.backend.expire_sessions()
+    server.reset_stats()
+    note.upload(str(path))
+    assert server.calls['login'] == 1
+    assert server.dataset.files[note['id']] == ('upload.bin', CONTENT)
+
+    server.backend.expire_sessions()
+    destination = tmp_path / 'download.bin'
+    note.download(str(destination))
+    assert server.calls['login'] == 2
+    assert destination.read_bytes() == CONTENT
+
+
+def test_document_revisions(server, connection):
+    document = Document(connection).objects.all()[0]
+    revision_id = document.upload_revision(io.BytesIO(CONTENT), '2', filename='v2.bin')
+    assert document['document_revision_id'] == revision_id
+    received = io.BytesIO()
+    metadata = document.download_revision(received)
+    assert received.getvalue() == CONTENT
+    assert (metadata['revision'], metadata['filename']) == ('2', 'v2.bin')
+
+
+@pytest.mark.parametrize('result', [{}, {'id': -1}])
+def test_failed_revisions_raise(server, connection, monkeypatch, result):
+    monkeypatch.setattr(server.backend, 'do_set_document_revision',
+                        lambda revision: result)
+    document = Document(connection).objects.all()[0]
+    with pytest.raises(SugarError):
+        document.upload_revision(io.BytesIO(CONTENT), '2')
+    assert document['document_revision_id'] != -1
+
+
+def test_transfer_many(tmp_path, connection):
+    notes = Note(connection).objects.all()[:3]
+    for i, note in enumerate(notes):
+        note.upload(io.BytesIO(CONTENT[i:]), filename='%d.bin' % i)
+    results = transfer.transfer_many(
+        functools.partial(note.download, str(tmp_path / ('%d.bin' % i)))
+        for i, note in enumerate(notes))
+    assert [r['filename'] for r in results] == ['0.bin', '1.bin', '2.bin']
+    assert all((tmp_path / ('%d.bin' % i)).read_bytes() == CONTENT[i:] for i in range(3))
+
+
+@pytest.mark.parametrize('size', [1, 2, 5, 1000])
+def test_file_member_decoder(size):
+    response = json.dumps({'note_attachment': {
+        'id': 'x', 'file': base64.b64encode(CONTENT[:3000]).decode('ascii'),
+        'filename': 'a/b'}}).replace('/', '\\/')
+    fileobj = io.BytesIO()
+    decoder = transfer._FileMemberDecoder(fileobj)
+    for i in range(0, len(response), size):
+        decoder.feed(response[i:i + size])
+    assert fileobj.getvalue() == CONTENT[:3000]
+    assert json.loads(decoder.close()) == {'note_attachment': {
+        'id': 'x', 'file': '', 'filename': 'a/b'}}
+
+
+def test_truncated_file_member():
+    decoder = transfer._FileMemberDecoder(io.BytesIO())
+    decoder.feed('{"note_attachment": {"file": "QUJD')
+    with pytest.raises(ValueError):
+        decoder.close()
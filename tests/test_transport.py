@@ -0,0 +1,89 @@
+import gzip
+import io
+import json
+import zlib
+
+import pytest
+
+from sugarcrm.stubserver import StubServer
+from sugarcrm.sugarentry import Account
+
+BODY = json.dumps({'entry_list': [{'id': str(i), 'name': 'Account %d' % i}
+                                  for i in range(2000)]}).encode('utf-8')
+
+
+class FakeResponse:
+
+    def __init__(self, body, encoding=''):
+        self.headers = {'Content-Encoding': encoding} if encoding else {}
+        self._body = io.BytesIO(body)
+        self.closed = False
+
+    def read(self, size):
+        return self._body.read(size)
+
+    def close(self):
+        self.closed = True
+
+
+def raw_deflate(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+@pytest.mark.parametrize('encoding, body', [
+    ('', BODY),
+    ('gzip', gzip.compress(BODY)),
+    ('x-gzip', gzip.compress(BODY)),
+    ('deflate', zlib.compress(BODY)),
+    # Servers sending deflate without the zlib header.
+    ('deflate', raw_deflate(BODY)),
+], ids=['identity', 'gzip', 'x-gzip', 'deflate', 'raw-deflate'])
+def test_decodes_responses(connection, encoding, body):
+    sizes = [0, 0]
+    response = FakeResponse(body, encoding)
+    assert b''.join(connection._read_chunks(response, sizes)) == BODY
+    assert sizes == [len(body), len(BODY)]
+    assert response.closed
+
+
+def test_corrupt_gzip_raises(connection):
+    response = FakeResponse(b'not gzip data', 'gzip')
+    with pytest.raises(zlib.error):
+        b''.join(connection._read_chunks(response, [0, 0]))
+    assert response.closed
+
+
+def test_abandoned_read_closes_the_response(connection, monkeypatch):
+    monkeypatch.setattr('sugarcrm.sugarcrm.CHUNK_SIZE', 1024)
+    response = FakeResponse(gzip.compress(BODY), 'gzip')
+    chunks = connection._read_chunks(response, [0, 0])
+    next(chunks)
+    assert not response.closed
+    chunks.close()
+    assert response.closed
+
+
+def test_compressed_responses_match_plain_ones():
+    with StubServer(records=100) as compressed, StubServer(records=100,
+                                                           compression=False) as plain:
+        results = []
+        for server in (compressed, plain):
+            connection = server.connect()
+            results.append(connection.get_entry_list('Accounts', '', '', 0, [], [], 100, 0))
+            assert connection.bytes_decoded == server.bytes_out_decoded
+        assert results[0] == results[1]
+        assert compressed.bytes_out < plain.bytes_out
+
+
+@pytest.mark.parametrize('compress_requests', [True, False])
+def test_large_requests(server, compress_requests):
+    connection = server.connect(compress_requests=compress_requests)
+    account = Account(connection)
+    account['name'] = 'Large'
+    account['description'] = 'Long description. ' * 10000
+    server.reset_stats()
+    account.save()
+    assert server.dataset.records['Accounts'][account['id']]['description'] == \
+        account['description']
+    assert (server.bytes_in < 20000) is compress_requests
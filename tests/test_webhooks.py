@@ -0,0 +1,115 @@
+import hashlib
+import hmac
+import json
+import uuid
+
+import pytest
+from django.test import Client
+
+from sugarcrm import reports
+from sugarcrm.connections import connections, register_connection
+from sugarcrm.replica import SQLiteReplica, register_replica
+from sugarcrm.stubserver import StubServer
+
+SECRET = 'secret'
+
+
+def post(path, events, secret=SECRET):
+    body = json.dumps(events).encode('utf-8')
+    signature = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return Client().post(path, body, content_type='application/json',
+                         HTTP_X_SUGARCRM_SIGNATURE=signature)
+
+
+@pytest.fixture
+def tenants():
+    """Two tenants, each with a replica of its Accounts."""
+    with StubServer(records=10) as first, StubServer(records=10) as second:
+        tenants = []
+        for server in (first, second):
+            alias = 'tenant-%s' % uuid.uuid4().hex[:8]
+            register_connection(alias, server.url, 'admin', 'admin')
+            replica = SQLiteReplica(connection=alias)
+            register_replica('replica-%s' % alias, replica)
+            replica.sync(connections[alias]['Accounts'])
+            tenants.append((alias, server, replica))
+        yield tenants
+        for alias, server, replica in tenants:
+            connections.close(alias)
+
+
+def replica_names(tenant):
+    alias, server, replica = tenant
+    return dict((entry['id'], entry['name']) for entry in
+                replica.search(connections[alias]['Accounts'], {}, fields=['id', 'name']))
+
+
+def test_rejects_bad_signatures(tenants):
+    alias = tenants[0][0]
+    assert post('/hooks/%s/' % alias, {'event': 'after_save'}, 'wrong').status_code == 403
+    assert post('/hooks/%s/' % alias, {'event': 'unknown', 'module': 'Accounts',
+                                       'id': 'x'}).status_code == 400
+
+
+def test_save_refreshes_the_tenant_replica_only(tenants):
+    (alias, server, replica), (other_alias, other_server, other_replica) = tenants
+    record = next(iter(server.dataset.records['Accounts'].values()))
+    record['name'] = 'Renamed on the server'
+    other_server.reset_stats()
+
+    response = post('/hooks/%s/' % alias, {'event': 'after_save', 'module': 'Accounts',
+                                           'id': record['id']})
+    assert response.status_code == 200
+    assert replica_names(tenants[0])[record['id']] == 'Renamed on the server'
+    assert sum(other_server.calls.values()) == 0
+
+
+def test_refreshes_with_a_closed_connection(tenants):
+    alias, server, replica = tenants[0]
+    record = next(iter(server.dataset.records['Accounts'].values()))
+    record['name'] = 'Renamed while logged out'
+    connections.close(alias)
+    assert connections.get_open(alias) is None
+
+    assert post('/hooks/%s/' % alias, {'event': 'after_save', 'module': 'Accounts',
+                                       'id': record['id']}).status_code == 200
+    assert replica_names(tenants[0])[record['id']] == 'Renamed while logged out'
+
+
+def test_delete_removes_from_the_tenant_replica_only(tenants):
+    (alias, server, replica), other = tenants
+    record_id = next(iter(server.dataset.records['Accounts']))
+    other_ids = set(replica_names(other))
+    assert record_id in other_ids
+    # Both stub datasets have the same ids; the hook only concerns the first.
+    assert post('/hooks/%s/' % alias, [{'event': 'after_delete', 'module': 'Accounts',
+                                        'id': record_id}]).status_code == 200
+    assert record_id not in replica_names(tenants[0])
+    assert set(replica_names(other)) == other_ids
+
+
+def test_invalidates_reports_of_the_tenant(tenants):
+    (alias, server, replica), (other_alias, other_server, other_replica) = tenants
+    for tenant_alias in (alias, other_alias):
+        reports._cache.set((connections.get_url(tenant_alias), 'report', ()), 'table')
+    connections.close(alias)
+    assert post('/hooks/%s/' % alias, {'event': 'after_save', 'module': 'Accounts',
+                                       'id': 'x'}).status_code == 200
+    assert reports._cache.get((server.url, 'report', ())) is None
+    assert reports._cache.get((other_server.url, 'report', ())) == 'table'
+
+
+def test_tenant_secrets():
+    aliases = ['tenant-%s' % uuid.uuid4().hex[:8] for _ in range(2)]
+    for alias in aliases:
+        register_connection(alias, 'http://%s.example.com/' % alias, 'admin', 'admin',
+                            webhook_secret='secret of %s' % alias)
+    event = {'event': 'after_save', 'module': 'Accounts', 'id': 'x'}
+    first, second = aliases
+    assert post('/hooks/%s/' % first, event, 'secret of %s' % first).status_code == 200
+    # Neither another tenant's secret nor the global one is accepted.
+    assert post('/hooks/%s/' % first, event, 'secret of %s' % second).status_code == 403
+    assert post('/hooks/%s/' % first, event).status_code == 403
+    # Aliases without their own secret use the global one.
+    assert post('/hooks/default/', event).status_code == 200
+    assert connections.get_webhook_secret('default') == SECRET
@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+from sugarcrm import sugarquerylist
+from sugarcrm.sugarentry import Account
+
+
+@pytest.fixture
+def queryset(connection):
+    return Account(connection).objects.all()
+
+
+@pytest.fixture
+def ids(connection):
+    result = connection.get_entry_list('Accounts', '', '', 0, ['id'], [], 1000, 0)
+    return [entry['id'] for entry in result['entry_list']]
+
+
+def wait_for_calls(server, expected, timeout=5):
+    deadline = time.time() + timeout
+    while server.calls['get_entry_list'] < expected and time.time() < deadline:
+        time.sleep(0.01)
+    return server.calls['get_entry_list']
+
+
+def test_sequential_indexing(server, queryset, ids):
+    server.reset_stats()
+    assert [queryset[i]['id'] for i in range(len(ids))] == ids
+    # 50 entries: pages 0 to 2, the later ones prefetched.
+    assert server.calls['get_entry_list'] == 3
+    with pytest.raises(IndexError):
+        queryset[len(ids)]
+    assert server.calls['get_entry_list'] == 3
+
+
+def test_overlapping_slices(server, queryset, ids):
+    server.reset_stats()
+    assert [e['id'] for e in queryset[0:10]] == ids[0:10]
+    assert [e['id'] for e in queryset[5:15]] == ids[5:15]
+    assert [e['id'] for e in queryset[2:12:3]] == ids[2:12:3]
+    assert server.calls['get_entry_list'] == 1
+
+
+def test_missing_pages_are_fetched_by_runs(server, queryset, ids):
+    queryset[3]
+    queryset[45]
+    server.reset_stats()
+    assert [e['id'] for e in queryset[0:50]] == ids
+    assert server.calls['get_entry_list'] == 1
+
+
+def test_next_page_is_prefetched(server, queryset, ids):
+    queryset[0:20]
+    server.reset_stats()
+    assert [e['id'] for e in queryset[20:40]] == ids[20:40]
+    assert wait_for_calls(server, 2) == 2
+    assert [e['id'] for e in queryset[40:60]] == ids[40:]
+    assert server.calls['get_entry_list'] == 2
+
+
+def test_random_access_is_not_prefetched(server, queryset):
+    queryset[0:5]
+    server.reset_stats()
+    queryset[30:35]
+    time.sleep(0.2)
+    assert server.calls['get_entry_list'] == 1
+
+
+def test_without_window(server, queryset, ids, monkeypatch):
+    monkeypatch.setattr(sugarquerylist, 'QUERY_WINDOW_SIZE', 0)
+    server.reset_stats()
+    assert [queryset[i]['id'] for i in range(3)] == ids[:3]
+    assert [e['id'] for e in queryset[3:6]] == ids[3:6]
+    assert server.calls['get_entry_list'] == 4
@@ -0,0 +1,156 @@
+import threading
+import time
+
+import pytest
+
+from sugarcrm.sugarentry import Account
+from sugarcrm.writebehind import MemoryBackend, SQLiteBackend, WriteBehindQueue
+
+
+def record_batches(connection, batches=None):
+    """Replace set_entries by a wrapper listing the names of each batch."""
+    batches = [] if batches is None else batches
+    set_entries = connection.set_entries
+
+    def wrapper(module_name, name_value_lists):
+        batches.append([dict((nv['name'], nv['value']) for nv in nvl).get('name')
+                        for nvl in name_value_lists])
+        return set_entries(module_name, name_value_lists)
+    connection.set_entries = wrapper
+    return batches
+
+
+def test_memory_backend_merges_writes():
+    backend = MemoryBackend()
+    backend.put('Accounts', 'a', {'name': 'x'}, True)
+    backend.put('Accounts', 'b', {'name': 'y'}, False)
+    backend.put('Accounts', 'a', {'description': 'z'}, False)
+    assert len(backend) == 2
+    # A record written again moves after the records written since.
+    assert backend.take(10) == [('Accounts', 'b', False, {'name': 'y'}),
+                                ('Accounts', 'a', True, {'name': 'x', 'description': 'z'})]
+    assert len(backend) == 0
+
+
+def test_write_queue_is_created_once(connection):
+    queues = []
+    threads = [threading.Thread(target=lambda: queues.append(connection.get_write_queue()))
+               for _ in range(8)]
+    # Schema fetches hold another lock.
+    with connection._schemas_lock:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        assert len(queues) == 8
+    assert len(set(map(id, queues))) == 1
+
+
+def test_saves_are_coalesced(server, connection):
+    account = Account(connection).objects.all()[0]
+    server.reset_stats()
+    for i in range(5):
+        account.name = 'Name %d' % i
+        account.description = 'Description %d' % i
+        account.save(write_behind=True)
+    assert connection.flush(5)
+    assert server.calls['set_entries'] == 1
+    assert server.calls['set_entry'] == 0
+    stored = server.dataset.records['Accounts'][account['id']]
+    assert (stored['name'], stored['description']) == ('Name 4', 'Description 4')
+
+
+def test_new_entries_get_their_id_client_side(server, connection):
+    account = Account(connection)
+    account.name = 'Created behind'
+    account.save(write_behind=True)
+    assert account['id']
+    account.description = 'Then updated'
+    account.save(write_behind=True)
+    assert connection.flush(5)
+    stored = server.dataset.records['Accounts'][account['id']]
+    assert (stored['name'], stored['description']) == ('Created behind', 'Then updated')
+
+
+def test_writes_are_sent_in_order(connection):
+    batches = record_batches(connection)
+    queue = WriteBehindQueue(connection, delay=0.05, batch_size=3)
+    ids = [account['id'] for account in Account(connection).objects.all()[:10]]
+    for i, record_id in enumerate(ids):
+        queue.put('Accounts', record_id, {'name': 'n%02d' % i})
+    assert queue.flush(5)
+    assert [name for batch in batches for name in batch] == ['n%02d' % i for i in range(10)]
+    assert all(len(batch) <= 3 for batch in batches)
+
+
+def test_failed_writes_are_kept(connection):
+    def fail(*args):
+        raise IOError('down')
+    connection.set_entries = fail
+    queue = WriteBehindQueue(connection, delay=0, retries=1, backoff=0)
+    queue.put('Accounts', 'some-id', {'name': 'lost'})
+    assert queue.flush(5)
+    assert queue.failed == [('Accounts', 'some-id', False, {'name': 'lost'})]
+
+
+def test_flush_timeout(connection):
+    release = threading.Event()
+    set_entries = connection.set_entries
+
+    def slow(*args):
+        release.wait(5)
+        return set_entries(*args)
+    connection.set_entries = slow
+    queue = WriteBehindQueue(connection, delay=0)
+    queue.put('Accounts', Account(connection).objects.all()[0]['id'], {'name': 'slow'})
+    start = time.time()
+    assert not queue.flush(0.2)
+    assert time.time() - start < 2
+    release.set()
+    assert queue.flush(5)
+
+
+def test_sqlite_backend_survives_restarts(tmp_path, server):
+    path = str(tmp_path / 'queue.sqlite3')
+    backend = SQLiteBackend(path, server.url)
+    backend.put('Accounts', 'a', {'name': 'x'}, True)
+    backend.put('Accounts', 'a', {'description': 'y'}, False)
+    reopened = SQLiteBackend(path, server.url)
+    assert len(reopened) == 1
+    assert len(SQLiteBackend(path, 'another queue')) == 0
+    assert reopened.take(10) == [('Accounts', 'a', True, {'name': 'x', 'description': 'y'})]
+
+
+def test_sqlite_lease_is_exclusive(tmp_path):
+    path = str(tmp_path / 'queue.sqlite3')
+    first, second = SQLiteBackend(path, 'q'), SQLiteBackend(path, 'q')
+    assert first.acquire('first', 60)
+    assert not second.acquire('second', 60)
+    # Renewed by its holder.
+    assert first.acquire('first', 60)
+    first.release('first')
+    assert second.acquire('second', 60)
+    # Taken over once expired.
+    assert second.acquire('second', -1)
+    assert first.acquire('first', 60)
+
+
+@pytest.mark.parametrize('puts_per_queue', [1, 5])
+def test_shared_queue_keeps_order(tmp_path, server, puts_per_queue):
+    """Queues of several processes sharing a database send its writes in
+    the order they were queued, one sender at a time.
+    """
+    path = str(tmp_path / 'queue.sqlite3')
+    connections = [server.connect(), server.connect()]
+    batches = []
+    for connection in connections:
+        record_batches(connection, batches)
+    queues = [WriteBehindQueue(c, SQLiteBackend(path, server.url), delay=0.05, batch_size=3)
+              for c in connections]
+    for queue in queues:
+        queue.lease_poll = 0.05
+    ids = [account['id'] for account in Account(connections[0]).objects.all()[:10]]
+    for i, record_id in enumerate(ids):
+        queues[i // puts_per_queue % 2].put('Accounts', record_id, {'name': 'n%02d' % i})
+    assert all(queue.flush(10) for queue in queues)
+    assert [name for batch in batches for name in batch] == ['n%02d' % i for i in range(10)]